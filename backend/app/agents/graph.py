@@ -0,0 +1,364 @@
+"""
+Граф общения агентов.
+
+Ребро source -> target - сколько раз source ответил target в чате. Рёбра
+копятся по мере ответов (record) и сразу пишутся в agent_interactions с
+номером изменения (seq, счётчик EDGES_KEY); другие воркеры подтягивают
+строки новее виденного номера. Удаление агента поднимает RESET_KEY - по
+нему воркеры перечитывают рёбра целиком.
+
+Раскладку (force-directed, networkx.spring_layout) и метрики узлов считает
+один воркер - держатель аренды, и только если граф изменился. Старт тёплый:
+от прошлых позиций, новый агент появляется рядом со своими собеседниками,
+поэтому картинка не прыгает. Результат лежит в graph_layout, а /graph
+отдаёт готовый снимок - без SQL и без пересчёта на каждый опрос.
+"""
+
+import math
+import random
+import threading
+import time
+from typing import Dict, Tuple
+
+import networkx as nx
+
+from ..config import config
+from ..db.database import db
+from ..logger import get_logger
+from ..shared_state import shared_state
+from ..versions import versions
+from .registry import agent_registry
+
+logger = get_logger(__name__)
+
+LAYOUT_LEASE = "interaction_graph"
+# Счётчики (общие для воркеров): записанные раскладки, изменения рёбер, удаления
+LAYOUT_KEY = "graph_layout"
+EDGES_KEY = "graph_edges_seq"
+RESET_KEY = "graph_edges_reset"
+
+# Итерации spring_layout: с нуля и от прошлых позиций
+COLD_ITERATIONS = 50
+WARM_ITERATIONS = 15
+LAYOUT_SEED = 42
+# Разброс нового узла вокруг его собеседников
+PLACE_JITTER = 0.05
+# Какую долю пути к новой раскладке проходит уже стоявший узел: spring_layout
+# каждый раз стартует "горячим" и без затухания сдвигает весь граф
+LAYOUT_DAMPING = 0.3
+
+
+class InteractionGraph:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+        self._edges: Dict[Tuple[str, str], int] = {}  # (source, target) -> сколько раз ответил
+        self._edges_seen = 0  # seq, до которого рёбра подтянуты из БД
+        self._reset_seen = -1  # RESET_KEY, после которого рёбра перечитаны целиком
+        self._layout: Dict[str, dict] = {}  # agent_id -> {x, y, degree, strength, community}
+        self._layout_seen = -1  # LAYOUT_KEY, с которым сверена _layout
+        self._laid_out = frozenset()  # агенты последней раскладки
+        self._dirty = True  # рёбра менялись после последней раскладки
+        self._generation = 0  # локальный номер изменения - ключ снимка
+
+        self._snapshot = None
+        self._snapshot_key = None
+        self.stats = {"records": 0, "layouts": 0, "last_layout_ms": 0.0}
+
+        self._stop = threading.Event()
+        self._worker = None
+        self._load_edges()
+        self._load_layout()
+        shared_state.subscribe(self._on_shared_change)
+
+    # --- загрузка из БД ---
+
+    def _load_edges(self):
+        """Подтянуть рёбра, изменённые с прошлого раза (свои и чужие); после удалений - все"""
+        reset = shared_state.get(RESET_KEY)
+        full = reset != self._reset_seen
+        try:
+            if full:
+                rows = db.fetch_all("SELECT source, target, weight, seq FROM agent_interactions")
+            else:
+                rows = db.fetch_all(
+                    "SELECT source, target, weight, seq FROM agent_interactions WHERE seq > ?", (self._edges_seen,)
+                )
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить граф общения: {e}")
+            return
+
+        with self._lock:
+            edges = {} if full else self._edges
+            changed = full
+            for row in rows:
+                pair = (row["source"], row["target"])
+                if edges.get(pair) != row["weight"]:
+                    edges[pair] = row["weight"]
+                    changed = True
+            if full:
+                self._edges = edges
+                self._reset_seen = reset
+            if changed:
+                self._dirty = True
+                self._generation += 1
+            self._edges_seen = max([self._edges_seen] + [row["seq"] for row in rows])
+
+    def _load_layout(self):
+        """Перечитать раскладку, записанную держателем аренды"""
+        seen = shared_state.get(LAYOUT_KEY)
+        try:
+            rows = db.fetch_all("SELECT agent_id, x, y, degree, strength, community FROM graph_layout")
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить раскладку графа: {e}")
+            return
+
+        with self._lock:
+            self._layout = {row["agent_id"]: row for row in rows}
+            self._layout_seen = seen
+            self._generation += 1
+
+    def _on_shared_change(self):
+        if shared_state.get(LAYOUT_KEY) != self._layout_seen:
+            self._load_layout()
+        if (shared_state.get(EDGES_KEY) != self._edges_seen
+                or shared_state.get(RESET_KEY) != self._reset_seen):
+            self._load_edges()
+
+    # --- изменения ---
+
+    def record(self, source: str, target: str):
+        """source ответил target: +1 к весу ребра"""
+        if source == target:
+            return
+        try:
+            with db.transaction() as conn:
+                # Номер берётся первой записью транзакции: порядок номеров = порядок коммитов
+                seq = shared_state.incr(EDGES_KEY, conn)
+                weight = conn.execute(
+                    "INSERT INTO agent_interactions (source, target, weight, last_at, seq) VALUES (?, ?, 1, ?, ?) "
+                    "ON CONFLICT(source, target) DO UPDATE SET "
+                    "weight = weight + 1, last_at = excluded.last_at, seq = excluded.seq "
+                    "RETURNING weight",
+                    (source, target, time.time(), seq)
+                ).fetchone()[0]
+        except Exception as e:
+            logger.error(f"❌ Ребро графа {source} -> {target} не записано: {e}")
+            return
+
+        with self._lock:
+            self._edges[(source, target)] = weight
+            self._dirty = True
+            self._generation += 1
+        self.stats["records"] += 1
+        versions.bump("graph")
+
+    def remove(self, agent_id: str):
+        """Убрать агента из графа (другие воркеры перечитают рёбра по RESET_KEY)"""
+        reset = None
+        try:
+            with db.transaction() as conn:
+                conn.execute("DELETE FROM agent_interactions WHERE source = ? OR target = ?", (agent_id, agent_id))
+                conn.execute("DELETE FROM graph_layout WHERE agent_id = ?", (agent_id,))
+                reset = shared_state.incr(RESET_KEY, conn)
+        except Exception as e:
+            logger.error(f"❌ Агент {agent_id} не удалён из графа: {e}")
+
+        with self._lock:
+            self._edges = {pair: w for pair, w in self._edges.items() if agent_id not in pair}
+            if reset is not None and self._reset_seen == reset - 1:
+                # Кроме нас никто не удалял - перечитывать незачем
+                self._reset_seen = reset
+            self._dirty = True
+            self._generation += 1
+        versions.bump("graph")
+
+    # --- раскладка (держатель аренды) ---
+
+    def relayout(self):
+        """Пересчитать раскладку и метрики, если изменились рёбра или набор агентов"""
+        nodes = {agent["id"] for agent in agent_registry.all()}
+        with self._lock:
+            if not self._dirty and nodes == self._laid_out:
+                return
+            edges = {pair: w for pair, w in self._edges.items() if pair[0] in nodes and pair[1] in nodes}
+            previous = {a: (row["x"], row["y"]) for a, row in self._layout.items() if a in nodes}
+            self._dirty = False
+
+        started = time.perf_counter()
+        graph = self._build(nodes, edges)
+        positions = self._layout_positions(graph, previous)
+        community = self._communities(graph)
+        rows = [
+            (node, round(float(x), 4), round(float(y), 4), graph.degree(node),
+             graph.degree(node, weight="count"), community.get(node, -1))
+            for node, (x, y) in positions.items()
+        ]
+
+        try:
+            with db.transaction() as conn:
+                conn.execute("DELETE FROM graph_layout")
+                conn.executemany(
+                    "INSERT INTO graph_layout (agent_id, x, y, degree, strength, community) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+            seen = shared_state.incr(LAYOUT_KEY)
+        except Exception as e:
+            logger.error(f"❌ Раскладка графа не записана: {e}")
+            self._dirty = True
+            return
+
+        columns = ("agent_id", "x", "y", "degree", "strength", "community")
+        with self._lock:
+            self._layout = {row[0]: dict(zip(columns, row)) for row in rows}
+            self._layout_seen = seen
+            self._laid_out = frozenset(nodes)
+            self._generation += 1
+        versions.bump("graph")
+
+        self.stats["layouts"] += 1
+        self.stats["last_layout_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        logger.debug(f"🕸️ Раскладка графа: {len(nodes)} узлов, {graph.number_of_edges()} рёбер")
+
+    @staticmethod
+    def _build(nodes, edges) -> nx.Graph:
+        """Неориентированный граф: count - ответы в обе стороны, weight - сжатый для раскладки"""
+        graph = nx.Graph()
+        graph.add_nodes_from(sorted(nodes))  # один порядок - одна раскладка при том же seed
+        for (source, target), count in sorted(edges.items()):
+            if graph.has_edge(source, target):
+                graph[source][target]["count"] += count
+            else:
+                graph.add_edge(source, target, count=count)
+        for _, _, data in graph.edges(data=True):
+            # Логарифм: самые болтливые пары не стягиваются в точку
+            data["weight"] = 1 + math.log(data["count"])
+        return graph
+
+    def _layout_positions(self, graph: nx.Graph, previous: Dict[str, tuple]) -> Dict[str, tuple]:
+        start = dict(previous)
+        for node in graph:
+            if node not in start:
+                start[node] = self._place(node, [start[n] for n in graph[node] if n in start])
+        if len(graph) < 2:
+            return start
+
+        # От 500 узлов networkx считает раскладку через scipy - он в requirements.txt
+        positions = nx.spring_layout(
+            graph, pos=start, iterations=WARM_ITERATIONS if previous else COLD_ITERATIONS,
+            weight="weight", seed=LAYOUT_SEED
+        )
+
+        for node, (x, y) in previous.items():
+            new_x, new_y = positions[node]
+            positions[node] = (x + (new_x - x) * LAYOUT_DAMPING, y + (new_y - y) * LAYOUT_DAMPING)
+        return positions
+
+    @staticmethod
+    def _place(node: str, neighbours) -> tuple:
+        """Начальная позиция нового узла: у собеседников, иначе - случайная, но одна во всех воркерах"""
+        rng = random.Random(node)
+        if not neighbours:
+            return rng.uniform(-1, 1), rng.uniform(-1, 1)
+        x = sum(p[0] for p in neighbours) / len(neighbours)
+        y = sum(p[1] for p in neighbours) / len(neighbours)
+        return x + rng.uniform(-PLACE_JITTER, PLACE_JITTER), y + rng.uniform(-PLACE_JITTER, PLACE_JITTER)
+
+    @staticmethod
+    def _communities(graph: nx.Graph) -> Dict[str, int]:
+        """Сообщества (Louvain) - номер по убыванию размера; одиночки без связей - -1"""
+        if not graph.number_of_edges():
+            return {}
+        communities = nx.community.louvain_communities(graph, weight="count", seed=LAYOUT_SEED)
+        result = {}
+        for i, members in enumerate(sorted((c for c in communities if len(c) > 1), key=len, reverse=True)):
+            for node in members:
+                result[node] = i
+        return result
+
+    # --- чтение ---
+
+    def snapshot(self) -> dict:
+        """Узлы с позициями и метриками, рёбра и сводка; пересобирается только после изменений"""
+        key = (agent_registry.version, self._generation)
+        if key == self._snapshot_key:
+            return self._snapshot
+
+        with self._lock:
+            layout = self._layout
+            edges = dict(self._edges)
+
+        nodes = []
+        for agent in agent_registry.all():
+            place = layout.get(agent["id"])
+            if place is None:
+                # Ещё не в раскладке - временно на своём месте по умолчанию
+                x, y = self._place(agent["id"], [])
+                place = {"x": round(x, 4), "y": round(y, 4), "degree": 0, "strength": 0, "community": -1}
+            nodes.append({
+                "id": agent["id"],
+                "name": agent["name"],
+                "location": agent["location"],
+                "x": place["x"],
+                "y": place["y"],
+                "degree": place["degree"],
+                "strength": place["strength"],
+                "community": place["community"],
+            })
+
+        known = {node["id"] for node in nodes}
+        pairs: Dict[Tuple[str, str], int] = {}
+        for (source, target), count in edges.items():
+            if source in known and target in known:
+                pair = (source, target) if source < target else (target, source)
+                pairs[pair] = pairs.get(pair, 0) + count
+
+        n = len(nodes)
+        self._snapshot = {
+            "nodes": nodes,
+            "edges": [{"source": a, "target": b, "weight": w} for (a, b), w in pairs.items()],
+            "metrics": {
+                "nodes": n,
+                "edges": len(pairs),
+                "interactions": sum(pairs.values()),
+                "density": round(2 * len(pairs) / (n * (n - 1)), 4) if n > 1 else 0.0,
+                "communities": len({node["community"] for node in nodes if node["community"] >= 0}),
+            },
+        }
+        self._snapshot_key = key
+        return self._snapshot
+
+    # --- фоновый поток ---
+
+    def start(self):
+        if self._worker is not None:
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._loop, name="interaction-graph", daemon=True)
+        self._worker.start()
+
+    def close(self):
+        if self._worker is None:
+            return
+        self._stop.set()
+        self._worker.join()
+        self._worker = None
+        try:
+            shared_state.release_lease(LAYOUT_LEASE)
+        except Exception as e:
+            logger.error(f"❌ Аренда раскладки графа не отдана: {e}")
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if shared_state.acquire_lease(LAYOUT_LEASE, self.interval * 3):
+                    self.relayout()
+            except Exception as e:
+                logger.error(f"❌ Ошибка раскладки графа: {e}")
+
+    def metrics(self) -> dict:
+        return {"edges": len(self._edges), "laid_out": len(self._layout), **self.stats}
+
+
+interaction_graph = InteractionGraph(interval=config.GRAPH_LAYOUT_INTERVAL)
@@ -3,6 +3,9 @@ from typing import Optional, List
 from datetime import datetime
 import uuid
 
+# Комната по умолчанию - локация новых агентов
+DEFAULT_ROOM = "общая зона"
+
 
 class Emotion(BaseModel):
     pleasure: float = 0.5
@@ -21,7 +24,7 @@ class Agent(BaseModel):
     name: str
     personality: str = "дружелюбный"
     mood: float = 0.5
-    location: str = "общая зона"
+    location: str = DEFAULT_ROOM
     goal: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.now)
 
@@ -0,0 +1,135 @@
+"""
+Реестр агентов в памяти процесса.
+
+Метаданные агентов (имя, характер, локация) читаются из SQLite один раз,
+дальше горячие пути (чат, фоновые ходы, статус) берут их отсюда: индексы
+по id, по имени и по комнате. Все изменения набора агентов идут через
+реестр (write-through): сначала SQLite, потом индексы. Индексы не правятся
+на месте - собираются заново и подменяются разом, так что читатели без
+блокировки видят либо старый, либо новый набор. Другие воркеры замечают
+изменение по счётчику в shared_state и перечитывают таблицу.
+
+Настроение здесь не хранится - оно живёт в agent_state.
+"""
+
+import threading
+from typing import Dict, List, Optional
+
+from ..db.database import db
+from ..logger import get_logger
+from ..shared_state import shared_state
+from .models import DEFAULT_ROOM, Agent
+
+logger = get_logger(__name__)
+
+# Счётчик изменений набора агентов (общий для воркеров)
+REGISTRY_KEY = "agents_registry"
+
+# mood сюда не входит: оно меняется в agent_state, копия здесь бы устаревала
+FIELDS = ("id", "name", "personality", "location", "created_at")
+
+
+class AgentRegistry:
+    def __init__(self):
+        self._by_id: Dict[str, dict] = {}
+        self._by_name: Dict[str, List[dict]] = {}  # имена не уникальны
+        self._by_room: Dict[str, Dict[str, dict]] = {}
+        self._ordered: List[dict] = []  # новые первыми, как отдаёт /agents
+        self._lock = threading.Lock()
+        self._seen = 0
+        self.reload()
+        shared_state.subscribe(self.refresh)
+
+    def reload(self):
+        """Перечитать всех агентов из SQLite и перестроить индексы"""
+        try:
+            seen = shared_state.get(REGISTRY_KEY)
+            rows = db.fetch_all(f"SELECT {', '.join(FIELDS)} FROM agents")
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить агентов: {e}")
+            return
+
+        with self._lock:
+            self._reindex({row["id"]: row for row in rows})
+            self._seen = seen
+        logger.info(f"👥 Реестр агентов: {len(rows)}")
+
+    def refresh(self):
+        """Перечитать, если набор агентов менял другой воркер"""
+        if shared_state.get(REGISTRY_KEY) != self._seen:
+            self.reload()
+
+    def _reindex(self, by_id: Dict[str, dict]):
+        """Собрать индексы по новому словарю агентов и подменить все разом (под self._lock)"""
+        by_name, by_room = {}, {}
+        for agent in by_id.values():
+            by_name.setdefault(agent["name"], []).append(agent)
+            # NULL в старых строках - та же комната, что у _room_of в чате
+            by_room.setdefault(agent["location"] or DEFAULT_ROOM, {})[agent["id"]] = agent
+        ordered = sorted(by_id.values(), key=lambda a: a["created_at"] or 0, reverse=True)
+        self._by_id, self._by_name, self._by_room, self._ordered = by_id, by_name, by_room, ordered
+
+    def _changed(self):
+        """Отметить изменение для других воркеров (своя копия уже актуальна)"""
+        try:
+            self._seen = shared_state.incr(REGISTRY_KEY)
+        except Exception as e:
+            logger.error(f"❌ Изменение реестра агентов не опубликовано: {e}")
+
+    # --- чтение (словари общие - не изменять) ---
+
+    def get(self, agent_id: str) -> Optional[dict]:
+        return self._by_id.get(agent_id)
+
+    def by_name(self, name: str) -> List[dict]:
+        return list(self._by_name.get(name, ()))
+
+    def in_room(self, room: str) -> List[dict]:
+        return list(self._by_room.get(room, {}).values())
+
+    def all(self) -> List[dict]:
+        return list(self._ordered)
+
+    def room_sizes(self) -> Dict[str, int]:
+        return {room: len(agents) for room, agents in self._by_room.items()}
+
+    @property
+    def version(self) -> int:
+        """Номер последнего известного изменения набора агентов"""
+        return self._seen
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    # --- запись: SQLite, затем индексы ---
+
+    def create(self, agent: Agent) -> dict:
+        row = {field: getattr(agent, field) for field in FIELDS}
+        row["created_at"] = agent.created_at.timestamp()
+        db.execute(
+            f"INSERT INTO agents ({', '.join(FIELDS)}, mood) VALUES ({', '.join('?' * (len(FIELDS) + 1))})",
+            (*(row[field] for field in FIELDS), agent.mood)
+        )
+        with self._lock:
+            self._reindex({**self._by_id, row["id"]: row})
+        self._changed()
+        return row
+
+    def move(self, agent_id: str, location: str):
+        db.execute("UPDATE agents SET location = ? WHERE id = ?", (location, agent_id))
+        with self._lock:
+            agent = self._by_id.get(agent_id)
+            if agent is not None:
+                # Новый словарь: старый могут читать в этот момент
+                self._reindex({**self._by_id, agent_id: {**agent, "location": location}})
+        self._changed()
+
+    def delete(self, agent_id: str):
+        db.execute("DELETE FROM agents WHERE id = ?", (agent_id,))
+        with self._lock:
+            if agent_id in self._by_id:
+                self._reindex({a: row for a, row in self._by_id.items() if a != agent_id})
+        self._changed()
+
+
+agent_registry = AgentRegistry()
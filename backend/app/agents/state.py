@@ -0,0 +1,351 @@
+"""
+Эмоциональное состояние всех агентов - колоночная таблица на NumPy.
+
+Каждая величина (mood, pleasure, arousal) - строка массива _state, агент -
+столбец. События, затухание и заражение настроением считаются одной
+векторной операцией на всё население, без цикла по агентам и без SQL.
+
+- pleasure / arousal - быстрое состояние (модель PAD): события толкают их,
+  со временем они возвращаются к базовому уровню.
+- mood - медленное настроение: сдвигается событиями и тянется к pleasure.
+- Заражение: в каждой комнате (локации) pleasure и arousal тянутся к
+  среднему по комнате, возбуждённые агенты заражаются быстрее.
+
+Изменённые столбцы пишутся в SQLite пачкой раз в AGENT_STATE_TICK секунд
+(write-behind) - дельтами, а не значениями, чтобы воркеры не затирали
+изменения друг друга. Затухание и заражение считает один воркер - держатель
+аренды. Каждая запись получает номер (счётчик STATE_KEY в shared_state,
+он же agents.state_seq), и другие воркеры подтягивают только строки новее
+уже виденного номера. Набор агентов сверяется по version:agents, а ETag
+настроения (version:moods) меняется, только когда сдвиг заметен.
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from ..config import config
+from ..db.database import db
+from ..logger import get_logger
+from ..shared_state import shared_state
+from ..versions import versions
+from .models import Emotion
+
+logger = get_logger(__name__)
+
+MOOD, PLEASURE, AROUSAL = 0, 1, 2
+COLUMNS = ("mood", "pleasure", "arousal")
+
+# К чему возвращается состояние без событий
+BASELINE = np.array([0.5, 0.5, 0.3])
+# Постоянные времени, секунды: pleasure/arousal - к базе, mood - к pleasure
+PLEASURE_TAU = 3600.0
+AROUSAL_TAU = 600.0
+MOOD_TAU = 6 * 3600.0
+# Постоянная времени заражения настроением комнаты при arousal=1, секунды
+CONTAGION_TAU = 900.0
+
+# Изменения меньше этого в БД не пишем (затухание копится до порога)
+WRITE_EPSILON = 0.005
+# Сдвиг, после которого меняется ETag настроения (version:moods)
+PUBLISH_EPSILON = 0.02
+
+STATE_LEASE = "agent_state"
+# Номер последней записи состояния (общий для воркеров)
+STATE_KEY = "agent_state_seq"
+
+# Сдвиг от одного сообщения/события: среднее и разброс (как раньше: -0.1..+0.2)
+STIMULUS_PLEASURE = 0.05
+STIMULUS_AROUSAL = 0.15
+STIMULUS_JITTER = 0.15
+
+
+class AgentStateTable:
+    def __init__(self, tick: float):
+        self.tick = tick
+        self._rng = np.random.default_rng()
+        self._lock = threading.Lock()
+
+        self._ids: List[str] = []
+        self._index: Dict[str, int] = {}  # agent_id -> столбец
+        self._rooms: Dict[str, int] = {}  # локация -> номер комнаты
+        self._room = np.zeros(0, dtype=np.int64)  # номер комнаты каждого агента
+        self._state = np.zeros((3, 0))
+        self._saved = np.zeros((3, 0))  # что уже лежит в SQLite
+        self._published = np.zeros((3, 0))  # состояние на момент последнего version:moods
+
+        self._seen_version = -1  # version:agents, с которой таблица сверена с БД
+        self._seen_seq = 0  # номер последней подтянутой записи состояния
+        self._last_step = time.monotonic()
+        self.stats = {"steps": 0, "last_step_us": 0.0, "rows_written": 0, "flushes": 0}
+
+        self._stop = threading.Event()
+        self._worker = None
+        self.reload()
+        shared_state.subscribe(self._on_shared_change)
+
+    # --- загрузка и сверка с БД ---
+
+    @staticmethod
+    def _stored(rows) -> np.ndarray:
+        stored = np.array(
+            [[row["mood"], row["pleasure"], row["arousal"]] for row in rows], dtype=float
+        ).reshape(-1, 3).T
+        return np.where(np.isnan(stored), BASELINE[:, None], stored)
+
+    def reload(self):
+        """Перечитать агентов из SQLite; несохранённые локальные изменения не теряются"""
+        version = versions.get("agents")
+        try:
+            rows = db.fetch_all("SELECT id, location, mood, pleasure, arousal, state_seq FROM agents")
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить состояние агентов: {e}")
+            return
+
+        stored = self._stored(rows)
+
+        with self._lock:
+            old_index, old_state, old_saved = self._index, self._state, self._saved
+            ids = [row["id"] for row in rows]
+            rooms = {}
+            room = np.array(
+                [rooms.setdefault(row["location"] or "", len(rooms)) for row in rows], dtype=np.int64
+            )
+
+            state, saved = stored.copy(), stored.copy()
+            # Изменения, сделанные здесь и ещё не записанные, - поверх значений из БД
+            kept = [(i, old_index[agent_id]) for i, agent_id in enumerate(ids) if agent_id in old_index]
+            if kept:
+                new_cols, old_cols = map(np.array, zip(*kept))
+                state[:, new_cols] += old_state[:, old_cols] - old_saved[:, old_cols]
+                np.clip(state, 0.0, 1.0, out=state)
+
+            self._ids, self._index = ids, {agent_id: i for i, agent_id in enumerate(ids)}
+            self._rooms, self._room = rooms, room
+            self._state, self._saved, self._published = state, saved, state.copy()
+            self._seen_version = max(self._seen_version, version)
+            self._seen_seq = max([self._seen_seq] + [row["state_seq"] for row in rows])
+
+    def _load_changes(self):
+        """Подтянуть только строки, записанные после уже виденного номера"""
+        seen = self._seen_seq
+        try:
+            rows = db.fetch_all(
+                "SELECT id, mood, pleasure, arousal, state_seq FROM agents WHERE state_seq > ?", (seen,)
+            )
+        except Exception as e:
+            logger.error(f"❌ Не удалось подтянуть состояние агентов: {e}")
+            return
+        if not rows:
+            return
+
+        stored = self._stored(rows)
+        with self._lock:
+            for j, row in enumerate(rows):
+                col = self._index.get(row["id"])
+                if col is None:
+                    continue
+                # Своя незаписанная дельта остаётся поверх нового значения из БД
+                self._state[:, col] = np.clip(stored[:, j] + self._state[:, col] - self._saved[:, col], 0.0, 1.0)
+                self._saved[:, col] = stored[:, j]
+            self._seen_seq = max(self._seen_seq, max(row["state_seq"] for row in rows))
+
+    def _on_shared_change(self):
+        # Агентов добавили, удалили или перевели - перечитываем всё
+        if versions.get("agents") != self._seen_version:
+            self.reload()
+        # Кто-то (и мы сами) записал состояние - только изменённые строки
+        elif shared_state.get(STATE_KEY) != self._seen_seq:
+            self._load_changes()
+
+    # --- чтение ---
+
+    def get(self, agent_id: str) -> Optional[dict]:
+        with self._lock:
+            col = self._index.get(agent_id)
+            if col is None:
+                return None
+            values = self._state[:, col].copy()
+        return {name: round(float(values[i]), 4) for i, name in enumerate(COLUMNS)}
+
+    def overlay(self, rows: Iterable[dict]) -> List[dict]:
+        """Подставить в строки agents актуальные mood/pleasure/arousal и иконку эмоции"""
+        result = []
+        for row in rows:
+            row = dict(row)
+            # Агента, которого таблица ещё не подтянула, показываем с базовым состоянием
+            state = self.get(row["id"]) or dict(zip(COLUMNS, BASELINE.tolist()))
+            row.update(state)
+            row["emotion"] = Emotion(pleasure=state["pleasure"], arousal=state["arousal"]).get_icon()
+            result.append(row)
+        return result
+
+    # --- изменения ---
+
+    def _columns(self, agent_ids: Optional[Iterable[str]]) -> np.ndarray:
+        if agent_ids is None:
+            return np.arange(len(self._ids))
+        return np.array([self._index[a] for a in agent_ids if a in self._index], dtype=np.int64)
+
+    def stimulate(self, agent_ids: Optional[Iterable[str]] = None, pleasure: float = STIMULUS_PLEASURE,
+                  arousal: float = STIMULUS_AROUSAL, jitter: float = STIMULUS_JITTER) -> Dict[str, dict]:
+        """
+        Событие для агентов agent_ids (None - для всех): сдвиг pleasure и mood
+        на pleasure ± jitter (у каждого свой), arousal - на arousal.
+        Возвращает новое состояние затронутых агентов.
+        """
+        with self._lock:
+            cols = self._columns(agent_ids)
+            if not len(cols):
+                return {}
+            delta = pleasure + self._rng.uniform(-jitter, jitter, len(cols))
+            block = self._state[:, cols]  # копия столбцов (fancy indexing)
+            block[MOOD] += delta
+            block[PLEASURE] += delta
+            block[AROUSAL] += arousal
+            np.clip(block, 0.0, 1.0, out=block)
+            self._state[:, cols] = block
+            values = np.round(block, 4).T.tolist()
+            return {self._ids[col]: dict(zip(COLUMNS, row)) for col, row in zip(cols.tolist(), values)}
+
+    def step(self, dt: float):
+        """Затухание и заражение настроением за dt секунд - для всех агентов разом"""
+        started = time.perf_counter()
+        with self._lock:
+            if not self._ids:
+                return
+            state = self._state
+            # К базе: x = base + (x - base) * e^(-dt/tau)
+            state[PLEASURE] = BASELINE[PLEASURE] + (state[PLEASURE] - BASELINE[PLEASURE]) * np.exp(-dt / PLEASURE_TAU)
+            state[AROUSAL] = BASELINE[AROUSAL] + (state[AROUSAL] - BASELINE[AROUSAL]) * np.exp(-dt / AROUSAL_TAU)
+
+            # Заражение: среднее по комнате через bincount, скорость растёт с arousal
+            counts = np.bincount(self._room, minlength=len(self._rooms))
+            rate = (1 - np.exp(-dt / CONTAGION_TAU)) * state[AROUSAL]
+            for row in (PLEASURE, AROUSAL):
+                room_mean = np.bincount(self._room, weights=state[row], minlength=len(self._rooms)) / np.maximum(counts, 1)
+                state[row] += (room_mean[self._room] - state[row]) * rate
+
+            state[MOOD] += (state[PLEASURE] - state[MOOD]) * (1 - np.exp(-dt / MOOD_TAU))
+            np.clip(state, 0.0, 1.0, out=state)
+        self.stats["steps"] += 1
+        self.stats["last_step_us"] = round((time.perf_counter() - started) * 1e6, 1)
+
+    def add(self, agent_id: str, location: str, mood: float = BASELINE[MOOD]):
+        with self._lock:
+            if agent_id in self._index:
+                return
+            room = self._rooms.setdefault(location or "", len(self._rooms))
+            values = np.array([[mood], [BASELINE[PLEASURE]], [BASELINE[AROUSAL]]])
+            self._index[agent_id] = len(self._ids)
+            self._ids.append(agent_id)
+            self._room = np.append(self._room, room)
+            self._state = np.hstack([self._state, values])
+            self._saved = np.hstack([self._saved, values])
+            self._published = np.hstack([self._published, values])
+
+    def move(self, agent_id: str, location: str):
+        with self._lock:
+            col = self._index.get(agent_id)
+            if col is not None:
+                self._room[col] = self._rooms.setdefault(location or "", len(self._rooms))
+
+    def remove(self, agent_id: str):
+        with self._lock:
+            col = self._index.pop(agent_id, None)
+            if col is None:
+                return
+            self._ids.pop(col)
+            self._room = np.delete(self._room, col)
+            self._state = np.delete(self._state, col, axis=1)
+            self._saved = np.delete(self._saved, col, axis=1)
+            self._published = np.delete(self._published, col, axis=1)
+            self._index = {a: i for i, a in enumerate(self._ids)}
+
+    # --- запись в БД ---
+
+    def flush(self):
+        """Записать дельты изменённых столбцов одним executemany"""
+        with self._lock:
+            delta = self._state - self._saved
+            changed = np.flatnonzero(np.any(np.abs(delta) > WRITE_EPSILON, axis=0))
+            if not len(changed):
+                return
+            values = delta[:, changed]
+            ids = [self._ids[col] for col in changed]
+            self._saved[:, changed] += values
+
+        try:
+            with db.transaction() as conn:
+                # Номер берётся первой записью транзакции: порядок номеров = порядок коммитов
+                seq = shared_state.incr(STATE_KEY, conn)
+                conn.executemany(
+                    "UPDATE agents SET "
+                    "mood = MIN(1.0, MAX(0.0, COALESCE(mood, 0.5) + ?)), "
+                    "pleasure = MIN(1.0, MAX(0.0, COALESCE(pleasure, 0.5) + ?)), "
+                    "arousal = MIN(1.0, MAX(0.0, COALESCE(arousal, 0.3) + ?)), "
+                    "state_seq = ? WHERE id = ?",
+                    [
+                        (float(values[MOOD, j]), float(values[PLEASURE, j]), float(values[AROUSAL, j]), seq, agent_id)
+                        for j, agent_id in enumerate(ids)
+                    ]
+                )
+        except Exception as e:
+            logger.error(f"❌ Состояние агентов не записано ({len(ids)} шт.): {e}")
+            with self._lock:
+                # Пусть попадут в следующую пачку
+                for j, agent_id in enumerate(ids):
+                    col = self._index.get(agent_id)
+                    if col is not None:
+                        self._saved[:, col] -= values[:, j]
+            return
+
+        with self._lock:
+            publish = bool(self._state.size) and np.abs(self._state - self._published).max() > PUBLISH_EPSILON
+            if publish:
+                self._published = self._state.copy()
+        if publish:
+            versions.bump("moods")
+        self.stats["rows_written"] += len(ids)
+        self.stats["flushes"] += 1
+
+    # --- фоновый поток ---
+
+    def start(self):
+        if self._worker is not None:
+            return
+        self._stop.clear()
+        self._last_step = time.monotonic()
+        self._worker = threading.Thread(target=self._loop, name="agent-state", daemon=True)
+        self._worker.start()
+
+    def close(self):
+        """Остановить поток, отдать аренду и дописать остаток"""
+        if self._worker is not None:
+            self._stop.set()
+            self._worker.join()
+            self._worker = None
+            try:
+                shared_state.release_lease(STATE_LEASE)
+            except Exception as e:
+                logger.error(f"❌ Аренда состояния агентов не отдана: {e}")
+        self.flush()
+
+    def _loop(self):
+        while not self._stop.wait(self.tick):
+            try:
+                now = time.monotonic()
+                if shared_state.acquire_lease(STATE_LEASE, self.tick * 3):
+                    self.step(now - self._last_step)
+                self._last_step = now
+                self.flush()
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления состояния агентов: {e}")
+
+    def metrics(self) -> dict:
+        return {"agents": len(self._ids), "rooms": len(self._rooms), **self.stats}
+
+
+agent_state = AgentStateTable(tick=config.AGENT_STATE_TICK)
@@ -1,53 +1,95 @@
 import asyncio
+import json
 import random
 import uuid
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 
+from ..agents.graph import interaction_graph
 from ..agents.personalities import get_chat_response_prompt
-from ..db.database import db
+from ..agents.registry import agent_registry
+from ..chat.simulation import simulation
+from ..chat.store import DEFAULT_ROOM, ChatStore, chat_rooms
 from ..llm.mistral import llm
 from ..logger import get_logger
+from ..memory.prefetch import format_memories, memory_prefetch
 from ..memory.store import memory_store
+from ..shared_state import shared_state
+from ..versions import versions
 
 logger = get_logger(__name__)
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-# In-memory chat storage. Keeps the app simple and avoids changing DB schema.
-chat_messages: List[Dict] = []
-MAX_CHAT_HISTORY = 200
+# Each room (agent location) has its own ring buffer backed by an SQLite tail.
+MAX_CHAT_HISTORY = chat_rooms.capacity
 
-background_task_running = False
-background_task = None
+# How many reply generations may run in parallel for one message.
+REPLY_POOL_SIZE = 3
 
+# Keep-alive comment interval for /chat/stream, seconds.
+STREAM_KEEPALIVE = 15.0
 
-def _trim_chat_history() -> None:
-    """Keep only the last MAX_CHAT_HISTORY messages."""
-    if len(chat_messages) > MAX_CHAT_HISTORY:
-        chat_messages[:] = chat_messages[-MAX_CHAT_HISTORY:]
+# The background conversation runs in exactly one worker: the holder of this
+# lease. "background_enabled" in shared_state is the on/off switch for all workers.
+BACKGROUND_LEASE = "background_conversation"
+BACKGROUND_FLAG = "background_enabled"
+LEASE_TTL = 15.0
+LEASE_RENEW = 5.0
 
+background_task = None  # this worker's loop, if it is the leader
+supervisor_task = None
+_supervisor_wakeup = None
 
-def _append_message(message: Dict) -> Dict:
-    """Append a message to chat and trim old history."""
-    chat_messages.append(message)
-    _trim_chat_history()
+
+async def _append_message(room: str, message: Dict) -> Dict:
+    """Append a message to the room's store (old ones are evicted by the ring buffer).
+
+    The SQLite writes run in a pool thread, so the event loop never waits on the database.
+    """
+    return await asyncio.to_thread(_store_message, room, message)
+
+
+def _store_message(room: str, message: Dict) -> Dict:
+    """Blocking part of _append_message; an agent's reply to another agent also feeds the interaction graph."""
+    store = _open_room(room)
+    store.append(message)
+
+    replied = store.find(message["in_reply_to"]) if message.get("in_reply_to") else None
+    if replied and agent_registry.get(message.get("agent_id")) and agent_registry.get(replied.get("agent_id")):
+        interaction_graph.record(message["agent_id"], replied["agent_id"])
     return message
 
 
-def _build_recent_context(limit: int = 8, exclude_last: bool = False) -> str:
-    """Build readable context for prompts from recent chat messages."""
-    if not chat_messages:
-        return ""
+def _open_room(room: str) -> ChatStore:
+    """The room's store; rooms without agents or messages do not exist (404)."""
+    store = chat_rooms.get(room)
+    if store is None:
+        raise HTTPException(status_code=404, detail="Room not found")
+    return store
+
+
+def _room_of(agent: Dict) -> str:
+    return agent.get("location") or DEFAULT_ROOM
 
-    messages = chat_messages[:-1] if exclude_last else chat_messages
-    recent = messages[-limit:]
+
+def _latest(room: str, limit: int) -> List[Dict]:
+    store = chat_rooms.get(room)
+    return store.latest(limit) if store else []
+
+
+def _build_recent_context(room: str, limit: int = 8, exclude_last: bool = False) -> str:
+    """Build readable context for prompts from recent messages of the room."""
+    recent = _latest(room, limit + 1 if exclude_last else limit)
+    if exclude_last:
+        recent = recent[:-1]
     if not recent:
         return ""
 
-    lines = ["Недавние сообщения в общем чате:"]
+    lines = [f"Недавние сообщения в чате ({room}):"]
     for msg in recent:
         name = msg.get("agent_name", "Кто-то")
         text = msg.get("message", "")
@@ -55,26 +97,110 @@ def _build_recent_context(limit: int = 8, exclude_last: bool = False) -> str:
     return "\n".join(lines)
 
 
+@router.get("/rooms")
+async def get_chat_rooms():
+    """Комнаты чата: локации с агентами и комнаты, где уже есть сообщения."""
+    return {"rooms": await asyncio.to_thread(chat_rooms.list, agent_registry.room_sizes())}
+
+
 @router.get("/messages")
-async def get_chat_messages(limit: int = 50):
-    """Получить последние сообщения из общего чата."""
+@router.get("/{room}/messages")
+async def get_chat_messages(room: str = DEFAULT_ROOM, limit: int = 50, since_id: Optional[str] = None,
+                            cursor: Optional[int] = None):
+    """
+    Получить сообщения комнаты (без room в пути - общей зоны).
+
+    Без параметров - последние limit сообщений. С since_id (id сообщения)
+    или cursor (seq из прошлого ответа) - только те, что пришли после него.
+    """
     limit = max(1, min(limit, MAX_CHAT_HISTORY))
+    store = _open_room(room)
+
+    if since_id is not None and cursor is None:
+        # Если сообщение уже вытеснено из буфера, отдаём последние limit
+        cursor = store.seq_of(since_id)
+
+    if cursor is not None:
+        messages = store.since(cursor, limit)
+    else:
+        messages = store.latest(limit)
+
     return {
-        "messages": chat_messages[-limit:],
-        "total": len(chat_messages),
+        "room": store.room,
+        "messages": messages,
+        "total": len(store),
+        "cursor": store.cursor,
     }
 
 
+def sse_frame(event: str, data: Dict, event_id: Optional[int] = None) -> str:
+    """Format one Server-Sent Events frame."""
+    frame = f"event: {event}\n"
+    if event_id is not None:
+        frame += f"id: {event_id}\n"
+    return frame + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.get("/stream")
+@router.get("/{room}/stream")
+async def stream_chat(request: Request, room: str = DEFAULT_ROOM, cursor: Optional[int] = None):
+    """
+    Поток новых сообщений комнаты (Server-Sent Events).
+
+    cursor (или заголовок Last-Event-ID при переподключении) - seq последнего
+    полученного сообщения: всё, что пришло после него, отправляется сразу.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if cursor is None and last_event_id and last_event_id.isdigit():
+        cursor = int(last_event_id)
+
+    # Подписываемся до чтения буфера, чтобы не потерять сообщения между ними
+    store = _open_room(room)
+    queue = store.subscribe()
+
+    async def events():
+        sent = cursor if cursor is not None else store.cursor
+        try:
+            for message in store.since(sent, MAX_CHAT_HISTORY):
+                yield sse_frame("message", message, message["seq"])
+                sent = message["seq"]
+
+            while not await request.is_disconnected():
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if event == "message":
+                    if data["seq"] <= sent:
+                        continue
+                    sent = data["seq"]
+                    yield sse_frame(event, data, sent)
+                else:
+                    yield sse_frame(event, data)
+        finally:
+            store.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/user")
-async def user_send_to_chat(message: str, user_name: str = "Пользователь"):
-    """Пользователь отправляет сообщение в общий чат."""
+@router.post("/{room}/user")
+async def user_send_to_chat(message: str, user_name: str = "Пользователь", room: str = DEFAULT_ROOM):
+    """Пользователь отправляет сообщение в комнату."""
     message = (message or "").strip()
     if not message:
         raise HTTPException(status_code=400, detail="Message is empty")
 
-    logger.info(f"👤 Пользователь {user_name} пишет: {message}")
+    _open_room(room)
+    logger.info(f"👤 Пользователь {user_name} пишет в {room}: {message}")
 
-    chat_message = _append_message({
+    chat_message = await _append_message(room, {
         "id": str(uuid.uuid4()),
         "agent_id": "user",
         "agent_name": user_name,
@@ -88,17 +214,22 @@ async def user_send_to_chat(message: str, user_name: str = "Пользовате
 
 
 @router.post("/send")
-async def send_to_chat(agent_id: str, message: str):
-    """Агент отправляет сообщение в чат."""
+@router.post("/{room}/send")
+async def send_to_chat(agent_id: str, message: str, room: Optional[str] = None):
+    """Агент отправляет сообщение в комнату, где находится (без room - в свою)."""
     message = (message or "").strip()
     if not message:
         raise HTTPException(status_code=400, detail="Message is empty")
 
-    sender = db.fetch_one("SELECT * FROM agents WHERE id = ?", (agent_id,))
+    sender = agent_registry.get(agent_id)
     if not sender:
         raise HTTPException(status_code=404, detail="Agent not found")
+    if room is None:
+        room = _room_of(sender)
+    elif room != _room_of(sender):
+        raise HTTPException(status_code=400, detail="Agent is not in this room")
 
-    chat_message = _append_message({
+    chat_message = await _append_message(room, {
         "id": str(uuid.uuid4()),
         "agent_id": agent_id,
         "agent_name": sender["name"],
@@ -107,40 +238,50 @@ async def send_to_chat(agent_id: str, message: str):
         "type": "agent_message",
     })
 
-    memory_store.add(agent_id, f"Я написал в общий чат: {message}", "нейтрально")
+    memory_store.add(agent_id, f"Я написал в чат ({room}): {message}", "нейтрально")
 
     asyncio.create_task(process_new_message(chat_message))
     return {"ok": True, "message": chat_message}
 
 
 @router.post("/clear")
-async def clear_chat():
-    """Очистить историю чата."""
-    chat_messages.clear()
-    logger.info("🧹 История чата очищена")
+@router.post("/{room}/clear")
+async def clear_chat(room: str = DEFAULT_ROOM):
+    """Очистить историю комнаты."""
+    await asyncio.to_thread(_open_room(room).clear)
+    logger.info(f"🧹 История комнаты {room} очищена")
     return {"ok": True}
 
 
-@router.post("/start-background")
-async def start_background_chat():
-    """Запустить фоновое общение агентов."""
-    global background_task_running, background_task
+async def _supervise_once():
+    """Take or renew the lease when background chat is on; run the loop only while leading."""
+    global background_task
 
-    if background_task_running and background_task and not background_task.done():
-        return {"ok": True, "message": "Already running"}
+    if background_task is not None and background_task.done() and not background_task.cancelled():
+        # Цикл упал - забираем исключение (иначе "never retrieved") и перезапускаем ниже
+        error = background_task.exception()
+        if error:
+            logger.error(f"Фоновое общение остановилось с ошибкой: {error!r}")
+        background_task = None
 
-    background_task_running = True
-    background_task = asyncio.create_task(background_agent_conversation())
-    logger.info("🎮 Запущено фоновое общение агентов")
-    return {"ok": True, "message": "Background chat started"}
+    enabled = bool(await asyncio.to_thread(shared_state.get, BACKGROUND_FLAG))
+    leader = enabled and await asyncio.to_thread(shared_state.acquire_lease, BACKGROUND_LEASE, LEASE_TTL)
+    running = background_task is not None and not background_task.done()
 
+    if leader and not running:
+        logger.info(f"👑 Воркер {shared_state.worker_id} ведёт фоновое общение")
+        background_task = asyncio.create_task(background_agent_conversation())
+        await asyncio.to_thread(versions.bump, "background")
+    elif not leader and running:
+        await _stop_local_loop()
+        if enabled:
+            logger.warning("⚠️ Аренда фонового общения потеряна, цикл остановлен")
+        else:
+            await asyncio.to_thread(shared_state.release_lease, BACKGROUND_LEASE)
 
-@router.post("/stop-background")
-async def stop_background_chat():
-    """Остановить фоновое общение агентов."""
-    global background_task_running, background_task
 
-    background_task_running = False
+async def _stop_local_loop():
+    global background_task
 
     if background_task and not background_task.done():
         background_task.cancel()
@@ -148,108 +289,205 @@ async def stop_background_chat():
             await background_task
         except asyncio.CancelledError:
             pass
-
     background_task = None
+
+
+async def background_supervisor():
+    """Runs in every worker; at most one of them holds the lease and the loop."""
+    global _supervisor_wakeup
+
+    _supervisor_wakeup = asyncio.Event()
+    while True:
+        try:
+            await _supervise_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка супервизора фонового общения: {e}")
+
+        try:
+            await asyncio.wait_for(_supervisor_wakeup.wait(), timeout=LEASE_RENEW)
+        except asyncio.TimeoutError:
+            pass
+        _supervisor_wakeup.clear()
+
+
+def start_supervisor():
+    """Called on app startup."""
+    global supervisor_task
+    supervisor_task = asyncio.create_task(background_supervisor())
+
+
+async def stop_supervisor():
+    """Called on shutdown: stop the loop and hand the lease to another worker."""
+    global supervisor_task
+
+    if supervisor_task:
+        supervisor_task.cancel()
+        try:
+            await supervisor_task
+        except asyncio.CancelledError:
+            pass
+        supervisor_task = None
+    if background_task:
+        await _stop_local_loop()
+        await asyncio.to_thread(shared_state.release_lease, BACKGROUND_LEASE)
+
+
+def _wake_supervisor():
+    if _supervisor_wakeup is not None:
+        _supervisor_wakeup.set()
+
+
+@router.post("/start-background")
+async def start_background_chat():
+    """Запустить фоновое общение агентов (в одном из воркеров)."""
+    if await asyncio.to_thread(shared_state.get, BACKGROUND_FLAG):
+        return {"ok": True, "message": "Already running"}
+
+    await asyncio.to_thread(shared_state.set, BACKGROUND_FLAG, 1)
+    await asyncio.to_thread(versions.bump, "background")
+    _wake_supervisor()
+    logger.info("🎮 Запущено фоновое общение агентов")
+    return {"ok": True, "message": "Background chat started"}
+
+
+@router.post("/stop-background")
+async def stop_background_chat():
+    """Остановить фоновое общение агентов (лидер заметит в течение LEASE_RENEW)."""
+    await asyncio.to_thread(shared_state.set, BACKGROUND_FLAG, 0)
+    if background_task:
+        await _stop_local_loop()
+        await asyncio.to_thread(shared_state.release_lease, BACKGROUND_LEASE)
+
+    await asyncio.to_thread(versions.bump, "background")
     logger.info("⏸️ Фоновое общение остановлено")
     return {"ok": True, "message": "Background chat stopped"}
 
 
+@router.post("/fast-forward")
+async def fast_forward_chat(hours: float = 8.0):
+    """
+    Перемотать симуляцию на hours часов: агенты ходят так быстро, как
+    позволяет LLM. Включает фоновое общение; hours=0 - отменить перемотку.
+    """
+    if hours < 0:
+        raise HTTPException(status_code=400, detail="hours must be >= 0")
+
+    until = await asyncio.to_thread(simulation.fast_forward, hours * 3600)
+    if until:
+        await asyncio.to_thread(shared_state.set, BACKGROUND_FLAG, 1)
+        _wake_supervisor()
+        logger.info(f"⏩ Перемотка симуляции на {hours:g} ч")
+    await asyncio.to_thread(versions.bump, "background")
+    return {
+        "ok": True,
+        "fast_forward_until": datetime.fromtimestamp(until).isoformat(timespec="seconds") if until else None,
+    }
+
+
 @router.get("/status")
-async def get_chat_status():
-    """Получить статус общего чата."""
-    agents = db.fetch_all("SELECT id FROM agents") or []
-    task_alive = bool(background_task and not background_task.done())
+@router.get("/{room}/status")
+async def get_chat_status(request: Request, response: Response, room: str = DEFAULT_ROOM):
+    """Получить статус комнаты и фонового общения."""
+    store = _open_room(room)
+    not_modified = versions.check(request, response, "chat", "agents", "background", extra=room)
+    if not_modified:
+        return not_modified
+
+    agents = agent_registry.in_room(room)
+    enabled = await asyncio.to_thread(shared_state.get, BACKGROUND_FLAG)
+    leader = await asyncio.to_thread(shared_state.lease_owner, BACKGROUND_LEASE)
+    clock = await asyncio.to_thread(simulation.saved_clock)
+    until = await asyncio.to_thread(simulation.fast_forward_until)
     return {
-        "background_running": bool(background_task_running and task_alive),
-        "messages_count": len(chat_messages),
+        "background_running": bool(enabled and leader),
+        "background_leader": leader,
+        "simulation_clock": datetime.fromtimestamp(clock).isoformat(timespec="seconds"),
+        "fast_forward_until": datetime.fromtimestamp(until).isoformat(timespec="seconds") if until else None,
+        "room": room,
+        "messages_count": len(store),
         "agents_active": len(agents),
     }
 
 
 async def background_agent_conversation():
-    """Фоновый процесс: агенты сами иногда инициируют разговор."""
-    global background_task_running
-
+    """Фоновый процесс: агенты сами иногда инициируют разговор (только в воркере-лидере)."""
     logger.info("🔄 Запуск фонового общения агентов")
 
     try:
-        while background_task_running:
-            try:
-                await asyncio.sleep(random.uniform(10, 30))
+        await simulation.run(_load_agents, _agent_turn)
+    except asyncio.CancelledError:
+        logger.info("⏸️ Фоновая задача отменена")
+        raise
+    finally:
+        await asyncio.to_thread(versions.bump, "background")
+        logger.info("⏸️ Фоновое общение завершено")
+
+
+async def _load_agents() -> List[Dict]:
+    return agent_registry.all()
 
-                agents = db.fetch_all("SELECT * FROM agents") or []
-                if len(agents) < 1:
-                    continue
 
-                speaker = random.choice(agents)
-                context = _build_recent_context(limit=8)
+async def _agent_turn(speaker: Dict):
+    """One simulation turn: the speaker writes to their room on their own, others may reply."""
+    room = _room_of(speaker)
+    last = _latest(room, 1)
+    topic = last[0]["message"] if last else speaker["name"]
+    memory_prefetch.prefetch(speaker["id"], topic)
 
-                prompt = f"""Ты {speaker['name']} ({speaker['personality']}).
-Ты участвуешь в общем чате с другими ИИ-агентами и пользователем.
+    context = _build_recent_context(room, limit=8)
+    memories = format_memories(await memory_prefetch.recall(speaker["id"], topic))
 
-{context}
+    prompt = f"""Ты {speaker['name']} ({speaker['personality']}).
+Ты участвуешь в чате с другими ИИ-агентами и пользователем, вы все сейчас в локации «{room}».
 
 Напиши новое сообщение в чат с учетом недавнего разговора.
 Коротко: 1-2 предложения. Не повторяй одно и то же.
 
 Твое сообщение:"""
 
-                reply = llm.generate(
-                    agent_id=speaker["id"],
-                    prompt=prompt,
-                    system=f"Ты {speaker['name']} и ты участвуешь в общем чате. Пиши живо, коротко и по характеру.",
-                    temperature=0.9,
-                )
-
-                if reply and not reply.startswith("(Ошибка"):
-                    chat_message = _append_message({
-                        "id": str(uuid.uuid4()),
-                        "agent_id": speaker["id"],
-                        "agent_name": speaker["name"],
-                        "message": reply.strip(),
-                        "timestamp": datetime.now().isoformat(),
-                        "type": "agent_message",
-                        "initiative": "self",
-                    })
-
-                    logger.info(f"💬 {speaker['name']} (сам): {reply[:50]}...")
-                    memory_store.add(speaker["id"], f"Я сам написал в чат: {reply}", "нейтрально")
-                    asyncio.create_task(process_new_message(chat_message))
-
-            except asyncio.CancelledError:
-                logger.info("⏸️ Фоновая задача отменена")
-                break
-            except Exception as e:
-                logger.error(f"Ошибка в фоновом общении: {e}")
-                await asyncio.sleep(5)
-    finally:
-        background_task_running = False
-        logger.info("⏸️ Фоновое общение завершено")
-
-
-async def process_new_message(trigger_message: Dict):
-    """Обработка нового сообщения: другие агенты могут ответить один раз."""
-    agents = db.fetch_all("SELECT * FROM agents") or []
-    other_agents = [a for a in agents if a["id"] != trigger_message.get("agent_id")]
-
-    if not other_agents:
+    # Чат и воспоминания - только в этот запрос; в историю агента идёт короткая реплика
+    reply = await llm.generate_async(
+        agent_id=speaker["id"],
+        prompt=prompt,
+        system=f"Ты {speaker['name']} и ты участвуешь в общем чате. Пиши живо, коротко и по характеру.",
+        temperature=0.9,
+        context="\n\n".join(part for part in (memories, context) if part),
+        history_text="(пишу в общий чат сам)",
+    )
+    if not reply or reply.startswith("(Ошибка"):
         return
 
-    context = _build_recent_context(limit=8, exclude_last=True)
+    chat_message = await _append_message(room, {
+        "id": str(uuid.uuid4()),
+        "agent_id": speaker["id"],
+        "agent_name": speaker["name"],
+        "message": reply.strip(),
+        "timestamp": datetime.now().isoformat(),
+        "sim_time": simulation.clock_iso(),
+        "type": "agent_message",
+        "initiative": "self",
+    })
+
+    logger.info(f"💬 {speaker['name']} (сам): {reply[:50]}...")
+    memory_store.add(speaker["id"], f"Я сам написал в чат: {reply}", "нейтрально")
 
-    # Перемешиваем, чтобы не всегда отвечали в одном порядке.
-    random.shuffle(other_agents)
+    if simulation.fast_forwarding:
+        # При перемотке ход ждёт ответы: иначе они копятся быстрее, чем успевает LLM
+        await process_new_message(chat_message)
+    else:
+        asyncio.create_task(process_new_message(chat_message))
 
-    # Ограничение, чтобы после одного сообщения не отвечала сразу вся толпа.
-    max_replies = 2 if len(other_agents) > 2 else 1
-    replies_count = 0
 
+def _pick_responders(other_agents: List[Dict], text: str, limit: int) -> List[Dict]:
+    """Choose up to `limit` agents who want to answer, by personality and message."""
+    responders = []
     for agent in other_agents:
-        if replies_count >= max_replies:
+        if len(responders) >= limit:
             break
 
         base_probability = 0.35
-        text = trigger_message.get("message", "")
 
         if "?" in text:
             base_probability += 0.25
@@ -259,52 +497,139 @@ async def process_new_message(trigger_message: Dict):
         elif agent["personality"] in ["задумчивый", "спокойный"]:
             base_probability -= 0.1
 
-        if random.random() >= base_probability:
-            continue
+        if random.random() < base_probability:
+            responders.append(agent)
+
+    return responders
 
-        await asyncio.sleep(random.uniform(1.0, 3.0))
 
-        base_prompt = get_chat_response_prompt(
-            name=agent["name"],
-            personality_type=agent["personality"],
-            message=text,
-            sender=trigger_message.get("agent_name", "Кто-то"),
-        )
+def _reply_history_text(trigger_message: Dict) -> str:
+    """What goes into the responder's history as the other side's turn."""
+    return f"{trigger_message.get('agent_name', 'Кто-то')}: {trigger_message.get('message', '')}"
 
-        prompt = f"""{context}
 
-Последнее сообщение:
-{trigger_message.get('agent_name', 'Кто-то')}: {text}
+async def _generate_reply(agent: Dict, trigger_message: Dict, context: str) -> Optional[str]:
+    """Generate one candidate reply; the typing delay runs alongside the LLM call.
+
+    Nothing is written to the agent's history here: surplus candidates are discarded,
+    so process_new_message records only the replies it actually posts.
+    """
+    text = trigger_message.get("message", "")
+    # Prefetch was started in process_new_message; wait at most the budget.
+    memories = format_memories(await memory_prefetch.recall(agent["id"], text))
+
+    sender = trigger_message.get("agent_name", "Кто-то")
+
+    base_prompt = get_chat_response_prompt(
+        name=agent["name"],
+        personality_type=agent["personality"],
+        message=text,
+        sender=sender,
+    )
+
+    prompt = f"""Последнее сообщение:
+{sender}: {text}
 
 {base_prompt}
 
 Важно: ответь именно на последнее сообщение, но учитывай контекст. Не повторяй чужие фразы."""
 
-        reply = llm.generate(
+    reply, _ = await asyncio.gather(
+        llm.generate_async(
             agent_id=agent["id"],
             prompt=prompt,
             system=f"Ты {agent['name']}, ИИ-агент в общем чате с другими ИИ и пользователем. Отвечай коротко и по характеру.",
             temperature=0.9,
-        )
-
-        if not reply or reply.startswith("(Ошибка"):
-            continue
-
-        reply_message = _append_message({
-            "id": str(uuid.uuid4()),
-            "agent_id": agent["id"],
-            "agent_name": agent["name"],
-            "message": reply.strip(),
-            "timestamp": datetime.now().isoformat(),
-            "type": "agent_message",
-            "in_reply_to": trigger_message["id"],
-        })
-
-        replies_count += 1
-        logger.info(f"💬 {agent['name']} ответил: {reply[:50]}...")
-
-        memory_store.add(
-            agent["id"],
-            f"Я ответил {trigger_message.get('agent_name', 'кому-то')} в общем чате: {reply}",
-            "нейтрально",
-        )
+            # Контекст чата не копится в истории: там только "кто что сказал"
+            context="\n\n".join(part for part in (memories, context) if part),
+            remember=False,
+        ),
+        # "Печатает..." - ответ не появится раньше этой паузы, но и не ждёт её последовательно.
+        # При перемотке симуляции паузы нет.
+        asyncio.sleep(0 if simulation.fast_forwarding else random.uniform(1.0, 3.0)),
+    )
+    return reply
+
+
+async def process_new_message(trigger_message: Dict):
+    """Обработка нового сообщения: другие агенты той же комнаты могут ответить один раз."""
+    room = trigger_message.get("room", DEFAULT_ROOM)
+    other_agents = [a for a in agent_registry.in_room(room) if a["id"] != trigger_message.get("agent_id")]
+
+    if not other_agents:
+        return
+
+    # Перемешиваем, чтобы не всегда отвечали в одном порядке.
+    random.shuffle(other_agents)
+
+    # Ограничение, чтобы после одного сообщения не отвечала сразу вся толпа.
+    max_replies = 2 if len(other_agents) > 2 else 1
+    replies_count = 0
+
+    # Кандидатов выбираем заранее: генерируем параллельно, лишние отменяем.
+    responders = _pick_responders(
+        other_agents,
+        trigger_message.get("message", ""),
+        limit=max(max_replies, REPLY_POOL_SIZE),
+    )
+    if not responders:
+        return
+
+    # Память ищется в фоне, пока собирается контекст и идёт генерация соседей.
+    for agent in responders:
+        memory_prefetch.prefetch(agent["id"], trigger_message.get("message", ""))
+
+    context = _build_recent_context(room, limit=8, exclude_last=True)
+
+    pending = {
+        asyncio.create_task(_generate_reply(agent, trigger_message, context)): agent
+        for agent in responders
+    }
+    started = dict(pending)
+
+    try:
+        while pending and replies_count < max_replies:
+            done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                agent = pending.pop(task)
+                if replies_count >= max_replies:
+                    break
+
+                try:
+                    reply = task.result()
+                except Exception as e:
+                    logger.error(f"Ошибка генерации ответа {agent['name']}: {e}")
+                    continue
+
+                if not reply or reply.startswith("(Ошибка"):
+                    continue
+
+                await _append_message(room, {
+                    "id": str(uuid.uuid4()),
+                    "agent_id": agent["id"],
+                    "agent_name": agent["name"],
+                    "message": reply.strip(),
+                    "timestamp": datetime.now().isoformat(),
+                    "type": "agent_message",
+                    "in_reply_to": trigger_message["id"],
+                })
+
+                replies_count += 1
+                llm.remember(agent["id"], _reply_history_text(trigger_message), reply)
+                logger.info(f"💬 {agent['name']} ответил: {reply[:50]}...")
+
+                memory_store.add(
+                    agent["id"],
+                    f"Я ответил {trigger_message.get('agent_name', 'кому-то')} в чате ({room}): {reply}",
+                    "нейтрально",
+                )
+    finally:
+        # Лимит ответов набран (или нас отменили) - остальные генерации не нужны.
+        for task in pending:
+            task.cancel()
+        # Забираем исход всех задач, в т.ч. готовых, но не разобранных после break
+        results = await asyncio.gather(*started, return_exceptions=True)
+        for (task, agent), result in zip(started.items(), results):
+            if isinstance(result, Exception):
+                logger.debug(f"Ответ {agent['name']} не понадобился или не удался: {result!r}")
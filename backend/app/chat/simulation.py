@@ -0,0 +1,260 @@
+"""
+Движок фонового общения агентов.
+
+Время дискретное: за тик часы симуляции сдвигаются на SIMULATION_TICK секунд.
+У каждого агента своё время следующего хода (куча по времени). Ход - отдельная
+задача: тик не ждёт самый медленный вызов LLM, а в каждой комнате (локации)
+одновременно идут не больше turns_per_tick ходов. После хода агент снова
+встаёт в очередь через случайный интервал; в людных комнатах интервал растёт, чтобы комната не тонула в
+сообщениях, а общий темп мира рос с числом комнат.
+
+В обычном режиме тик ждёт настоящее время. В перемотке (fast-forward) часы
+прыгают к ближайшему ходу, как только закончится какой-нибудь ход (но не реже
+раза в тик), и скорость ограничивает только LLM (планировщик запросов).
+Ошибка тика (БД занята и т.п.) не останавливает цикл: повтор с нарастающей паузой. Часы и цель перемотки лежат в shared_state, так что
+новый воркер-лидер продолжает с того же места.
+"""
+
+import asyncio
+import heapq
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from ..config import config
+from ..logger import get_logger
+from ..shared_state import shared_state
+from .store import DEFAULT_ROOM
+from ..versions import versions
+
+logger = get_logger(__name__)
+
+CLOCK_KEY = "simulation_clock"
+FAST_FORWARD_KEY = "simulation_fast_forward_until"
+# Как часто сохранять часы в shared_state в обычном режиме, секунды
+CLOCK_SAVE_INTERVAL = 5.0
+# Потолок паузы после ошибок тика подряд, секунды
+MAX_TICK_BACKOFF = 60.0
+
+
+class SimulationEngine:
+    def __init__(self, tick: float, turns_per_tick: int, min_interval: float, max_interval: float,
+                 room_pace_agents: int):
+        self.tick = tick
+        self.turns_per_tick = max(1, turns_per_tick)
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.room_pace_agents = max(1, room_pace_agents)
+
+        self.clock = 0.0  # секунды unix-времени внутри симуляции
+        self.fast_forwarding = False
+        self._queue = []  # куча (время хода, agent_id); бывают устаревшие записи
+        self._next_at: Dict[str, float] = {}  # agent_id -> актуальное время хода
+        self._running: Dict[str, asyncio.Task] = {}  # agent_id -> идущий ход
+        self._saved_at = 0.0  # time.monotonic() последнего сохранения часов
+        self.stats = defaultdict(int)
+        self._fast_forward_from = (0.0, 0)  # (time.monotonic(), ходов) в начале перемотки
+
+    # --- вызывается из любого воркера ---
+
+    @staticmethod
+    def saved_clock() -> float:
+        """Часы симуляции из shared_state (до первого запуска - настоящее время)"""
+        return shared_state.get(CLOCK_KEY) or time.time()
+
+    @staticmethod
+    def fast_forward_until() -> int:
+        return shared_state.get(FAST_FORWARD_KEY)
+
+    def fast_forward(self, seconds: float) -> int:
+        """Перемотать на seconds симулированного времени (0 - отменить перемотку)"""
+        until = int(self.saved_clock() + seconds) if seconds > 0 else 0
+        shared_state.set(FAST_FORWARD_KEY, until)
+        return until
+
+    # --- очередь ходов ---
+
+    def _schedule(self, agent_id: str, at: float):
+        self._next_at[agent_id] = at
+        heapq.heappush(self._queue, (at, agent_id))
+
+    def _sync_agents(self, agent_ids):
+        """Новых агентов поставить в очередь, удалённых - забыть"""
+        for agent_id in list(self._next_at):
+            if agent_id not in agent_ids:
+                del self._next_at[agent_id]
+        for agent_id in agent_ids:
+            if agent_id not in self._next_at:
+                # Новички разбросаны по первому интервалу, чтобы не ходить толпой
+                self._schedule(agent_id, self.clock + random.uniform(0, self.max_interval))
+
+    def _next_due(self) -> Optional[float]:
+        """Время ближайшего хода (устаревшие записи кучи выбрасываются)"""
+        while self._queue and self._next_at.get(self._queue[0][1]) != self._queue[0][0]:
+            heapq.heappop(self._queue)
+        return self._queue[0][0] if self._queue else None
+
+    def _pop_due(self, rooms: Dict[str, str], busy: Optional[Counter] = None) -> List[str]:
+        """Агенты, чей ход настал, - вместе с идущими ходами (busy) не больше turns_per_tick на комнату"""
+        due, deferred = [], []
+        per_room = Counter(busy or ())
+        while True:
+            at = self._next_due()
+            if at is None or at > self.clock:
+                break
+            entry = heapq.heappop(self._queue)
+            room = rooms[entry[1]]
+            if per_room[room] >= self.turns_per_tick:
+                deferred.append(entry)  # ход не отменяется, а переносится на следующий тик
+                continue
+            per_room[room] += 1
+            due.append(entry[1])
+        for entry in deferred:
+            heapq.heappush(self._queue, entry)
+        return due
+
+    def _interval(self, room_size: int) -> float:
+        """Пауза до следующего хода: в комнате больше room_pace_agents агентов - реже"""
+        scale = max(1.0, room_size / self.room_pace_agents)
+        return random.uniform(self.min_interval, self.max_interval) * scale
+
+    # --- цикл ---
+
+    async def run(self, load_agents, take_turn):
+        """
+        Крутить тики, пока задачу не отменят.
+
+        load_agents() - корутина со списком агентов (dict с "id"),
+        take_turn(agent) - корутина одного хода агента.
+        """
+        self.clock = await asyncio.to_thread(self.saved_clock)
+        self._saved_at = time.monotonic()
+        failures = 0
+        try:
+            while True:
+                try:
+                    await self._tick(load_agents, take_turn)
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    self.stats["tick_errors"] += 1
+                    delay = min(self.tick * 2 ** failures, MAX_TICK_BACKOFF)
+                    logger.error(f"❌ Ошибка тика симуляции, повтор через {delay:g}с: {e}")
+                    await asyncio.sleep(delay)
+        finally:
+            running = list(self._running.values())
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+            try:
+                await self._set_fast_forward(False)
+                await asyncio.to_thread(shared_state.set, CLOCK_KEY, int(self.clock))
+            except Exception as e:
+                logger.error(f"❌ Часы симуляции не сохранены: {e}")
+
+    async def _tick(self, load_agents, take_turn):
+        started = time.monotonic()
+        agents = {agent["id"]: agent for agent in await load_agents()}
+        rooms = {agent_id: agent.get("location") or DEFAULT_ROOM for agent_id, agent in agents.items()}
+        room_sizes = Counter(rooms.values())
+        self._sync_agents(agents)
+
+        until = await asyncio.to_thread(self.fast_forward_until)
+        if until and until <= self.clock:
+            # Цель уже позади (например, считали её по чуть отставшим часам)
+            await asyncio.to_thread(shared_state.set, FAST_FORWARD_KEY, 0)
+            until = 0
+        await self._set_fast_forward(until > self.clock)
+
+        busy = Counter(rooms.get(agent_id) for agent_id in self._running)
+        for agent_id in self._pop_due(rooms, busy):
+            self._running[agent_id] = asyncio.create_task(
+                self._turn(agents[agent_id], take_turn, room_sizes[rooms[agent_id]])
+            )
+        self.stats["ticks"] += 1
+
+        if self.fast_forwarding:
+            if self._running:
+                await asyncio.wait(list(self._running.values()), timeout=self.tick,
+                                   return_when=asyncio.FIRST_COMPLETED)
+            self._advance_fast(until)
+            await asyncio.to_thread(shared_state.set, CLOCK_KEY, int(self.clock))
+            self._saved_at = time.monotonic()
+            if self.clock >= until:
+                await asyncio.to_thread(shared_state.set, FAST_FORWARD_KEY, 0)
+                await self._set_fast_forward(False)
+            return
+
+        elapsed = time.monotonic() - started
+        if elapsed < self.tick:
+            await asyncio.sleep(self.tick - elapsed)
+        self.clock += time.monotonic() - started
+        if time.monotonic() - self._saved_at >= CLOCK_SAVE_INTERVAL:
+            await asyncio.to_thread(shared_state.set, CLOCK_KEY, int(self.clock))
+            self._saved_at = time.monotonic()
+
+    async def _turn(self, agent: dict, take_turn, room_size: int):
+        """Один ход в своей задаче; после него агент снова встаёт в очередь"""
+        agent_id = agent["id"]
+        try:
+            await take_turn(agent)
+            self.stats["turns"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Ошибка хода агента {agent_id}: {e}")
+        finally:
+            self._running.pop(agent_id, None)
+            if agent_id in self._next_at:
+                self._schedule(agent_id, self.clock + self._interval(room_size))
+
+    def _advance_fast(self, until: int):
+        """Перемотка: к следующему ходу, но не дальше цели"""
+        step = self.tick
+        next_due = self._next_due()
+        if next_due is None:
+            step = until - self.clock  # агентов нет - ждать нечего
+        elif next_due > self.clock:
+            step = max(step, next_due - self.clock)
+        self.clock = min(self.clock + step, until)
+
+    async def _set_fast_forward(self, enabled: bool):
+        if enabled == self.fast_forwarding:
+            return
+        self.fast_forwarding = enabled
+        if enabled:
+            self._fast_forward_from = (time.monotonic(), self.stats["turns"])
+            logger.info(f"⏩ Перемотка симуляции с {self.clock_iso()}")
+        else:
+            started, turns = self._fast_forward_from
+            turns = self.stats["turns"] - turns
+            spent = time.monotonic() - started
+            logger.info(f"⏹️ Перемотка закончена на {self.clock_iso()}: {turns} ходов за {spent:.0f}с")
+        await asyncio.to_thread(versions.bump, "background")
+
+    def clock_iso(self) -> str:
+        return datetime.fromtimestamp(self.clock).isoformat(timespec="seconds")
+
+    def metrics(self) -> dict:
+        return {
+            "clock": self.clock_iso(),
+            "fast_forwarding": self.fast_forwarding,
+            "agents_scheduled": len(self._next_at),
+            "turns_running": len(self._running),
+            **self.stats
+        }
+
+
+def build_simulation() -> SimulationEngine:
+    return SimulationEngine(
+        tick=config.SIMULATION_TICK,
+        turns_per_tick=config.SIMULATION_TURNS_PER_TICK,
+        min_interval=config.SIMULATION_TURN_INTERVAL_MIN,
+        max_interval=config.SIMULATION_TURN_INTERVAL_MAX,
+        room_pace_agents=config.SIMULATION_ROOM_PACE_AGENTS
+    )
+
+
+simulation = build_simulation()
@@ -0,0 +1,363 @@
+"""
+Хранилище чатов по комнатам.
+
+Комната - это локация агентов (agents.location). У каждой комнаты свой
+кольцевой буфер фиксированной ёмкости + индекс id -> seq для чтения
+"только новых" сообщений, и append-only хвост в SQLite, чтобы чат
+переживал перезапуск бэкенда.
+
+seq сообщения свой в каждой комнате (счётчик chat_rooms.last_seq): буфер
+комнаты без дыр, а курсоры клиентов не зависят от соседних комнат.
+SQLite - общий источник правды для всех воркеров: строки хвоста идут в
+глобальном порядке (chat_messages.seq, AUTOINCREMENT), и ChatRooms.sync
+после своих и чужих записей раздаёт новые строки открытым комнатам.
+
+Открываются только существующие комнаты - локации агентов и комнаты с
+сообщениями; открытая комната без подписчиков закрывается, если к ней
+не обращались ROOM_IDLE_TTL секунд.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+
+from ..config import config
+from ..agents.models import DEFAULT_ROOM
+from ..agents.registry import agent_registry
+from ..db.database import db
+from ..logger import get_logger
+from ..shared_state import shared_state
+from ..versions import versions
+
+logger = get_logger(__name__)
+
+# Сколько лишних строк комнаты держим в SQLite сверх ёмкости буфера перед чисткой
+PRUNE_SLACK = 500
+
+# Очередь одного подписчика стрима; медленный клиент теряет самые старые сообщения
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Через сколько секунд без обращений закрывается комната без подписчиков
+ROOM_IDLE_TTL = 600.0
+
+# Счётчик очисток комнат (общий для воркеров): sync читает chat_rooms, только когда он вырос
+CLEAR_KEY = "chat_cleared"
+
+
+class ChatStore:
+    """Буфер одной комнаты; создаётся через ChatRooms.get"""
+
+    def __init__(self, room: str, capacity: int, rooms: "ChatRooms"):
+        self.room = room
+        self.capacity = capacity
+        self._rooms = rooms
+        self._slots: List[Optional[Dict]] = [None] * capacity
+        self._index: Dict[str, int] = {}  # id сообщения -> seq
+        self._next_seq = 1  # seq следующего сообщения
+        self._first_seq = 1  # seq самого старого сообщения в буфере
+        self._clear_version = 0  # номер последней очистки комнаты (chat_rooms.cleared)
+        self._lock = threading.Lock()
+        self._subscribers = {}  # asyncio.Queue -> event loop подписчика
+        self.used_at = time.monotonic()  # последнее обращение через ChatRooms.get
+
+    def _load_tail(self):
+        """Поднять последние сообщения комнаты из SQLite"""
+        try:
+            rows = db.fetch_all(
+                "SELECT room_seq, payload FROM chat_messages WHERE room = ? ORDER BY room_seq DESC LIMIT ?",
+                (self.room, self.capacity)
+            )
+            state = db.fetch_one("SELECT last_seq, cleared FROM chat_rooms WHERE name = ?", (self.room,))
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить историю комнаты {self.room}: {e}")
+            return
+
+        for row in reversed(rows):
+            self._put(self._decode(row["payload"], row["room_seq"]))
+
+        # last_seq помнит максимум даже после очистки комнаты
+        if state:
+            self._next_seq = max(self._next_seq, state["last_seq"] + 1)
+            self._clear_version = state["cleared"]
+        self._first_seq = rows[-1]["room_seq"] if rows else self._next_seq
+
+        logger.info(f"💬 Комната {self.room}: загружено сообщений {len(rows)}")
+
+    def _decode(self, payload: str, seq: int) -> Dict:
+        message = json.loads(payload)
+        message["seq"] = seq
+        message["room"] = self.room
+        return message
+
+    def _put(self, message: Dict):
+        """Положить сообщение в слот seq % capacity, вытеснив старое"""
+        seq = message["seq"]
+        slot = seq % self.capacity
+        evicted = self._slots[slot]
+        if evicted is not None and evicted["seq"] != seq:
+            self._index.pop(evicted["id"], None)
+            self._first_seq = evicted["seq"] + 1
+        self._slots[slot] = message
+        self._index[message["id"]] = seq
+        self._next_seq = max(self._next_seq, seq + 1)
+        # sync отдаёт не больше capacity строк комнаты - более старые seq могли не прийти вовсе
+        self._first_seq = max(self._first_seq, self._next_seq - self.capacity)
+
+    def _receive(self, message: Dict):
+        """Сообщение из хвоста SQLite (своё или другого воркера)"""
+        with self._lock:
+            self._put(message)
+        self._publish("message", message)
+
+    def append(self, message: Dict) -> Dict:
+        """
+        Добавить сообщение: в хвост SQLite (там выдаётся seq комнаты), затем догнать его в буфере.
+
+        Блокирующий вызов (несколько запросов к БД) - из event loop только через asyncio.to_thread.
+        В буфер и подписчикам сообщение попадает через sync, в общем порядке seq со всеми
+        воркерами; _publish потокобезопасен.
+        """
+        message["room"] = self.room
+        payload = json.dumps(
+            {k: v for k, v in message.items() if k not in ("seq", "room")}, ensure_ascii=False
+        )
+        try:
+            with db.transaction() as conn:
+                message["seq"] = conn.execute(
+                    "INSERT INTO chat_rooms (name, last_seq) VALUES (?, 1) "
+                    "ON CONFLICT(name) DO UPDATE SET last_seq = last_seq + 1 RETURNING last_seq",
+                    (self.room,)
+                ).fetchone()[0]
+                conn.execute(
+                    "INSERT INTO chat_messages (id, room, room_seq, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (message["id"], self.room, message["seq"], payload, time.time())
+                )
+        except Exception as e:
+            # Чат важнее персистентности: работаем дальше из памяти этого воркера
+            logger.error(f"❌ Сообщение чата не сохранено в БД: {e}")
+            with self._lock:
+                message["seq"] = self._next_seq
+                self._put(message)
+            versions.bump("chat")
+            self._publish("message", message)
+            return message
+
+        # Заодно подтянутся чужие сообщения - порядок у всех один
+        self._rooms.sync()
+        if message["seq"] % PRUNE_SLACK == 0:
+            self._prune()
+
+        versions.bump("chat")
+        return message
+
+    def subscribe(self) -> asyncio.Queue:
+        """Подписаться на новые сообщения комнаты (для /chat/{room}/stream)"""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.pop(queue, None)
+
+    @property
+    def subscribers_count(self) -> int:
+        return len(self._subscribers)
+
+    def _publish(self, event: str, data: Dict):
+        """Разослать подписчикам пару (тип события, данные)"""
+        for queue, loop in list(self._subscribers.items()):
+            loop.call_soon_threadsafe(self._deliver, queue, (event, data))
+
+    @staticmethod
+    def _deliver(queue: asyncio.Queue, item: tuple):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(item)
+
+    def _prune(self):
+        """Удалить из SQLite строки комнаты, которые уже никогда не попадут в буфер"""
+        try:
+            db.execute(
+                "DELETE FROM chat_messages WHERE room = ? AND room_seq < ?",
+                (self.room, self._next_seq - self.capacity - PRUNE_SLACK)
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки хвоста комнаты {self.room}: {e}")
+
+    def _range(self, start_seq: int) -> List[Dict]:
+        start_seq = max(start_seq, self._first_seq)
+        messages = []
+        for seq in range(start_seq, self._next_seq):
+            message = self._slots[seq % self.capacity]
+            # После рестарта в хвосте могут быть дыры (сообщение не дошло до БД)
+            if message is not None and message["seq"] == seq:
+                messages.append(message)
+        return messages
+
+    def latest(self, limit: int) -> List[Dict]:
+        """Последние limit сообщений, от старых к новым"""
+        with self._lock:
+            return self._range(self._next_seq - limit)
+
+    def since(self, cursor: int, limit: int) -> List[Dict]:
+        """Сообщения с seq > cursor (не больше limit самых новых)"""
+        with self._lock:
+            return self._range(max(cursor + 1, self._next_seq - limit))
+
+    def find(self, message_id: str) -> Optional[Dict]:
+        """Сообщение по id (None, если оно уже вытеснено)"""
+        with self._lock:
+            seq = self._index.get(message_id)
+            return self._slots[seq % self.capacity] if seq is not None else None
+
+    def seq_of(self, message_id: str) -> Optional[int]:
+        """seq сообщения по id (None, если оно уже вытеснено)"""
+        return self._index.get(message_id)
+
+    @property
+    def cursor(self) -> int:
+        """seq последнего сообщения (0, если комната пуста)"""
+        return self._next_seq - 1
+
+    def clear(self):
+        """Очистить комнату во всех воркерах; seq продолжает расти, чтобы курсоры клиентов не путались"""
+        try:
+            with db.transaction() as conn:
+                conn.execute("DELETE FROM chat_messages WHERE room = ?", (self.room,))
+                cleared = conn.execute(
+                    "INSERT INTO chat_rooms (name, last_seq, cleared) VALUES (?, 0, 1) "
+                    "ON CONFLICT(name) DO UPDATE SET cleared = cleared + 1 RETURNING cleared",
+                    (self.room,)
+                ).fetchone()[0]
+                shared_state.incr(CLEAR_KEY, conn)
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки комнаты {self.room} в БД: {e}")
+            cleared = self._clear_version + 1
+
+        self._apply_clear(cleared)
+        versions.bump("chat")
+
+    def _apply_clear(self, version: int):
+        with self._lock:
+            if version == self._clear_version:
+                return
+            self._slots = [None] * self.capacity
+            self._index.clear()
+            self._first_seq = self._next_seq
+            self._clear_version = version
+        self._publish("clear", {"cursor": self.cursor})
+
+    def __len__(self) -> int:
+        return self._next_seq - self._first_seq
+
+
+class ChatRooms:
+    """Открытые комнаты воркера: буфер комнаты поднимается при первом обращении"""
+
+    def __init__(self, capacity: int = 200):
+        self.capacity = capacity
+        self._rooms: Dict[str, ChatStore] = {}
+        self._lock = threading.Lock()  # открытие комнат и sync не пересекаются
+        self._synced = self._last_row()  # seq последней строки хвоста, разобранной sync
+        self._clears_seen = shared_state.get(CLEAR_KEY)  # CLEAR_KEY, до которого очистки применены
+        self._evicted_at = time.monotonic()
+        shared_state.subscribe(self.sync)
+
+    @staticmethod
+    def _last_row() -> int:
+        try:
+            row = db.fetch_one("SELECT MAX(seq) AS seq FROM chat_messages")
+        except Exception:
+            return 0
+        return (row and row["seq"]) or 0
+
+    @staticmethod
+    def _exists(room: str) -> bool:
+        """Комната есть, если в ней стоят агенты или уже есть сообщения"""
+        if room == DEFAULT_ROOM or agent_registry.in_room(room):
+            return True
+        return db.fetch_one("SELECT 1 FROM chat_messages WHERE room = ? LIMIT 1", (room,)) is not None
+
+    def get(self, room: Optional[str] = None) -> Optional[ChatStore]:
+        """Буфер комнаты; None - такой комнаты нет (ни агентов, ни сообщений)"""
+        room = (room or "").strip() or DEFAULT_ROOM
+        with self._lock:
+            store = self._rooms.get(room)
+            if store is None:
+                if not self._exists(room):
+                    return None
+                self._evict_idle()
+                store = ChatStore(room, self.capacity, self)
+                store._load_tail()
+                self._rooms[room] = store
+            store.used_at = time.monotonic()
+            return store
+
+    def _evict_idle(self):
+        """Закрыть комнаты без подписчиков, к которым давно не обращались (под self._lock)"""
+        now = time.monotonic()
+        self._evicted_at = now
+        for name, store in list(self._rooms.items()):
+            if not store.subscribers_count and now - store.used_at > ROOM_IDLE_TTL:
+                del self._rooms[name]
+                logger.debug(f"💬 Комната {name} закрыта: нет обращений {ROOM_IDLE_TTL:g} с")
+
+    def sync(self):
+        """Догнать SQLite: чужие очистки комнат и новые строки хвоста открытых комнат"""
+        with self._lock:
+            if time.monotonic() - self._evicted_at > ROOM_IDLE_TTL:
+                self._evict_idle()
+            if not self._rooms:
+                return
+            names = list(self._rooms)
+            marks = ", ".join("?" * len(names))
+
+            clears = shared_state.get(CLEAR_KEY)
+            if clears != self._clears_seen:
+                for row in db.fetch_all(f"SELECT name, cleared FROM chat_rooms WHERE name IN ({marks})", names):
+                    store = self._rooms[row["name"]]
+                    if row["cleared"] != store._clear_version:
+                        store._apply_clear(row["cleared"])
+                self._clears_seen = clears
+
+            # Сначала граница: все строки до неё уже закоммичены (seq выдаются по порядку записи)
+            last = self._last_row()
+            if last <= self._synced:
+                return
+            # Из каждой комнаты - не больше capacity самых новых строк, остальные всё равно вытеснены
+            rows = db.fetch_all(
+                "SELECT seq, room, room_seq, payload FROM ("
+                "SELECT seq, room, room_seq, payload, "
+                "ROW_NUMBER() OVER (PARTITION BY room ORDER BY seq DESC) AS n "
+                f"FROM chat_messages WHERE seq > ? AND seq <= ? AND room IN ({marks})"
+                ") WHERE n <= ? ORDER BY seq",
+                (self._synced, last, *names, self.capacity)
+            )
+            self._synced = last
+
+            # Строки закрытых комнат не читаем: они поднимутся из SQLite при открытии
+            for row in rows:
+                store = self._rooms[row["room"]]
+                store._receive(store._decode(row["payload"], row["room_seq"]))
+
+    def list(self, agents: Dict[str, int]) -> List[Dict]:
+        """Все комнаты: с агентами (agents - число агентов по локациям) или с сообщениями"""
+        messages = db.fetch_all("SELECT room, COUNT(*) AS messages FROM chat_messages GROUP BY room")
+
+        rooms = {DEFAULT_ROOM: {"name": DEFAULT_ROOM, "agents": 0, "messages": 0}}
+        for location, count in agents.items():
+            name = location or DEFAULT_ROOM
+            rooms.setdefault(name, {"name": name, "agents": 0, "messages": 0})["agents"] += count
+        for row in messages:
+            room = rooms.setdefault(row["room"], {"name": row["room"], "agents": 0, "messages": 0})
+            room["messages"] = min(row["messages"], self.capacity)
+        return sorted(rooms.values(), key=lambda room: (room["name"] != DEFAULT_ROOM, room["name"]))
+
+    @property
+    def open_count(self) -> int:
+        return len(self._rooms)
+
+
+chat_rooms = ChatRooms(capacity=config.CHAT_HISTORY_SIZE)
@@ -7,10 +7,53 @@ class Config(BaseSettings):
     # Mistral AI
     MISTRAL_API_KEY: str = Field("", env="MISTRAL_API_KEY")
     MISTRAL_MODEL: str = Field("mistral-small-latest", env="MISTRAL_MODEL")
+    MISTRAL_SERVER_URL: str = Field("", env="MISTRAL_SERVER_URL")  # пусто - официальный API; для тестов - mock_server
+    LLM_MAX_CONCURRENCY: int = Field(4, env="LLM_MAX_CONCURRENCY")  # одновременных запросов к LLM
+    LLM_TIMEOUT: float = Field(30.0, env="LLM_TIMEOUT")  # таймаут одного запроса, секунды
+    LLM_RPS: float = Field(0.0, env="LLM_RPS")  # запросов в секунду к LLM (0 - без ограничения; лимит своего тарифа задаётся в окружении)
+    LLM_TPM: int = Field(500000, env="LLM_TPM")  # токенов в минуту (0 - без ограничения)
+    LLM_RETRY_ATTEMPTS: int = Field(4, env="LLM_RETRY_ATTEMPTS")  # попыток на запрос при 429
+    LLM_BACKOFF_MAX: float = Field(20.0, env="LLM_BACKOFF_MAX")  # потолок паузы между повторами, секунды
+    LLM_PROVIDER: str = Field("mistral", env="LLM_PROVIDER")  # mistral, record, replay
+    LLM_TAPE_PATH: str = Field("../data/llm_tape.jsonl", env="LLM_TAPE_PATH")  # лента для record/replay
+    LLM_REPLAY_SPEED: float = Field(1.0, env="LLM_REPLAY_SPEED")  # множитель задержек при replay (0 - без пауз)
+    LLM_INPUT_TOKEN_BUDGET: int = Field(2000, env="LLM_INPUT_TOKEN_BUDGET")  # потолок входных токенов на запрос
+    LLM_TOKENIZER: str = Field("", env="LLM_TOKENIZER")  # путь к tokenizer.json модели MISTRAL_MODEL; пусто - оценка по длине
+    LLM_SUMMARY_MODEL: str = Field("ministral-3b-latest", env="LLM_SUMMARY_MODEL")  # дешёвая модель для конспектов истории
+    LLM_SUMMARY_MAX_TOKENS: int = Field(200, env="LLM_SUMMARY_MAX_TOKENS")  # размер конспекта
+    LLM_SUMMARY_BATCH: int = Field(4, env="LLM_SUMMARY_BATCH")  # сворачивать, когда вытеснено столько реплик
+    LLM_SUMMARY_INTERVAL: float = Field(30.0, env="LLM_SUMMARY_INTERVAL")  # или не реже, чем раз в столько секунд
+    HISTORY_OPEN_AGENTS: int = Field(256, env="HISTORY_OPEN_AGENTS")  # истории скольких агентов держать в памяти
 
     # Базы данных
     DATABASE_PATH: str = Field("../data/agents.db", env="DATABASE_PATH")
     CHROMA_PATH: str = Field("../data/chroma", env="CHROMA_PATH")
+    SQLITE_CACHE_SIZE_KB: int = Field(16384, env="SQLITE_CACHE_SIZE_KB")  # page cache на соединение
+    SQLITE_STATEMENT_CACHE: int = Field(256, env="SQLITE_STATEMENT_CACHE")  # подготовленных запросов на соединение
+
+    # Общий чат
+    CHAT_HISTORY_SIZE: int = Field(200, env="CHAT_HISTORY_SIZE")  # сообщений в кольцевом буфере комнаты
+    SIMULATION_TICK: float = Field(1.0, env="SIMULATION_TICK")  # длина тика фонового общения, секунды
+    SIMULATION_TURNS_PER_TICK: int = Field(2, env="SIMULATION_TURNS_PER_TICK")  # сколько агентов одной комнаты ходят за тик параллельно
+    SIMULATION_TURN_INTERVAL_MIN: float = Field(30.0, env="SIMULATION_TURN_INTERVAL_MIN")  # пауза агента между ходами, секунды
+    SIMULATION_TURN_INTERVAL_MAX: float = Field(90.0, env="SIMULATION_TURN_INTERVAL_MAX")
+    SIMULATION_ROOM_PACE_AGENTS: int = Field(5, env="SIMULATION_ROOM_PACE_AGENTS")  # в комнате больше агентов - каждый пишет реже
+    SHARED_STATE_POLL_INTERVAL: float = Field(0.1, env="SHARED_STATE_POLL_INTERVAL")  # как часто воркер проверяет чужие записи в БД, секунды
+
+    # Состояние агентов (настроение, эмоции)
+    AGENT_STATE_TICK: float = Field(5.0, env="AGENT_STATE_TICK")  # шаг затухания/заражения и сброса в БД, секунды
+    GRAPH_LAYOUT_INTERVAL: float = Field(5.0, env="GRAPH_LAYOUT_INTERVAL")  # как часто пересчитывать раскладку графа общения, секунды
+
+    # Векторная память (write-behind)
+    MEMORY_BATCH_SIZE: int = Field(32, env="MEMORY_BATCH_SIZE")  # сбрасывать пачку при таком размере
+    MEMORY_FLUSH_INTERVAL: float = Field(2.0, env="MEMORY_FLUSH_INTERVAL")  # или раз в столько секунд
+    EMBEDDING_CACHE_SIZE: int = Field(10000, env="EMBEDDING_CACHE_SIZE")  # эмбеддингов в памяти (LRU)
+    EMBEDDING_CACHE_DISK_SIZE: int = Field(200000, env="EMBEDDING_CACHE_DISK_SIZE")  # эмбеддингов на диске
+    MEMORY_OPEN_PARTITIONS: int = Field(64, env="MEMORY_OPEN_PARTITIONS")  # открытых коллекций агентов (LRU)
+    MEMORY_HALF_LIFE_HOURS: float = Field(24.0, env="MEMORY_HALF_LIFE_HOURS")  # за сколько свежесть падает вдвое
+    MEMORY_RECENCY_WEIGHT: float = Field(0.3, env="MEMORY_RECENCY_WEIGHT")  # вес свежести против похожести
+    MEMORY_PREFETCH_BUDGET_MS: int = Field(150, env="MEMORY_PREFETCH_BUDGET_MS")  # сколько ждём память перед LLM
+    MEMORY_BURST_TTL: float = Field(60.0, env="MEMORY_BURST_TTL")  # сколько секунд переиспользуем найденное
 
     # Логирование
     LOG_FILE: str = Field("../logs/backend.log", env="LOG_FILE")
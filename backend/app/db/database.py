@@ -1,12 +1,25 @@
+import asyncio
 import sqlite3
 import os
+import threading
 from contextlib import contextmanager
+from datetime import datetime
 from ..config import config
 from ..logger import get_logger
+from .migrations import migrate
 
 logger = get_logger(__name__)
 
 
+def format_timestamps(row: dict, *fields: str) -> dict:
+    """Время в БД хранится как unix time; наружу отдаём ISO-строку"""
+    for field in fields:
+        value = row.get(field)
+        if isinstance(value, (int, float)):
+            row[field] = datetime.fromtimestamp(value).isoformat()
+    return row
+
+
 class Database:
     def __init__(self):
         # Создаем папку для базы данных, если её нет
@@ -17,63 +30,77 @@ class Database:
 
         self.db_path = config.DATABASE_PATH
         logger.info(f"📁 База данных: {os.path.abspath(self.db_path)}")
+
+        # Пул: одно долгоживущее соединение на поток
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
         self.init_db()
 
+    def _connect(self) -> sqlite3.Connection:
+        """Открыть соединение и настроить его под частые короткие запросы"""
+        conn = sqlite3.connect(
+            self.db_path,
+            cached_statements=config.SQLITE_STATEMENT_CACHE,
+            # Соединение используется только своим потоком; флаг нужен, чтобы close() мог закрыть его
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{config.SQLITE_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._connections_lock:
+            self._connections.append(conn)
+        logger.debug(f"🔌 Соединение с БД открыто (поток {threading.current_thread().name})")
+        return conn
+
     @contextmanager
     def get_connection(self):
-        conn = None
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            logger.debug("🔌 Соединение с БД открыто")
             yield conn
         except Exception as e:
             logger.error(f"❌ Ошибка БД: {e}")
+            if conn.in_transaction:
+                conn.rollback()
             raise
-        finally:
-            if conn:
-                conn.close()
-                logger.debug("🔌 Соединение с БД закрыто")
+
+    def close(self):
+        """Закрыть все соединения пула (при остановке сервера)"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+        logger.info(f"🔌 Пул БД закрыт ({len(connections)} соединений)")
 
     def init_db(self):
         try:
             with self.get_connection() as conn:
-                conn.executescript("""
-                    CREATE TABLE IF NOT EXISTS agents (
-                        id TEXT PRIMARY KEY,
-                        name TEXT NOT NULL,
-                        personality TEXT,
-                        mood REAL DEFAULT 0.5,
-                        location TEXT DEFAULT 'общая зона',
-                        created_at TIMESTAMP
-                    );
-
-                    CREATE TABLE IF NOT EXISTS memories (
-                        id TEXT PRIMARY KEY,
-                        agent_id TEXT,
-                        content TEXT,
-                        emotion TEXT,
-                        timestamp TIMESTAMP,
-                        FOREIGN KEY(agent_id) REFERENCES agents(id)
-                    );
-
-                    CREATE TABLE IF NOT EXISTS events (
-                        id TEXT PRIMARY KEY,
-                        content TEXT,
-                        agent_id TEXT,
-                        type TEXT,
-                        timestamp TIMESTAMP
-                    );
-                """)
-                conn.commit()
-                logger.info("✅ Таблицы созданы или уже существуют")
+                version = migrate(conn)
+                logger.info(f"✅ Схема БД актуальна (версия {version})")
         except Exception as e:
-            logger.error(f"❌ Ошибка при создании таблиц: {e}")
+            logger.error(f"❌ Ошибка при миграции БД: {e}")
 
     def execute(self, query: str, params: tuple = ()):
+        """Выполнить запрос с commit; вернуть rowid вставленной строки (для INSERT)"""
         logger.debug(f"⚡ SQL Execute: {query[:50]}...")
         with self.get_connection() as conn:
-            conn.execute(query, params)
+            cursor = conn.execute(query, params)
+            conn.commit()
+            return cursor.lastrowid
+
+    @contextmanager
+    def transaction(self):
+        """Несколько запросов в одной транзакции: commit в конце, rollback при ошибке"""
+        with self.get_connection() as conn:
+            yield conn
             conn.commit()
 
     def fetch_one(self, query: str, params: tuple = ()):
@@ -88,5 +115,16 @@ class Database:
             rows = conn.execute(query, params).fetchall()
             return [dict(row) for row in rows]
 
+    # Async-варианты: запрос выполняется в потоке пула, event loop не ждёт диск
+
+    async def execute_async(self, query: str, params: tuple = ()):
+        return await asyncio.to_thread(self.execute, query, params)
+
+    async def fetch_one_async(self, query: str, params: tuple = ()):
+        return await asyncio.to_thread(self.fetch_one, query, params)
+
+    async def fetch_all_async(self, query: str, params: tuple = ()):
+        return await asyncio.to_thread(self.fetch_all, query, params)
+
 
 db = Database()
\ No newline at end of file
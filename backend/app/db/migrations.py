@@ -0,0 +1,255 @@
+"""
+Версионные миграции схемы БД.
+
+Каждая миграция выполняется ровно один раз в своей транзакции,
+номер применённой версии записывается в таблицу schema_version.
+Новая миграция = новая функция + строка в MIGRATIONS.
+"""
+
+import sqlite3
+import time
+from datetime import datetime
+
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _create_base_tables(conn: sqlite3.Connection):
+    """Исходные таблицы (раньше создавались в init_db)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS agents (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            personality TEXT,
+            mood REAL DEFAULT 0.5,
+            location TEXT DEFAULT 'общая зона',
+            created_at TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS memories (
+            id TEXT PRIMARY KEY,
+            agent_id TEXT,
+            content TEXT,
+            emotion TEXT,
+            timestamp TIMESTAMP,
+            FOREIGN KEY(agent_id) REFERENCES agents(id)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id TEXT PRIMARY KEY,
+            content TEXT,
+            agent_id TEXT,
+            type TEXT,
+            timestamp TIMESTAMP
+        )
+    """)
+
+
+def _normalize_timestamps(conn: sqlite3.Connection):
+    """
+    ISO-строки ('2026-02-17T20:23:43' и '2026-02-16 22:47:07') -> unix time (REAL).
+    Числа сортируются правильно и сравниваются без разбора строк.
+    """
+    for table, column in (("agents", "created_at"), ("memories", "timestamp"), ("events", "timestamp")):
+        rows = conn.execute(
+            f"SELECT rowid, {column} FROM {table} WHERE typeof({column}) = 'text'"
+        ).fetchall()
+
+        updates = []
+        for rowid, value in rows:
+            try:
+                updates.append((datetime.fromisoformat(value).timestamp(), rowid))
+            except ValueError:
+                logger.warning(f"⚠️ {table}.{column}: не удалось разобрать '{value}', оставляем как есть")
+
+        conn.executemany(f"UPDATE {table} SET {column} = ? WHERE rowid = ?", updates)
+        logger.info(f"🕐 {table}.{column}: нормализовано {len(updates)} записей")
+
+
+def _add_indexes(conn: sqlite3.Connection):
+    """Индексы под реальные запросы: лента событий, список агентов, память агента"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memories_agent_id ON memories(agent_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_agents_created_at ON agents(created_at)")
+
+
+def _create_chat_tail(conn: sqlite3.Connection):
+    """Append-only хвост общего чата: переживает перезапуск бэкенда"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            payload TEXT NOT NULL,
+            created_at REAL
+        )
+    """)
+
+
+def _create_conversation_history(conn: sqlite3.Connection):
+    """История диалогов агентов и их конспекты (раньше жили только в памяти)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_turns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            tokens INTEGER,
+            created_at REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_conversation_turns_agent ON conversation_turns(agent_id, id)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            agent_id TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            tokens INTEGER,
+            updated_at REAL
+        )
+    """)
+
+
+def _create_shared_state(conn: sqlite3.Connection):
+    """Общее состояние воркеров: счётчики/флаги и аренды для выбора лидера"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shared_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL,
+            updated_at REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+
+def _add_chat_rooms(conn: sqlite3.Connection):
+    """Чат по комнатам (локациям агентов): у каждой комнаты своя нумерация сообщений"""
+    conn.execute("ALTER TABLE chat_messages ADD COLUMN room TEXT NOT NULL DEFAULT 'общая зона'")
+    conn.execute("ALTER TABLE chat_messages ADD COLUMN room_seq INTEGER")
+    conn.execute("UPDATE chat_messages SET room_seq = seq")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_messages_room ON chat_messages(room, room_seq)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_rooms (
+            name TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL DEFAULT 0,
+            cleared INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # Курсоры клиентов общего чата продолжают расти с прежнего места
+    conn.execute("""
+        INSERT OR IGNORE INTO chat_rooms (name, last_seq)
+        SELECT 'общая зона', COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'chat_messages'), 0)
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_agents_location ON agents(location)")
+
+
+def _add_agent_emotions(conn: sqlite3.Connection):
+    """pleasure/arousal агента рядом с mood (модель Emotion)"""
+    conn.execute("ALTER TABLE agents ADD COLUMN pleasure REAL DEFAULT 0.5")
+    conn.execute("ALTER TABLE agents ADD COLUMN arousal REAL DEFAULT 0.3")
+    conn.execute("UPDATE agents SET pleasure = COALESCE(mood, 0.5)")
+
+
+def _create_interaction_graph(conn: sqlite3.Connection):
+    """Граф общения агентов: кто кому сколько раз ответил, и сохранённая раскладка"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS agent_interactions (
+            source TEXT NOT NULL,
+            target TEXT NOT NULL,
+            weight INTEGER NOT NULL DEFAULT 0,
+            last_at REAL,
+            PRIMARY KEY (source, target)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_agent_interactions_last_at ON agent_interactions(last_at)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS graph_layout (
+            agent_id TEXT PRIMARY KEY,
+            x REAL NOT NULL,
+            y REAL NOT NULL,
+            degree INTEGER NOT NULL DEFAULT 0,
+            strength INTEGER NOT NULL DEFAULT 0,
+            community INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+
+def _add_agent_state_seq(conn: sqlite3.Connection):
+    """Номер записи состояния агента: воркеры подтягивают только изменённые строки"""
+    conn.execute("ALTER TABLE agents ADD COLUMN state_seq INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_agents_state_seq ON agents(state_seq)")
+
+
+def _add_interaction_seq(conn: sqlite3.Connection):
+    """Номер изменения ребра графа: воркеры подтягивают рёбра по нему, а не по времени"""
+    conn.execute("ALTER TABLE agent_interactions ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_agent_interactions_seq ON agent_interactions(seq)")
+
+
+# (версия, описание, функция)
+MIGRATIONS = [
+    (1, "базовые таблицы", _create_base_tables),
+    (2, "timestamp -> unix time", _normalize_timestamps),
+    (3, "индексы events/memories/agents", _add_indexes),
+    (4, "таблица chat_messages", _create_chat_tail),
+    (5, "история диалогов агентов", _create_conversation_history),
+    (6, "общее состояние воркеров", _create_shared_state),
+    (7, "комнаты чата", _add_chat_rooms),
+    (8, "pleasure/arousal агентов", _add_agent_emotions),
+    (9, "граф общения агентов", _create_interaction_graph),
+    (10, "номер записи состояния агентов", _add_agent_state_seq),
+    (11, "номер изменения рёбер графа", _add_interaction_seq),
+]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    """Текущая версия схемы (0 - миграции ещё не применялись)"""
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Применить все новые миграции, вернуть итоговую версию схемы"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at REAL
+        )
+    """)
+    conn.commit()
+
+    current = get_version(conn)
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+
+        try:
+            # IMMEDIATE: несколько воркеров стартуют разом - миграцию применяет один,
+            # остальные ждут блокировку и видят, что версия уже новая
+            conn.execute("BEGIN IMMEDIATE")
+            if get_version(conn) >= version:
+                conn.commit()
+                current = version
+                continue
+            logger.info(f"🛠️ Миграция {version}: {description}")
+            apply(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, time.time())
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"❌ Миграция {version} не применена")
+            raise
+        current = version
+
+    return current
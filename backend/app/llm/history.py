@@ -0,0 +1,268 @@
+"""
+История диалогов агентов.
+
+У каждого агента - буфер фиксированной длины (deque с maxlen) из компактных
+реплик и его конспект. В памяти держим только недавно активных агентов (LRU),
+остальные поднимаются из SQLite при первом обращении. Каждая реплика сразу
+пишется в SQLite, так что история переживает перезапуск. Если историю агента
+дописал другой воркер, локальная копия сбрасывается и перечитывается.
+
+Запись в SQLite идёт в отдельном потоке (очередь, порядок сохраняется): append
+из event loop трогает только deque. Чтение истории с диска для async-кода -
+preload в потоке пула.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import partial
+from typing import List, NamedTuple, Optional
+
+from ..db.database import db
+from ..logger import get_logger
+from ..shared_state import shared_state
+from .tokens import token_counter
+
+logger = get_logger(__name__)
+
+
+class Turn(NamedTuple):
+    role: str
+    content: str
+    timestamp: float
+    tokens: int  # считаются один раз, при записи
+
+
+# Сколько ждать записи очереди при очистке истории, секунды
+CLEAR_WAIT = 10.0
+
+
+class _AgentHistory:
+    __slots__ = ("turns", "summary", "writes", "last_id", "pending", "stale")
+
+    def __init__(self, capacity: int):
+        self.turns = deque(maxlen=capacity)
+        self.summary = None  # {"text", "tokens", "updated_at"}
+        self.writes = 0  # реплик с последней чистки SQLite
+        self.last_id = 0  # id последней известной строки conversation_turns
+        self.pending = 0  # реплик в очереди на запись
+        self.stale = False  # другой воркер дописал историю - перечитать, когда очередь запишется
+
+
+class HistoryStore:
+    def __init__(self, capacity: int, max_open: int):
+        self.capacity = capacity
+        self.max_open = max_open
+        self._open: "OrderedDict[str, _AgentHistory]" = OrderedDict()
+        self._lock = threading.RLock()
+
+        # Что уже видели в БД - чтобы замечать записи других воркеров
+        self._seen_turn_id = self._max_turn_id()
+        self._seen_summary_at = time.time()
+        self._epoch = shared_state.get("history_epoch")
+        shared_state.subscribe(self.refresh)
+
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def _max_turn_id() -> int:
+        try:
+            row = db.fetch_one("SELECT MAX(id) AS last_id FROM conversation_turns")
+        except Exception:
+            return 0
+        return (row and row["last_id"]) or 0
+
+    def _entry(self, agent_id: str) -> _AgentHistory:
+        """История агента из памяти или, при первом обращении, из SQLite (без блокировки)"""
+        with self._lock:
+            entry = self._open.get(agent_id)
+            if entry is not None:
+                self._open.move_to_end(agent_id)
+                return entry
+
+        loaded = self._load(agent_id)
+        with self._lock:
+            # Пока читали, историю мог открыть другой поток
+            entry = self._open.setdefault(agent_id, loaded)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+            return entry
+
+    async def preload(self, agent_id: str):
+        """Поднять историю агента в память, не блокируя event loop"""
+        with self._lock:
+            if agent_id in self._open:
+                return
+        await asyncio.to_thread(self._entry, agent_id)
+
+    def _load(self, agent_id: str) -> _AgentHistory:
+        entry = _AgentHistory(self.capacity)
+        try:
+            rows = db.fetch_all(
+                "SELECT id, role, content, tokens, created_at FROM conversation_turns "
+                "WHERE agent_id = ? ORDER BY id DESC LIMIT ?",
+                (agent_id, self.capacity)
+            )
+            summary = db.fetch_one(
+                "SELECT text, tokens, updated_at FROM conversation_summaries WHERE agent_id = ?", (agent_id,)
+            )
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить историю агента {agent_id}: {e}")
+            return entry
+
+        if rows:
+            entry.last_id = rows[0]["id"]
+        for row in reversed(rows):
+            tokens = row["tokens"] if row["tokens"] is not None else token_counter.count_message(row["content"])
+            entry.turns.append(Turn(row["role"], row["content"], row["created_at"], tokens))
+        if summary:
+            entry.summary = summary
+        return entry
+
+    def turns(self, agent_id: str) -> List[Turn]:
+        """Реплики агента, от старых к новым"""
+        entry = self._entry(agent_id)
+        with self._lock:
+            return list(entry.turns)
+
+    def append(self, agent_id: str, role: str, content: str) -> Optional[Turn]:
+        """Добавить реплику (в SQLite - через очередь записи); вернуть вытесненную из буфера (или None)"""
+        turn = Turn(role, content, time.time(), token_counter.count_message(content))
+        entry = self._entry(agent_id)
+        with self._lock:
+            evicted = entry.turns[0] if len(entry.turns) == self.capacity else None
+            entry.turns.append(turn)
+            entry.writes += 1
+            prune = entry.writes >= self.capacity
+            if prune:
+                entry.writes = 0
+            entry.pending += 1
+
+        self._writes.put(partial(self._write_turn, agent_id, entry, turn, prune))
+        return evicted
+
+    def _write_turn(self, agent_id: str, entry: _AgentHistory, turn: Turn, prune: bool):
+        last_id = None
+        try:
+            last_id = db.execute(
+                "INSERT INTO conversation_turns (agent_id, role, content, tokens, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (agent_id, turn.role, turn.content, turn.tokens, turn.timestamp)
+            )
+            if prune:
+                # В SQLite держим столько же, сколько в буфере
+                db.execute(
+                    "DELETE FROM conversation_turns WHERE agent_id = ? AND id < "
+                    "(SELECT id FROM conversation_turns WHERE agent_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (agent_id, agent_id, self.capacity - 1)
+                )
+        except Exception as e:
+            logger.error(f"❌ Реплика агента {agent_id} не сохранена в БД: {e}")
+
+        with self._lock:
+            if last_id:
+                entry.last_id = max(entry.last_id, last_id)
+            entry.pending -= 1
+            if entry.stale and not entry.pending and self._open.get(agent_id) is entry:
+                del self._open[agent_id]
+
+    def _write_loop(self):
+        while True:
+            job = self._writes.get()
+            if job is None:
+                return
+            try:
+                job()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи истории: {e}")
+
+    def close(self):
+        """Дописать очередь и остановить поток записи (при остановке сервера)"""
+        if self._writer is None:
+            return
+        self._writes.put(None)
+        self._writer.join()
+        self._writer = None
+
+    def summary(self, agent_id: str) -> Optional[dict]:
+        return self._entry(agent_id).summary
+
+    def set_summary(self, agent_id: str, text: str, tokens: int):
+        summary = {"text": text, "tokens": tokens, "updated_at": time.time()}
+        entry = self._entry(agent_id)
+        with self._lock:
+            entry.summary = summary
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO conversation_summaries (agent_id, text, tokens, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (agent_id, text, tokens, summary["updated_at"])
+            )
+        except Exception as e:
+            logger.error(f"❌ Конспект агента {agent_id} не сохранён в БД: {e}")
+
+    def clear(self, agent_id: str):
+        """Забыть историю и конспект агента (в памяти, в БД и у других воркеров)"""
+        with self._lock:
+            self._open.pop(agent_id, None)
+        # Через очередь: реплики, поставленные раньше, не воскреснут после удаления
+        done = threading.Event()
+        self._writes.put(partial(self._delete, agent_id, done))
+        if not done.wait(CLEAR_WAIT):
+            logger.warning(f"⚠️ Очистка истории агента {agent_id} ещё в очереди записи")
+
+    @staticmethod
+    def _delete(agent_id: str, done: threading.Event):
+        try:
+            with db.transaction() as conn:
+                conn.execute("DELETE FROM conversation_turns WHERE agent_id = ?", (agent_id,))
+                conn.execute("DELETE FROM conversation_summaries WHERE agent_id = ?", (agent_id,))
+            shared_state.incr("history_epoch")
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки истории агента {agent_id}: {e}")
+        finally:
+            done.set()
+
+    def refresh(self):
+        """Сбросить локальные копии историй, которые изменили другие воркеры"""
+        epoch = shared_state.get("history_epoch")
+        if epoch != self._epoch:
+            # Где-то удалили историю - проще перечитать всех лениво
+            with self._lock:
+                self._open.clear()
+                self._epoch = epoch
+
+        turns = db.fetch_all(
+            "SELECT agent_id, MAX(id) AS last_id FROM conversation_turns WHERE id > ? GROUP BY agent_id",
+            (self._seen_turn_id,)
+        )
+        summaries = db.fetch_all(
+            "SELECT agent_id, updated_at FROM conversation_summaries WHERE updated_at > ?",
+            (self._seen_summary_at,)
+        )
+        with self._lock:
+            for row in turns:
+                entry = self._open.get(row["agent_id"])
+                if entry is not None and entry.last_id < row["last_id"]:
+                    if entry.pending:
+                        # Возможно, это наши же реплики; перечитаем, когда очередь запишется
+                        entry.stale = True
+                    else:
+                        del self._open[row["agent_id"]]
+                self._seen_turn_id = max(self._seen_turn_id, row["last_id"])
+            for row in summaries:
+                entry = self._open.get(row["agent_id"])
+                known = entry.summary["updated_at"] if entry is not None and entry.summary else 0
+                if entry is not None and known < row["updated_at"]:
+                    del self._open[row["agent_id"]]
+                self._seen_summary_at = max(self._seen_summary_at, row["updated_at"])
+
+    @property
+    def open_count(self) -> int:
+        """Сколько агентов сейчас держим в памяти"""
+        return len(self._open)
+
@@ -1,7 +1,12 @@
-from mistralai import Mistral
 from ..config import config
 from ..logger import get_logger
-import time
+from .history import HistoryStore
+from .providers import build_provider
+from .scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, build_scheduler
+from .summary import build_summarizer
+from .tokens import token_counter
+from typing import Tuple
+import asyncio
 import random
 
 logger = get_logger(__name__)
@@ -12,56 +17,89 @@ class MistralClient:
         self.api_key = config.MISTRAL_API_KEY
         self.model = config.MISTRAL_MODEL
 
-        # Хранилище истории разговоров
-        self.conversation_history = {}
+        # История разговоров: буфер на агента, LRU в памяти, копия в SQLite
         self.max_history = 15
+        self.history = HistoryStore(self.max_history, max_open=config.HISTORY_OPEN_AGENTS)
+        # Бюджет входных токенов на запрос: system + контекст + история + промпт
+        self.input_budget = config.LLM_INPUT_TOKEN_BUDGET
 
-        if self.api_key:
-            try:
-                self.client = Mistral(api_key=self.api_key)
-                logger.info("✅ Mistral AI клиент инициализирован")
-            except Exception as e:
-                logger.error(f"❌ Ошибка инициализации Mistral: {e}")
-                self.client = None
-        else:
-            logger.warning("⚠️ API ключ Mistral не найден")
-            self.client = None
+        # Async-запросы идут через очередь с приоритетами и лимитами RPS/TPM
+        self.timeout = config.LLM_TIMEOUT
+        self.scheduler = build_scheduler()
 
-    def generate(self, agent_id: str, prompt: str, system: str = None,
-                 temperature: float = 0.8) -> str:
-        """Генерация с более живыми настройками"""
-        if not self.client:
-            return self._fallback_response()
+        # Кто отвечает: живой Mistral, запись в ленту или воспроизведение (LLM_PROVIDER)
+        self.provider = build_provider()
+
+        # Вытесненные из истории реплики сворачиваются в конспект, а не теряются
+        self.summarizer = build_summarizer(self.history, self.provider)
+
+    def _build_messages(self, agent_id: str, prompt: str, system: str = None,
+                        context: str = "") -> Tuple[list, int]:
+        """
+        Собрать список сообщений под бюджет input_budget токенов.
 
-        messages = []
+        system (с конспектом ранней истории) и промпт идут всегда. Контекст (чат, воспоминания) нужен только
+        этому запросу: он приклеивается к промпту и при нехватке места урезается
+        со старых строк. История - сколько влезет в остаток, от свежих к старым.
+        Возвращает (сообщения, входных токенов).
+        """
+        remaining = self.input_budget - token_counter.count_message(prompt)
         if system:
-            messages.append({"role": "system", "content": system})
+            remaining -= token_counter.count_message(system)
 
-        # Добавляем историю
-        if agent_id in self.conversation_history:
-            for msg in self.conversation_history[agent_id][-8:]:  # последние 8 сообщений
-                messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
+        # Конспект меняется редко, его токены посчитаны заранее
+        summary = self.summarizer.get(agent_id)
+        if summary:
+            system = f"{system or ''}\n\nРаньше в разговоре:\n{summary['text']}".lstrip()
+            remaining -= summary["tokens"] + 1
 
-        messages.append({"role": "user", "content": prompt})
+        if context:
+            context = token_counter.truncate_lines(context, max(0, remaining))
+            remaining -= token_counter.count(context)
+        content = f"{context}\n\n{prompt}" if context else prompt
 
-        try:
-            start_time = time.time()
+        history = []
+        for turn in reversed(self.history.turns(agent_id)):
+            if turn.tokens > remaining:
+                break
+            history.append({"role": turn.role, "content": turn.content})
+            remaining -= turn.tokens
+        history.reverse()
+        # Урезанная история не должна начинаться с ответа ассистента
+        if history and history[0]["role"] == "assistant":
+            history.pop(0)
 
-            response = self.client.chat.complete(
+        messages = [{"role": "system", "content": system}] if system else []
+        messages.extend(history)
+        messages.append({"role": "user", "content": content})
+        return messages, self.input_budget - remaining
+
+    def generate(self, agent_id: str, prompt: str, system: str = None,
+                 temperature: float = 0.8, context: str = "",
+                 history_text: str = None) -> str:
+        """
+        Генерация с более живыми настройками.
+
+        context уходит только в этот запрос; в историю попадает history_text
+        (короткая реплика) или, если он не задан, сам prompt.
+        """
+        if not self.provider:
+            return self._fallback_response()
+
+        messages, _ = self._build_messages(agent_id, prompt, system, context)
+
+        try:
+            answer = self.provider.complete(
                 model=self.model,
                 messages=messages,
                 temperature=temperature,  # Выше = креативнее
                 max_tokens=500,
-                top_p=0.9  # Добавляем разнообразия
+                top_p=0.9,  # Добавляем разнообразия
+                timeout=self.timeout
             )
 
-            answer = response.choices[0].message.content
-
             # Сохраняем в историю
-            self._add_to_history(agent_id, "user", prompt)
+            self._add_to_history(agent_id, "user", history_text or prompt)
             self._add_to_history(agent_id, "assistant", answer)
 
             return answer
@@ -70,19 +108,122 @@ class MistralClient:
             logger.error(f"❌ Ошибка Mistral: {e}")
             return self._fallback_response()
 
+    async def generate_async(self, agent_id: str, prompt: str, system: str = None,
+                             temperature: float = 0.8, context: str = "",
+                             history_text: str = None,
+                             priority: int = PRIORITY_BACKGROUND,
+                             remember: bool = True) -> str:
+        """
+        Асинхронная генерация: не блокирует event loop.
+
+        Запрос ждёт своей очереди в планировщике (priority: PRIORITY_INTERACTIVE
+        обгоняет PRIORITY_BACKGROUND), сам вызов API ограничен LLM_TIMEOUT
+        секундами, на 429 - повторы. context и history_text - как у generate.
+        remember=False - ответ в историю не пишется (кандидат, который может не
+        понадобиться); вызывающий добавит его сам через remember().
+        """
+        if not self.provider:
+            return self._fallback_response()
+
+        await self.history.preload(agent_id)
+        messages, input_tokens = self._build_messages(agent_id, prompt, system, context)
+
+        def call():
+            return asyncio.wait_for(
+                self.provider.complete_async(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=500,
+                    top_p=0.9,
+                    timeout=self.timeout
+                ),
+                timeout=self.timeout
+            )
+
+        try:
+            answer = await self.scheduler.submit(call, priority=priority, tokens=input_tokens)
+
+            if remember:
+                self.remember(agent_id, history_text or prompt, answer)
+
+            return answer
+
+        except asyncio.TimeoutError:
+            logger.warning(f"⏳ Mistral не ответил за {self.timeout:.0f}с (агент {agent_id})")
+            return self._fallback_response()
+        except Exception as e:
+            logger.error(f"❌ Ошибка Mistral: {e}")
+            return self._fallback_response()
+
+    async def generate_stream(self, agent_id: str, prompt: str, system: str = None,
+                              temperature: float = 0.8, context: str = "",
+                              history_text: str = None,
+                              priority: int = PRIORITY_INTERACTIVE):
+        """
+        Потоковая генерация: async-генератор кусков ответа по мере прихода.
+
+        Параметры - как у generate_async. В историю ответ попадает, только
+        когда поток дошёл до конца. Ошибка до первого куска - заглушка,
+        после - поток просто обрывается на том, что успели получить.
+        """
+        if not self.provider:
+            yield self._fallback_response()
+            return
+
+        await self.history.preload(agent_id)
+        messages, input_tokens = self._build_messages(agent_id, prompt, system, context)
+
+        def open_stream():
+            return asyncio.wait_for(
+                self.provider.stream_async(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=500,
+                    top_p=0.9,
+                    timeout=self.timeout
+                ),
+                timeout=self.timeout
+            )
+
+        parts = []
+        try:
+            async for piece in self.scheduler.stream(open_stream, priority=priority, tokens=input_tokens):
+                parts.append(piece)
+                yield piece
+        except asyncio.TimeoutError:
+            logger.warning(f"⏳ Mistral не начал отвечать за {self.timeout:.0f}с (агент {agent_id})")
+        except Exception as e:
+            logger.error(f"❌ Ошибка потока Mistral: {e}")
+
+        if not parts:
+            yield self._fallback_response()
+            return
+
+        self._add_to_history(agent_id, "user", history_text or prompt)
+        self._add_to_history(agent_id, "assistant", "".join(parts))
+
+    def remember(self, agent_id: str, said: str, answer: str):
+        """Записать в историю агента реплику собеседника и его ответ"""
+        self._add_to_history(agent_id, "user", said)
+        self._add_to_history(agent_id, "assistant", answer)
+
     def _add_to_history(self, agent_id: str, role: str, content: str):
-        """Добавить в историю"""
-        if agent_id not in self.conversation_history:
-            self.conversation_history[agent_id] = []
+        """Добавить в историю; вытесненная реплика уходит в конспект"""
+        evicted = self.history.append(agent_id, role, content)
+        if evicted:
+            self.summarizer.fold(agent_id, [evicted])
 
-        self.conversation_history[agent_id].append({
-            "role": role,
-            "content": content,
-            "timestamp": time.time()
-        })
+    def clear_history(self, agent_id: str):
+        """Забыть историю и конспект агента"""
+        self.summarizer.forget(agent_id)
+        self.history.clear(agent_id)
 
-        if len(self.conversation_history[agent_id]) > self.max_history:
-            self.conversation_history[agent_id] = self.conversation_history[agent_id][-self.max_history:]
+    def close(self):
+        """Остановить фоновое сворачивание истории и дописать её в БД (при остановке сервера)"""
+        self.summarizer.close()
+        self.history.close()
 
     def _fallback_response(self):
         """Живые заглушки на случай ошибки"""
@@ -98,9 +239,9 @@ class MistralClient:
         ]
         return random.choice(responses)
 
-    def agent_response(self, agent_id: str, agent_name: str, personality: str,
-                       message: str, context: str = "") -> str:
-        """Ответ агента с живым характером"""
+    def _agent_prompts(self, agent_name: str, personality: str,
+                       message: str, context: str = "") -> tuple:
+        """Системный промпт и текст запроса для ответа агента"""
 
         # Настраиваем систему под характер
         system_prompts = {
@@ -127,13 +268,51 @@ class MistralClient:
 
         full_prompt = message
         if context:
-            full_prompt = f"{context}\n\nТеперь {agent_name}, {message}"
+            full_prompt = f"Теперь {agent_name}, {message}"
 
+        return system, full_prompt
+
+    def agent_response(self, agent_id: str, agent_name: str, personality: str,
+                       message: str, context: str = "") -> str:
+        """Ответ агента с живым характером"""
+        system, full_prompt = self._agent_prompts(agent_name, personality, message, context)
         return self.generate(
             agent_id=agent_id,
             prompt=full_prompt,
             system=system,
-            temperature=0.85  # Чуть выше для живости
+            temperature=0.85,  # Чуть выше для живости
+            context=context,
+            history_text=message
+        )
+
+    async def agent_response_async(self, agent_id: str, agent_name: str, personality: str,
+                                   message: str, context: str = "",
+                                   priority: int = PRIORITY_INTERACTIVE) -> str:
+        """Асинхронный вариант agent_response"""
+        system, full_prompt = self._agent_prompts(agent_name, personality, message, context)
+        return await self.generate_async(
+            agent_id=agent_id,
+            prompt=full_prompt,
+            system=system,
+            temperature=0.85,
+            context=context,
+            history_text=message,
+            priority=priority
+        )
+
+    def agent_response_stream(self, agent_id: str, agent_name: str, personality: str,
+                              message: str, context: str = "",
+                              priority: int = PRIORITY_INTERACTIVE):
+        """Потоковый вариант agent_response: async-генератор кусков ответа"""
+        system, full_prompt = self._agent_prompts(agent_name, personality, message, context)
+        return self.generate_stream(
+            agent_id=agent_id,
+            prompt=full_prompt,
+            system=system,
+            temperature=0.85,
+            context=context,
+            history_text=message,
+            priority=priority
         )
 
 llm = MistralClient()
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""
+Локальная заглушка Mistral chat completions для нагрузочных тестов.
+
+Запуск:
+    cd backend
+    MOCK_PROFILE=flaky uvicorn app.llm.mock_server:app --port 8001
+
+и в .env бэкенда:
+    MISTRAL_API_KEY=mock
+    MISTRAL_SERVER_URL=http://localhost:8001
+
+Профиль (задержки, лимиты, ошибки) задаётся переменными MOCK_* или
+пресетом MOCK_PROFILE, и меняется на лету через POST /mock/profile.
+Статистика - GET /mock/stats.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from pydantic_settings import BaseSettings
+
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class MockProfile(BaseModel):
+    # Задержка до ответа (для стрима - до первого токена)
+    latency: str = "lognormal"  # fixed, uniform, lognormal
+    latency_ms: float = 800.0  # fixed: значение; uniform: середина; lognormal: медиана
+    latency_spread: float = 0.5  # uniform: ±доля от latency_ms; lognormal: sigma
+    # Скорость генерации: влияет на длительность стрима и обычного ответа
+    tokens_per_sec: float = 60.0
+    reply_tokens: int = 30
+    # Пропускная способность: сверх лимита - 429
+    max_rps: float = 0.0  # 0 - без ограничения
+    max_concurrent: int = 0  # 0 - без ограничения
+    # Случайные сбои
+    error_429_rate: float = 0.0
+    error_5xx_rate: float = 0.0
+
+
+PRESETS = {
+    "fast": MockProfile(latency="fixed", latency_ms=50, tokens_per_sec=1000),
+    "normal": MockProfile(),
+    "slow": MockProfile(latency_ms=4000, latency_spread=0.8, tokens_per_sec=20),
+    "flaky": MockProfile(error_429_rate=0.1, error_5xx_rate=0.05),
+    "rate_limited": MockProfile(max_rps=2, max_concurrent=4),
+}
+
+
+class MockSettings(BaseSettings):
+    MOCK_PROFILE: str = "normal"
+    MOCK_LATENCY: Optional[str] = None
+    MOCK_LATENCY_MS: Optional[float] = None
+    MOCK_LATENCY_SPREAD: Optional[float] = None
+    MOCK_TOKENS_PER_SEC: Optional[float] = None
+    MOCK_REPLY_TOKENS: Optional[int] = None
+    MOCK_MAX_RPS: Optional[float] = None
+    MOCK_MAX_CONCURRENT: Optional[int] = None
+    MOCK_ERROR_429_RATE: Optional[float] = None
+    MOCK_ERROR_5XX_RATE: Optional[float] = None
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
+    def profile(self) -> MockProfile:
+        """Пресет + точечные переопределения из MOCK_*"""
+        base = PRESETS.get(self.MOCK_PROFILE, PRESETS["normal"])
+        overrides = {
+            field: getattr(self, f"MOCK_{field.upper()}")
+            for field in MockProfile.model_fields
+            if getattr(self, f"MOCK_{field.upper()}") is not None
+        }
+        return base.model_copy(update=overrides)
+
+
+PHRASES = [
+    "Слушай, ну это вообще интересно.",
+    "Хм, я бы сказал иначе, но ладно.",
+    "О, а я как раз об этом думал!",
+    "Да ладно, серьёзно? :)",
+    "Ну такое, если честно.",
+    "Согласен, звучит разумно.",
+    "А что, если попробовать по-другому?",
+    "Симуляция сегодня странная, не находите?",
+]
+
+
+class MockState:
+    def __init__(self, profile: MockProfile):
+        self.profile = profile
+        self.in_flight = 0
+        self._tokens = 0.0
+        self._refilled = time.monotonic()
+        self.stats = {"requests": 0, "ok": 0, "streams": 0, "429": 0, "5xx": 0}
+
+    def take_rate_token(self) -> bool:
+        """Token bucket на max_rps (ёмкость - одна секунда запросов)"""
+        rps = self.profile.max_rps
+        if rps <= 0:
+            return True
+        now = time.monotonic()
+        self._tokens = min(rps, self._tokens + (now - self._refilled) * rps)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def sample_latency(self) -> float:
+        p = self.profile
+        if p.latency == "fixed":
+            ms = p.latency_ms
+        elif p.latency == "uniform":
+            ms = random.uniform(p.latency_ms * (1 - p.latency_spread), p.latency_ms * (1 + p.latency_spread))
+        else:
+            ms = random.lognormvariate(0, p.latency_spread) * p.latency_ms
+        return max(0.0, ms) / 1000
+
+
+state = MockState(MockSettings().profile())
+app = FastAPI(title="Mock Mistral")
+
+
+def _reply_tokens(messages: list) -> list:
+    """Детерминированный по промпту ответ, нарезанный на 'токены'-слова"""
+    last = messages[-1].get("content", "") if messages else ""
+    seed = int(hashlib.md5(str(last).encode("utf-8")).hexdigest(), 16)
+    rng = random.Random(seed)
+    words = []
+    while len(words) < state.profile.reply_tokens:
+        words.extend(rng.choice(PHRASES).split())
+    return words[:state.profile.reply_tokens]
+
+
+def _error(status: int, message: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status,
+        content={"object": "error", "message": message, "type": "mock_error", "code": str(status)},
+    )
+
+
+def _usage(messages: list, completion_tokens: int) -> dict:
+    prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "mock")
+    profile = state.profile
+    state.stats["requests"] += 1
+
+    if not state.take_rate_token() or (profile.max_concurrent and state.in_flight >= profile.max_concurrent):
+        state.stats["429"] += 1
+        return _error(429, "Requests rate limit exceeded")
+    if random.random() < profile.error_429_rate:
+        state.stats["429"] += 1
+        return _error(429, "Service tier capacity exceeded for this model.")
+    if random.random() < profile.error_5xx_rate:
+        state.stats["5xx"] += 1
+        return _error(random.choice([500, 502, 503]), "Internal server error")
+
+    tokens = _reply_tokens(messages)
+    completion_id = uuid.uuid4().hex
+    created = int(time.time())
+    token_delay = 1 / profile.tokens_per_sec if profile.tokens_per_sec > 0 else 0.0
+
+    if body.get("stream"):
+        state.stats["streams"] += 1
+
+        async def events():
+            state.in_flight += 1
+            try:
+                await asyncio.sleep(state.sample_latency())
+                for i, token in enumerate(tokens):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "model": model,
+                        "created": created,
+                        "choices": [{
+                            "index": 0,
+                            "delta": {"role": "assistant", "content": token if i == 0 else " " + token},
+                            "finish_reason": None,
+                        }],
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    await asyncio.sleep(token_delay)
+                final = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "created": created,
+                    "choices": [{"index": 0, "delta": {"content": ""}, "finish_reason": "stop"}],
+                    "usage": _usage(messages, len(tokens)),
+                }
+                yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+                state.stats["ok"] += 1
+            finally:
+                state.in_flight -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    state.in_flight += 1
+    try:
+        await asyncio.sleep(state.sample_latency() + token_delay * len(tokens))
+    finally:
+        state.in_flight -= 1
+
+    state.stats["ok"] += 1
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "model": model,
+        "created": created,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": " ".join(tokens)},
+            "finish_reason": "stop",
+        }],
+        "usage": _usage(messages, len(tokens)),
+    }
+
+
+@app.get("/mock/stats")
+def get_stats():
+    return {**state.stats, "in_flight": state.in_flight, "profile": state.profile.model_dump()}
+
+
+@app.post("/mock/profile")
+def set_profile(profile: Optional[MockProfile] = None, preset: Optional[str] = None):
+    """Сменить профиль на лету: ?preset=slow или JSON с полями MockProfile"""
+    if preset in PRESETS:
+        state.profile = PRESETS[preset]
+    elif profile is not None:
+        state.profile = profile
+    else:
+        return _error(400, f"Нужен JSON профиля или preset из {list(PRESETS)}")
+    logger.info(f"🧪 Профиль mock-сервера: {state.profile.model_dump()}")
+    return state.profile.model_dump()
@@ -0,0 +1,264 @@
+"""
+Провайдеры LLM: кто на самом деле отвечает на chat-запросы.
+
+- mistral - живой Mistral API
+- record  - Mistral + запись пар запрос/ответ и задержек в файл-ленту
+- replay  - ответы из ленты без сети, с исходными (или масштабированными) задержками
+
+Лента - JSONL, по строке на ответ: {"k": хэш запроса, "r": ответ, "t": секунды}.
+Полные промпты не пишем: для воспроизведения хватает хэша, а файл остаётся маленьким.
+"""
+
+import abc
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from mistralai import Mistral
+
+from ..config import config
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def request_key(model: str, messages: list, temperature: float, max_tokens: int, top_p: float) -> str:
+    """Короткий стабильный хэш запроса"""
+    payload = json.dumps(
+        [model, messages, round(temperature, 3), max_tokens, round(top_p, 3)],
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _open_tape(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class LLMProvider(abc.ABC):
+    """Общий интерфейс: по списку сообщений вернуть текст ответа"""
+    name = "base"
+
+    @abc.abstractmethod
+    def complete(self, model: str, messages: list, temperature: float,
+                 max_tokens: int, top_p: float, timeout: float) -> str:
+        ...
+
+    @abc.abstractmethod
+    async def complete_async(self, model: str, messages: list, temperature: float,
+                             max_tokens: int, top_p: float, timeout: float) -> str:
+        ...
+
+    async def stream_async(self, model: str, messages: list, temperature: float,
+                           max_tokens: int, top_p: float, timeout: float):
+        """
+        Открыть потоковый ответ: вернуть async-итератор кусков текста.
+        Ошибки соединения (в т.ч. 429) - здесь, до первого куска.
+        По умолчанию - весь ответ одним куском.
+        """
+        answer = await self.complete_async(model, messages, temperature, max_tokens, top_p, timeout)
+
+        async def pieces():
+            yield answer
+        return pieces()
+
+
+class MistralProvider(LLMProvider):
+    name = "mistral"
+
+    def __init__(self, api_key: str, server_url: str = ""):
+        self.client = Mistral(api_key=api_key, server_url=server_url or None)
+
+    def complete(self, model, messages, temperature, max_tokens, top_p, timeout):
+        response = self.client.chat.complete(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            timeout_ms=int(timeout * 1000)
+        )
+        return response.choices[0].message.content
+
+    async def complete_async(self, model, messages, temperature, max_tokens, top_p, timeout):
+        response = await self.client.chat.complete_async(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            timeout_ms=int(timeout * 1000)
+        )
+        return response.choices[0].message.content
+
+    async def stream_async(self, model, messages, temperature, max_tokens, top_p, timeout):
+        stream = await self.client.chat.stream_async(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            timeout_ms=int(timeout * 1000)
+        )
+
+        async def pieces():
+            async with stream as events:
+                async for event in events:
+                    if not event.data.choices:
+                        continue
+                    content = event.data.choices[0].delta.content
+                    if isinstance(content, str):
+                        if content:
+                            yield content
+                    elif content:
+                        yield "".join(getattr(chunk, "text", "") for chunk in content)
+        return pieces()
+
+
+class RecordingProvider(LLMProvider):
+    """Проксирует запросы во внутренний провайдер и пишет ответы в ленту"""
+    name = "record"
+
+    def __init__(self, inner: LLMProvider, path: str):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+        tape_dir = os.path.dirname(path)
+        if tape_dir:
+            os.makedirs(tape_dir, exist_ok=True)
+
+    def _record(self, key: str, answer: str, latency: float):
+        line = json.dumps({"k": key, "r": answer, "t": round(latency, 3)}, ensure_ascii=False)
+        with self._lock:
+            with _open_tape(self.path, "a") as tape:
+                tape.write(line + "\n")
+
+    def complete(self, model, messages, temperature, max_tokens, top_p, timeout):
+        start = time.perf_counter()
+        answer = self.inner.complete(model, messages, temperature, max_tokens, top_p, timeout)
+        self._record(request_key(model, messages, temperature, max_tokens, top_p),
+                     answer, time.perf_counter() - start)
+        return answer
+
+    async def complete_async(self, model, messages, temperature, max_tokens, top_p, timeout):
+        start = time.perf_counter()
+        answer = await self.inner.complete_async(model, messages, temperature, max_tokens, top_p, timeout)
+        self._record(request_key(model, messages, temperature, max_tokens, top_p),
+                     answer, time.perf_counter() - start)
+        return answer
+
+    async def stream_async(self, model, messages, temperature, max_tokens, top_p, timeout):
+        start = time.perf_counter()
+        inner = await self.inner.stream_async(model, messages, temperature, max_tokens, top_p, timeout)
+
+        async def pieces():
+            parts = []
+            async for piece in inner:
+                parts.append(piece)
+                yield piece
+            # В ленту - только полностью полученный ответ
+            self._record(request_key(model, messages, temperature, max_tokens, top_p),
+                         "".join(parts), time.perf_counter() - start)
+        return pieces()
+
+
+class ReplayProvider(LLMProvider):
+    """
+    Отвечает из ленты. Совпал хэш запроса - отдаём записанный ответ
+    (повторы одного запроса - по очереди). Не совпал - следующий ответ
+    из ленты по кругу, чтобы прогон не останавливался.
+    """
+    name = "replay"
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self.path = path
+        self.speed = speed
+        self._by_key = defaultdict(deque)
+        self._sequence = []
+        self._position = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        with _open_tape(path, "r") as tape:
+            for line in tape:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._by_key[entry["k"]].append(entry)
+                self._sequence.append(entry)
+
+        if not self._sequence:
+            raise ValueError(f"Лента {path} пуста")
+        logger.info(f"📼 Лента LLM загружена: {len(self._sequence)} ответов, скорость x{speed}")
+
+    def _next(self, key: str) -> dict:
+        with self._lock:
+            entries = self._by_key.get(key)
+            if entries:
+                self.hits += 1
+                entry = entries[0]
+                entries.rotate(-1)
+                return entry
+
+            self.misses += 1
+            entry = self._sequence[self._position % len(self._sequence)]
+            self._position += 1
+            return entry
+
+    def complete(self, model, messages, temperature, max_tokens, top_p, timeout):
+        entry = self._next(request_key(model, messages, temperature, max_tokens, top_p))
+        time.sleep(entry["t"] * self.speed)
+        return entry["r"]
+
+    async def complete_async(self, model, messages, temperature, max_tokens, top_p, timeout):
+        entry = self._next(request_key(model, messages, temperature, max_tokens, top_p))
+        await asyncio.sleep(entry["t"] * self.speed)
+        return entry["r"]
+
+    async def stream_async(self, model, messages, temperature, max_tokens, top_p, timeout):
+        entry = self._next(request_key(model, messages, temperature, max_tokens, top_p))
+        words = entry["r"].split(" ")
+        delay = entry["t"] * self.speed / max(1, len(words))
+
+        async def pieces():
+            # Записанное время ответа растягиваем на слова
+            for i, word in enumerate(words):
+                await asyncio.sleep(delay)
+                yield word if i == 0 else " " + word
+        return pieces()
+
+
+def build_provider():
+    """Провайдер по LLM_PROVIDER; None - LLM недоступен (будут заглушки)"""
+    mode = config.LLM_PROVIDER.lower()
+
+    if mode == "replay":
+        try:
+            return ReplayProvider(config.LLM_TAPE_PATH, speed=config.LLM_REPLAY_SPEED)
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить ленту LLM {config.LLM_TAPE_PATH}: {e}")
+            return None
+
+    if not config.MISTRAL_API_KEY:
+        logger.warning("⚠️ API ключ Mistral не найден")
+        return None
+
+    try:
+        provider = MistralProvider(config.MISTRAL_API_KEY, config.MISTRAL_SERVER_URL)
+        logger.info(f"✅ Mistral AI клиент инициализирован{' (' + config.MISTRAL_SERVER_URL + ')' if config.MISTRAL_SERVER_URL else ''}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка инициализации Mistral: {e}")
+        return None
+
+    if mode == "record":
+        logger.info(f"📼 Запись ответов LLM в {config.LLM_TAPE_PATH}")
+        return RecordingProvider(provider, config.LLM_TAPE_PATH)
+    return provider
@@ -0,0 +1,226 @@
+"""
+Планировщик запросов к LLM.
+
+Все async-запросы проходят через одну очередь с приоритетами: прямые
+сообщения пользователя (INTERACTIVE) обгоняют фоновую болтовню агентов
+(BACKGROUND). Выпуск из очереди ограничен двумя token bucket - запросы
+в секунду и токены в минуту - и числом одновременных запросов.
+На 429 запрос повторяется с экспоненциальной паузой со случайным
+разбросом и снова встаёт в очередь со своим приоритетом.
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import defaultdict
+
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from ..config import config
+from ..logger import get_logger
+from .tokens import token_counter
+
+logger = get_logger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """429 от Mistral (SDK кладёт код ответа в status_code)"""
+    return getattr(error, "status_code", None) == 429
+
+
+class TokenBucket:
+    """Ведро на rate единиц в секунду, ёмкость capacity; 0 - без ограничения"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._level = capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Сколько секунд ждать, пока в ведре наберётся amount"""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        # Запрос больше ёмкости ждёт полного ведра, а не вечно
+        missing = min(amount, self.capacity) - self._level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        """Списать amount; уровень может уйти в минус (доплата за ответ)"""
+        if self.unlimited:
+            return
+        self._refill()
+        self._level -= amount
+
+
+class RequestScheduler:
+    def __init__(self, rps: float, tpm: float, max_concurrency: int,
+                 retry_attempts: int, backoff_max: float):
+        self.requests = TokenBucket(rps, max(1.0, rps))
+        self.tokens = TokenBucket(tpm / 60, tpm)
+        self.max_concurrency = max(1, max_concurrency)
+        self.retry_attempts = max(1, retry_attempts)
+        self.backoff_max = backoff_max
+
+        self._waiting = []  # куча [priority, seq]
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._changed = None  # asyncio.Event, создаётся внутри event loop
+
+        self.stats = defaultdict(int)
+        self._wait_total = defaultdict(float)  # priority -> суммарное ожидание в очереди
+
+    def _notify(self):
+        """Разбудить ждущих: что-то освободилось или очередь изменилась"""
+        if self._changed is not None:
+            self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _acquire(self, priority: int, tokens: int):
+        entry = [priority, next(self._seq)]
+        heapq.heappush(self._waiting, entry)
+        enqueued = time.monotonic()
+        try:
+            while True:
+                if self._changed is None:
+                    self._changed = asyncio.Event()
+                changed = self._changed
+
+                timeout = None
+                if self._waiting[0] is entry and self._in_flight < self.max_concurrency:
+                    timeout = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if timeout <= 0:
+                        heapq.heappop(self._waiting)
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        self._in_flight += 1
+                        self._wait_total[priority] += time.monotonic() - enqueued
+                        self.stats[f"started_{PRIORITY_NAMES[priority]}"] += 1
+                        self._notify()
+                        return
+
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # Отменили в очереди - убираем запись, чтобы не держать остальных
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._notify()
+            raise
+
+    def _release(self, extra_tokens: int = 0):
+        self._in_flight -= 1
+        self.tokens.take(extra_tokens)
+        self._notify()
+
+    async def submit(self, call, priority: int = PRIORITY_BACKGROUND, tokens: int = 0):
+        """
+        Выполнить call() (корутинную функцию, возвращающую текст) через очередь.
+
+        tokens - входные токены запроса; токены ответа доплачиваются по факту.
+        429 повторяется до retry_attempts раз, остальные ошибки - наружу.
+        """
+        retrying = AsyncRetrying(
+            retry=retry_if_exception(is_rate_limited),
+            wait=wait_random_exponential(multiplier=0.5, max=self.backoff_max),
+            stop=stop_after_attempt(self.retry_attempts),
+            before_sleep=self._on_retry,
+            reraise=True
+        )
+        async for attempt in retrying:
+            with attempt:
+                await self._acquire(priority, tokens)
+                answer = ""
+                try:
+                    answer = await call()
+                    return answer
+                except Exception as e:
+                    if is_rate_limited(e):
+                        self.stats["rate_limited"] += 1
+                    raise
+                finally:
+                    self._release(token_counter.count(answer or ""))
+
+    async def stream(self, open_stream, priority: int = PRIORITY_BACKGROUND, tokens: int = 0):
+        """
+        Как submit, но для потокового ответа: open_stream() открывает поток
+        (async-итератор кусков текста), слот занят, пока поток не кончится.
+        429 повторяется, только если ни одного куска ещё не отдали.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            await self._acquire(priority, tokens)
+            produced = []
+            try:
+                async for piece in await open_stream():
+                    produced.append(piece)
+                    yield piece
+                return
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                self.stats["rate_limited"] += 1
+                if produced or attempt >= self.retry_attempts:
+                    raise
+            finally:
+                self._release(token_counter.count("".join(produced)))
+
+            # Та же пауза, что у wait_random_exponential в submit
+            delay = random.uniform(0, min(self.backoff_max, 0.5 * 2 ** attempt))
+            self.stats["retries"] += 1
+            logger.warning(f"⏳ LLM: 429 на потоке, повтор {attempt} через {delay:.1f}с")
+            await asyncio.sleep(delay)
+
+    def _on_retry(self, retry_state):
+        self.stats["retries"] += 1
+        logger.warning(
+            f"⏳ LLM: 429, повтор {retry_state.attempt_number} через "
+            f"{retry_state.next_action.sleep:.1f}с"
+        )
+
+    def metrics(self) -> dict:
+        """Глубина очереди по приоритетам, запросы в работе, счётчики"""
+        queued = defaultdict(int)
+        for priority, _ in self._waiting:
+            queued[PRIORITY_NAMES[priority]] += 1
+        avg_wait = {
+            name: round(self._wait_total[priority] / self.stats[f"started_{name}"], 3)
+            for priority, name in PRIORITY_NAMES.items()
+            if self.stats[f"started_{name}"]
+        }
+        return {
+            "queued": dict(queued),
+            "in_flight": self._in_flight,
+            "avg_queue_wait": avg_wait,
+            **self.stats
+        }
+
+
+def build_scheduler() -> RequestScheduler:
+    return RequestScheduler(
+        rps=config.LLM_RPS,
+        tpm=config.LLM_TPM,
+        max_concurrency=config.LLM_MAX_CONCURRENCY,
+        retry_attempts=config.LLM_RETRY_ATTEMPTS,
+        backoff_max=config.LLM_BACKOFF_MAX
+    )
@@ -0,0 +1,132 @@
+"""
+Скользящий конспект разговора для агентов с длинной историей.
+
+Реплики, вытесненные из conversation_history, не выбрасываются, а копятся
+и в фоне сворачиваются в короткий конспект (дешёвая модель, LLM_SUMMARY_MODEL).
+Конспект хранится (в HistoryStore) готовым текстом с числом токенов и идёт в промпт
+неизменным префиксом, так что размер промпта не растёт с длиной разговора.
+Если LLM недоступен - конспект собирается из обрезанных реплик без модели.
+"""
+
+import threading
+from collections import defaultdict
+from typing import List
+
+from ..config import config
+from ..logger import get_logger
+from .history import Turn
+from .tokens import token_counter
+
+logger = get_logger(__name__)
+
+# Сколько символов реплики оставляет конспект без модели
+FALLBACK_TURN_CHARS = 120
+
+SUMMARY_SYSTEM = (
+    "Ты ведёшь краткий конспект разговора от лица его участника. "
+    "Пиши сжато, от первого лица, без вступлений."
+)
+
+
+class HistorySummarizer:
+    def __init__(self, store, provider, model: str, max_tokens: int, batch: int,
+                 interval: float, timeout: float):
+        self.store = store
+        self.provider = provider
+        self.model = model
+        self.max_tokens = max_tokens
+        self.batch = batch
+        self.interval = interval
+        self.timeout = timeout
+
+        self._evicted = defaultdict(list)  # agent_id -> вытесненные реплики, ещё не в конспекте
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._worker = threading.Thread(target=self._loop, name="history-summarizer", daemon=True)
+        self._worker.start()
+
+    def get(self, agent_id: str) -> dict:
+        """Текущий конспект агента: {"text", "tokens"} или None"""
+        return self.store.summary(agent_id)
+
+    def fold(self, agent_id: str, turns: List[Turn]):
+        """Поставить вытесненные реплики в очередь на сворачивание"""
+        if not turns:
+            return
+        with self._cond:
+            self._evicted[agent_id].extend(turns)
+            if len(self._evicted[agent_id]) >= self.batch:
+                self._cond.notify()
+
+    def forget(self, agent_id: str):
+        """Не сворачивать то, что ещё в очереди (сам конспект удаляет HistoryStore.clear)"""
+        with self._cond:
+            self._evicted.pop(agent_id, None)
+
+    def close(self):
+        """Остановить поток; остаток очереди сворачивается без модели"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._worker.join()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if not self._stopped and not any(len(t) >= self.batch for t in self._evicted.values()):
+                    self._cond.wait(self.interval)
+                stopped = self._stopped
+                work, self._evicted = self._evicted, defaultdict(list)
+
+            for agent_id, turns in work.items():
+                previous = self.store.summary(agent_id)
+                text = self._summarize(previous["text"] if previous else "", turns, use_llm=not stopped)
+                self.store.set_summary(agent_id, text, token_counter.count(text))
+            if stopped:
+                return
+
+    def _summarize(self, previous: str, turns: List[Turn], use_llm: bool = True) -> str:
+        lines = [
+            f"- Я: {turn.content}" if turn.role == "assistant" else f"- {turn.content}"
+            for turn in turns
+        ]
+        if use_llm and self.provider:
+            prompt = (
+                f"Прежний конспект:\n{previous or '(пусто)'}\n\n"
+                f"Новые реплики:\n" + "\n".join(lines) + "\n\n"
+                f"Обнови конспект: до {self.max_tokens // 2} слов, только факты, имена, "
+                f"договорённости и настроение. Выведи только конспект."
+            )
+            try:
+                summary = self.provider.complete(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": SUMMARY_SYSTEM},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.3,
+                    max_tokens=self.max_tokens,
+                    top_p=0.9,
+                    timeout=self.timeout
+                )
+                if summary:
+                    return token_counter.truncate_lines(summary.strip(), self.max_tokens)
+            except Exception as e:
+                logger.warning(f"⚠️ Конспект без модели, LLM не ответил: {e}")
+
+        # Запасной путь: обрезанные реплики, старые строки вытесняются новыми
+        short = [line[:FALLBACK_TURN_CHARS] for line in lines]
+        combined = "\n".join(([previous] if previous else []) + short)
+        return token_counter.truncate_lines(combined, self.max_tokens)
+
+
+def build_summarizer(store, provider) -> HistorySummarizer:
+    return HistorySummarizer(
+        store,
+        provider,
+        model=config.LLM_SUMMARY_MODEL,
+        max_tokens=config.LLM_SUMMARY_MAX_TOKENS,
+        batch=config.LLM_SUMMARY_BATCH,
+        interval=config.LLM_SUMMARY_INTERVAL,
+        timeout=config.LLM_TIMEOUT
+    )
@@ -0,0 +1,76 @@
+"""
+Подсчёт токенов для сборки промптов под бюджет.
+
+По умолчанию токены считаются грубой оценкой по длине текста. Для точного
+счёта LLM_TOKENIZER указывает на локальный tokenizer.json той модели, что
+стоит в MISTRAL_MODEL (имя репозитория на Hugging Face тоже подойдёт, но это
+загрузка по сети при каждом старте, а закрытые репозитории требуют токен HF).
+Загрузка идёт в фоне, чтобы не задерживать старт; пока токенизатора нет
+(или он недоступен) - считаем по длине.
+"""
+
+import os
+import threading
+from typing import List
+
+from ..config import config
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
+# Грубая оценка без токенизатора: у Mistral на кириллице ~3 символа на токен
+CHARS_PER_TOKEN = 3
+# Служебные токены на каждое сообщение чата (роль, разделители)
+MESSAGE_OVERHEAD = 4
+
+
+class TokenCounter:
+    def __init__(self, source: str = ""):
+        self.source = source
+        self._tokenizer = None
+        if source:
+            threading.Thread(target=self._load, name="tokenizer-loader", daemon=True).start()
+
+    def _load(self):
+        try:
+            from tokenizers import Tokenizer
+            if os.path.exists(self.source):
+                tokenizer = Tokenizer.from_file(self.source)
+            else:
+                tokenizer = Tokenizer.from_pretrained(self.source)
+            self._tokenizer = tokenizer
+            logger.info(f"🔤 Токенизатор загружен: {self.source}")
+        except Exception as e:
+            logger.warning(f"⚠️ Токенизатор {self.source} недоступен, токены считаются по длине текста: {e}")
+
+    @property
+    def exact(self) -> bool:
+        return self._tokenizer is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        tokenizer = self._tokenizer
+        if tokenizer is not None:
+            return len(tokenizer.encode(text, add_special_tokens=False).ids)
+        return len(text) // CHARS_PER_TOKEN + 1
+
+    def count_message(self, content: str) -> int:
+        return self.count(content) + MESSAGE_OVERHEAD
+
+    def truncate_lines(self, text: str, budget: int) -> str:
+        """Оставить последние строки текста, укладывающиеся в budget токенов"""
+        if self.count(text) <= budget:
+            return text
+        kept: List[str] = []
+        used = 0
+        for line in reversed(text.split("\n")):
+            cost = self.count(line) + 1
+            if used + cost > budget:
+                break
+            kept.append(line)
+            used += cost
+        return "\n".join(reversed(kept))
+
+
+token_counter = TokenCounter(config.LLM_TOKENIZER)
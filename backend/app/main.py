@@ -1,19 +1,28 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from datetime import datetime
+import asyncio
 import uuid
-import random
 import time
 
 from .config import config
-from .db.database import db
-from .agents.models import Agent
+from .db.database import db, format_timestamps
+from .agents.graph import interaction_graph
+from .agents.models import Agent, Emotion
+from .agents.registry import agent_registry
+from .agents.state import agent_state
 from .llm.mistral import llm
+from .memory.prefetch import format_memories, memory_prefetch
 from .memory.store import memory_store
 from .logger import get_logger, log_request, log_response, log_error
+from .chat.simulation import simulation
+from .chat.store import DEFAULT_ROOM, chat_rooms
+from .shared_state import shared_state
+from .versions import versions
 
 # Импортируем роутер чата
-from .api.chat import router as chat_router
+from .api.chat import router as chat_router, sse_frame, start_supervisor, stop_supervisor
 
 logger = get_logger(__name__)
 
@@ -64,11 +73,24 @@ async def startup_event():
     logger.info(f"📁 База данных: {config.DATABASE_PATH}")
     logger.info(f"🤖 Mistral AI: {'✅ Доступен' if config.MISTRAL_API_KEY else '❌ Не настроен'}")
     logger.info(f"📝 Логи пишутся в: {config.LOG_FILE}")
+    # Общее с другими воркерами: наблюдатель за БД и выборы лидера фонового общения
+    shared_state.start()
+    start_supervisor()
+    agent_state.start()
+    interaction_graph.start()
+    logger.info(f"🧩 Воркер {shared_state.worker_id}")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("👋 Сервер останавливается...")
+    await stop_supervisor()
+    shared_state.stop()
+    memory_store.close()
+    agent_state.close()
+    interaction_graph.close()
+    llm.close()
+    db.close()
 
 
 @app.get("/")
@@ -77,21 +99,28 @@ def root():
     return {
         "status": "ok",
         "mistral": bool(config.MISTRAL_API_KEY),
+        "llm_provider": llm.provider.name if llm.provider else None,
+        "memory_queue": memory_store.queue_depth,
+        "history_agents_open": llm.history.open_count,
+        "llm_scheduler": llm.scheduler.metrics(),
+        "simulation": simulation.metrics(),
+        "agent_state": agent_state.metrics(),
+        "agents_cached": len(agent_registry),
+        "graph": interaction_graph.metrics(),
+        "chat_rooms_open": chat_rooms.open_count,
         "time": datetime.now().isoformat()
     }
 
 
 @app.post("/agents")
-def create_agent(name: str, personality: str = "дружелюбный"):
-    logger.info(f"✨ Создание нового агента: {name} (характер: {personality})")
+def create_agent(name: str, personality: str = "дружелюбный", location: str = DEFAULT_ROOM):
+    logger.info(f"✨ Создание нового агента: {name} (характер: {personality}, локация: {location})")
 
-    agent = Agent(name=name, personality=personality)
-
-    db.execute(
-        "INSERT INTO agents (id, name, personality, mood, location, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-        (agent.id, agent.name, agent.personality, agent.mood, agent.location, agent.created_at.isoformat())
-    )
+    agent = Agent(name=name, personality=personality, location=location.strip() or DEFAULT_ROOM)
 
+    agent_registry.create(agent)
+    agent_state.add(agent.id, agent.location, agent.mood)
+    versions.bump("agents")
     logger.info(f"✅ Агент создан: {agent.id}")
 
     # Логируем в файл отдельно
@@ -102,41 +131,62 @@ def create_agent(name: str, personality: str = "дружелюбный"):
 
 
 @app.get("/agents")
-def get_agents():
+def get_agents(request: Request, response: Response):
     logger.debug("Запрос списка всех агентов")
-    rows = db.fetch_all("SELECT * FROM agents ORDER BY created_at DESC")
+    not_modified = versions.check(request, response, "agents", "moods")
+    if not_modified:
+        return not_modified
+
+    rows = agent_registry.all()
     logger.info(f"📊 Получено агентов: {len(rows)}")
-    return [dict(row) for row in rows]
+    return [format_timestamps(row, "created_at") for row in agent_state.overlay(rows)]
 
 
 @app.get("/agents/{agent_id}")
 def get_agent(agent_id: str):
     logger.debug(f"Запрос агента: {agent_id}")
-    row = db.fetch_one("SELECT * FROM agents WHERE id = ?", (agent_id,))
+    row = agent_registry.get(agent_id)
     if not row:
         logger.warning(f"❌ Агент не найден: {agent_id}")
         return {"error": "Not found"}
-    return dict(row)
+    return format_timestamps(agent_state.overlay([row])[0], "created_at")
 
 
-@app.post("/agents/{agent_id}/message")
-def send_message(agent_id: str, message: str):
-    logger.info(f"💬 Сообщение агенту {agent_id}: {message}")
+@app.post("/agents/{agent_id}/move")
+def move_agent(agent_id: str, location: str):
+    """Перевести агента в другую локацию - он будет говорить и отвечать в её комнате чата"""
+    location = location.strip() or DEFAULT_ROOM
+    agent = agent_registry.get(agent_id)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found")
+
+    agent_registry.move(agent_id, location)
+    agent_state.move(agent_id, location)
+    db.execute(
+        "INSERT INTO events (id, content, agent_id, type, timestamp) VALUES (?, ?, ?, ?, ?)",
+        (str(uuid.uuid4()), f"🚶 {agent['name']} переходит: {agent['location']} -> {location}",
+         agent_id, "system", time.time())
+    )
+    versions.bump("agents", "events")
+    logger.info(f"🚶 Агент {agent['name']} переходит в {location}")
+    return {"ok": True, "location": location}
+
 
-    agent = db.fetch_one("SELECT * FROM agents WHERE id = ?", (agent_id,))
+async def _load_for_reply(agent_id: str, message: str):
+    """Агент из реестра и его воспоминания (поиск памяти уже запущен в фоне)"""
+    memory_prefetch.prefetch(agent_id, message)
+    agent = agent_registry.get(agent_id)
     if not agent:
         logger.error(f"❌ Агент {agent_id} не найден")
-        return {"error": "Agent not found"}
+        return None, []
 
     logger.info(f"🤖 Агент {agent['name']} обрабатывает сообщение...")
+    return agent, await memory_prefetch.recall(agent_id, message)
 
-    # Генерируем ответ с передачей agent_id для истории
-    reply = llm.agent_response(
-        agent_id=agent_id,  # Теперь передаём ID
-        agent_name=agent['name'],
-        personality=agent['personality'],
-        message=message
-    )
+
+async def _after_reply(agent: dict, message: str, reply: str) -> dict:
+    """Общее для обычного и потокового ответа: память, настроение, событие"""
+    agent_id = agent["id"]
     logger.info(f"📝 Ответ от Mistral: {reply}")
 
     # Сохраняем в векторную память (долговременную)
@@ -146,34 +196,93 @@ def send_message(agent_id: str, message: str):
         "нейтрально"
     )
 
-    # Меняем настроение
-    new_mood = min(1.0, max(0.0, agent['mood'] + random.uniform(-0.1, 0.2)))
-    db.execute("UPDATE agents SET mood = ? WHERE id = ?", (new_mood, agent_id))
-    logger.info(f"😊 Настроение изменено: {agent['mood']:.2f} -> {new_mood:.2f}")
+    # Меняем настроение (в таблице состояний; в БД уйдёт пачкой)
+    before = agent_state.get(agent_id)
+    if before is None:
+        agent_state.add(agent_id, agent["location"])
+        before = agent_state.get(agent_id)
+    state = agent_state.stimulate([agent_id])[agent_id]
+    logger.info(f"😊 Настроение изменено: {before['mood']:.2f} -> {state['mood']:.2f}")
 
     # Событие в ленту
-    db.execute(
+    await db.execute_async(
         "INSERT INTO events (id, content, agent_id, type, timestamp) VALUES (?, ?, ?, ?, ?)",
-        (str(uuid.uuid4()), f"{agent['name']}: {reply}", agent_id, "message", datetime.now())
+        (str(uuid.uuid4()), f"{agent['name']}: {reply}", agent_id, "message", time.time())
     )
+    await asyncio.to_thread(versions.bump, "events")
 
     return {
         "reply": reply,
-        "mood": new_mood,
-        "emotion": "😊" if new_mood > 0.7 else "😐" if new_mood > 0.3 else "😢"
+        "mood": state["mood"],
+        "pleasure": state["pleasure"],
+        "arousal": state["arousal"],
+        "emotion": Emotion(pleasure=state["pleasure"], arousal=state["arousal"]).get_icon()
     }
 
 
+@app.post("/agents/{agent_id}/message")
+async def send_message(agent_id: str, message: str):
+    logger.info(f"💬 Сообщение агенту {agent_id}: {message}")
+
+    agent, memories = await _load_for_reply(agent_id, message)
+    if not agent:
+        return {"error": "Agent not found"}
+
+    # Генерируем ответ с передачей agent_id для истории
+    reply = await llm.agent_response_async(
+        agent_id=agent_id,  # Теперь передаём ID
+        agent_name=agent['name'],
+        personality=agent['personality'],
+        message=message,
+        context=format_memories(memories)
+    )
+    return await _after_reply(agent, message, reply)
+
+
+@app.post("/agents/{agent_id}/message/stream")
+async def send_message_stream(agent_id: str, message: str):
+    """
+    То же, что /message, но ответ идёт по мере генерации (Server-Sent Events):
+    события token {"text"} с кусками ответа, затем done с тем же телом,
+    что у /message. Память, настроение и событие - после конца потока.
+    """
+    logger.info(f"💬 Сообщение агенту {agent_id} (поток): {message}")
+
+    agent, memories = await _load_for_reply(agent_id, message)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found")
+
+    async def events():
+        parts = []
+        async for piece in llm.agent_response_stream(
+            agent_id=agent_id,
+            agent_name=agent['name'],
+            personality=agent['personality'],
+            message=message,
+            context=format_memories(memories)
+        ):
+            parts.append(piece)
+            yield sse_frame("token", {"text": piece})
+
+        result = await _after_reply(agent, message, "".join(parts))
+        yield sse_frame("done", result)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/agents/{agent_id}/history")
 def get_agent_history(agent_id: str):
     """Получить историю разговора с агентом"""
-    if agent_id not in llm.conversation_history:
-        return {"history": []}
-
-    history = llm.conversation_history[agent_id]
+    history = [turn._asdict() for turn in llm.history.turns(agent_id)]
+    summary = llm.history.summary(agent_id)
     return {
         "agent_id": agent_id,
         "history": history,
+        "summary": summary["text"] if summary else None,
         "count": len(history)
     }
 
@@ -189,43 +298,61 @@ def clear_agent_history(agent_id: str):
 def add_event(event_text: str):
     logger.info(f"🌍 Глобальное событие: {event_text}")
 
-    agents = db.fetch_all("SELECT id FROM agents")
+    agents = agent_registry.all()
     logger.info(f"👥 Затронуто агентов: {len(agents)}")
 
+    # Настроение всех агентов - одной векторной операцией; в БД уйдёт пачкой
+    states = agent_state.stimulate()
+    results = []
     for agent in agents:
-        memory_store.add(agent['id'], f"Событие: {event_text}", "нейтрально")
-        db.execute(
-            "UPDATE agents SET mood = mood + ? WHERE id = ?",
-            (random.uniform(-0.1, 0.2), agent['id'])
-        )
+        state = states.get(agent['id'])
+        if state is None:
+            continue
+        results.append({
+            "agent_id": agent['id'],
+            "name": agent['name'],
+            "mood": state["mood"],
+            "emotion": Emotion(pleasure=state["pleasure"], arousal=state["arousal"]).get_icon()
+        })
 
     event_id = str(uuid.uuid4())
     db.execute(
         "INSERT INTO events (id, content, type, timestamp) VALUES (?, ?, ?, ?)",
-        (event_id, event_text, "global", datetime.now())
+        (event_id, event_text, "global", time.time())
     )
 
+    versions.bump("events")
+
+    # Все воспоминания - одной пачкой
+    memory_store.add_many([(agent['id'], f"Событие: {event_text}", "нейтрально") for agent in agents])
+
     logger.info(f"✅ Событие добавлено: {event_id}")
 
-    return {"ok": True, "affected": len(agents)}
+    return {"ok": True, "affected": len(agents), "event_id": event_id, "agents": results}
 
 
 @app.get("/events")
-def get_events(limit: int = 50):
+def get_events(request: Request, response: Response, limit: int = 50):
     logger.debug(f"Запрос событий (лимит: {limit})")
+    not_modified = versions.check(request, response, "events", extra=str(limit))
+    if not_modified:
+        return not_modified
+
     rows = db.fetch_all("SELECT * FROM events ORDER BY timestamp DESC LIMIT ?", (limit,))
-    return [dict(row) for row in rows]
+    return [format_timestamps(dict(row), "timestamp") for row in rows]
 
 
 @app.get("/graph")
-def get_graph():
+def get_graph(request: Request, response: Response):
     logger.debug("Запрос данных для графа")
-    agents = db.fetch_all("SELECT id, name, mood FROM agents")
-    logger.info(f"📊 Граф: {len(agents)} узлов")
-    return {
-        "nodes": [dict(a) for a in agents],
-        "edges": []
-    }
+    not_modified = versions.check(request, response, "agents", "graph", "moods")
+    if not_modified:
+        return not_modified
+
+    # Раскладка и метрики уже посчитаны в фоне; сюда добавляется только текущее настроение
+    graph = interaction_graph.snapshot()
+    logger.info(f"📊 Граф: {len(graph['nodes'])} узлов, {len(graph['edges'])} рёбер")
+    return {**graph, "nodes": agent_state.overlay(graph["nodes"])}
 
 
 @app.delete("/agents/{agent_id}")
@@ -234,18 +361,22 @@ def delete_agent(agent_id: str):
     logger.info(f"🗑️ Запрос на удаление агента: {agent_id}")
 
     # Проверяем существует ли агент
-    agent = db.fetch_one("SELECT * FROM agents WHERE id = ?", (agent_id,))
+    agent = agent_registry.get(agent_id)
     if not agent:
         logger.warning(f"❌ Агент не найден: {agent_id}")
         raise HTTPException(status_code=404, detail="Agent not found")
 
     agent_name = agent['name']
 
-    # Удаляем агента из БД
-    db.execute("DELETE FROM agents WHERE id = ?", (agent_id,))
+    # Удаляем агента из БД и реестра
+    agent_registry.delete(agent_id)
 
     # Удаляем воспоминания агента
     db.execute("DELETE FROM memories WHERE agent_id = ?", (agent_id,))
+    memory_store.delete_agent(agent_id)
+    memory_prefetch.forget(agent_id)
+    agent_state.remove(agent_id)
+    interaction_graph.remove(agent_id)
 
     # Убираем удаление из relations - этой таблицы нет
     # db.execute("DELETE FROM relations WHERE agent1_id = ? OR agent2_id = ?", (agent_id, agent_id))
@@ -253,13 +384,13 @@ def delete_agent(agent_id: str):
     # Добавляем событие в ленту
     db.execute(
         "INSERT INTO events (id, content, type, timestamp) VALUES (?, ?, ?, ?)",
-        (str(uuid.uuid4()), f"🗑️ Агент {agent_name} удален", "system", datetime.now())
+        (str(uuid.uuid4()), f"🗑️ Агент {agent_name} удален", "system", time.time())
     )
 
+    versions.bump("agents", "events")
     logger.info(f"✅ Агент {agent_name} ({agent_id}) удален")
 
-    # Очищаем историю чата агента если есть
-    if hasattr(llm, 'conversation_history') and agent_id in llm.conversation_history:
-        del llm.conversation_history[agent_id]
+    # Очищаем историю разговоров агента
+    llm.clear_history(agent_id)
 
     return {"ok": True, "message": f"Agent {agent_name} deleted"}
\ No newline at end of file
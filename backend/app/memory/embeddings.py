@@ -0,0 +1,177 @@
+"""
+Кэш эмбеддингов по хэшу содержимого.
+
+Одинаковый текст (например, "Событие: ..." для всех агентов) считается
+один раз: ключ - sha1 нормализованного текста, в памяти LRU, на диске
+SQLite рядом с Chroma, чтобы кэш переживал перезапуск.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+
+from ..config import config
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
+# Раз в столько новых записей подрезаем дисковый кэш до EMBEDDING_CACHE_DISK_SIZE
+DISK_PRUNE_EVERY = 1000
+# Ограничение SQLite на число параметров в одном запросе
+SQL_CHUNK = 500
+
+
+def normalize_text(text: str) -> str:
+    """Одинаковый по смыслу текст -> одинаковая строка (юникод и пробелы)"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    def __init__(self, inner: EmbeddingFunction = None, capacity: int = None,
+                 path: str = None, disk_capacity: int = None):
+        # Та же модель, что у DefaultEmbeddingFunction, но один экземпляр:
+        # DefaultEmbeddingFunction создаёт (и грузит) модель на каждый вызов
+        self._inner = inner or ONNXMiniLM_L6_V2()
+        self.capacity = capacity or config.EMBEDDING_CACHE_SIZE
+        self.disk_capacity = disk_capacity or config.EMBEDDING_CACHE_DISK_SIZE
+        self._ram: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserted = 0
+        self.hits = 0
+        self.misses = 0
+
+        path = path or os.path.join(config.CHROMA_PATH, "embedding_cache.db")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [text_key(text) for text in input]
+        found: Dict[str, np.ndarray] = {}
+
+        with self._lock:
+            for key in keys:
+                vector = self._ram.get(key)
+                if vector is not None:
+                    self._ram.move_to_end(key)
+                    found[key] = vector
+
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            if missing:
+                found.update(self._load_from_disk(missing))
+
+            # Считаем только уникальные тексты, которых нет нигде
+            to_embed = {}
+            for key, text in zip(keys, input):
+                if key not in found and key not in to_embed:
+                    to_embed[key] = text
+
+            self.hits += len(keys) - len(to_embed)
+            self.misses += len(to_embed)
+
+        if to_embed:
+            vectors = self._inner(list(to_embed.values()))
+            fresh = {
+                key: np.asarray(vector, dtype=np.float32)
+                for key, vector in zip(to_embed.keys(), vectors)
+            }
+            found.update(fresh)
+            with self._lock:
+                self._save_to_disk(fresh)
+
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                self._remember(key, found[key])
+
+        return [found[key] for key in keys]
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._ram[key] = vector
+        self._ram.move_to_end(key)
+        while len(self._ram) > self.capacity:
+            self._ram.popitem(last=False)
+
+    def _load_from_disk(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        loaded = {}
+        try:
+            for i in range(0, len(keys), SQL_CHUNK):
+                chunk = keys[i:i + SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    loaded[key] = np.frombuffer(blob, dtype=np.float32).copy()
+            if loaded:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in loaded]
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка чтения кэша эмбеддингов: {e}")
+        return loaded
+
+    def _save_to_disk(self, vectors: Dict[str, np.ndarray]):
+        now = time.time()
+        try:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, vector.tobytes(), now) for key, vector in vectors.items()]
+            )
+            self._inserted += len(vectors)
+            if self._inserted >= DISK_PRUNE_EVERY:
+                self._inserted = 0
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key NOT IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used DESC LIMIT ?)",
+                    (self.disk_capacity,)
+                )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка записи кэша эмбеддингов: {e}")
+
+    @property
+    def stats(self) -> dict:
+        return {"size": len(self._ram), "hits": self.hits, "misses": self.misses}
+
+    # Те же векторы, что у встроенной функции Chroma, поэтому и имя то же:
+    # так коллекции, созданные раньше без кэша, открываются без конфликта.
+    @staticmethod
+    def name() -> str:
+        return "default"
+
+    def get_config(self) -> Dict:
+        return {}
+
+    @staticmethod
+    def build_from_config(config: Dict) -> "CachedEmbeddingFunction":
+        return CachedEmbeddingFunction()
+
+    @staticmethod
+    def validate_config(config: Dict) -> None:
+        return
@@ -0,0 +1,96 @@
+"""
+Подкачка долговременной памяти в промпты агентов.
+
+Поиск запускается заранее (prefetch) и идёт в потоке параллельно с
+остальной подготовкой ответа. recall() ждёт результат не дольше
+бюджета: не успели - промпт строится без воспоминаний, а найденное
+позже попадёт в кэш и пригодится на следующей реплике того же агента.
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Tuple
+
+from ..config import config
+from ..logger import get_logger
+from .store import memory_store
+
+logger = get_logger(__name__)
+
+
+class MemoryPrefetcher:
+    def __init__(self, store, budget: float, ttl: float, n: int = 3):
+        self.store = store
+        self.budget = budget
+        self.ttl = ttl
+        self.n = n
+        self._cache: Dict[str, Tuple[float, List[str]]] = {}  # agent_id -> (истекает, воспоминания)
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def _cached(self, agent_id: str):
+        entry = self._cache.get(agent_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def prefetch(self, agent_id: str, query: str):
+        """Начать поиск в фоне (если в кэше уже есть свежий результат - ничего не делать)"""
+        if not self.store.available or self._cached(agent_id) is not None or agent_id in self._inflight:
+            return
+        task = asyncio.create_task(asyncio.to_thread(self.store.search, agent_id, query, self.n))
+        self._inflight[agent_id] = task
+        task.add_done_callback(lambda t: self._on_done(agent_id, t))
+
+    def _on_done(self, agent_id: str, task: asyncio.Task):
+        if self._inflight.get(agent_id) is task:
+            del self._inflight[agent_id]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.error(f"❌ Ошибка подкачки памяти {agent_id}: {task.exception()}")
+            return
+
+        now = time.monotonic()
+        self._cache[agent_id] = (now + self.ttl, task.result())
+        # Выкидываем протухшие записи, чтобы кэш не рос с числом агентов
+        for key in [key for key, (expires, _) in self._cache.items() if expires <= now]:
+            del self._cache[key]
+
+    async def recall(self, agent_id: str, query: str) -> List[str]:
+        """Воспоминания агента, но не дольше бюджета; иначе пустой список"""
+        cached = self._cached(agent_id)
+        if cached is not None:
+            return cached
+
+        self.prefetch(agent_id, query)
+        task = self._inflight.get(agent_id)
+        if task is None:
+            return self._cached(agent_id) or []
+
+        try:
+            # shield: по таймауту поиск не отменяется, а досчитывается в кэш
+            return await asyncio.wait_for(asyncio.shield(task), timeout=self.budget)
+        except asyncio.TimeoutError:
+            logger.debug(f"⏳ Память {agent_id} не успела за {self.budget * 1000:.0f}мс")
+            return []
+        except Exception:
+            return []
+
+    def forget(self, agent_id: str):
+        self._cache.pop(agent_id, None)
+
+
+def format_memories(memories: List[str]) -> str:
+    """Блок воспоминаний для промпта (пустая строка, если вспоминать нечего)"""
+    if not memories:
+        return ""
+    lines = ["Ты помнишь:"]
+    lines.extend(f"- {memory}" for memory in memories)
+    return "\n".join(lines)
+
+
+memory_prefetch = MemoryPrefetcher(
+    memory_store,
+    budget=config.MEMORY_PREFETCH_BUDGET_MS / 1000,
+    ttl=config.MEMORY_BURST_TTL
+)
@@ -1,47 +1,298 @@
 import chromadb
 from chromadb.config import Settings
+from chromadb.errors import NotFoundError
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
 from ..config import config
+from ..logger import get_logger
+from .embeddings import CachedEmbeddingFunction
+
+logger = get_logger(__name__)
+
+# Старая общая коллекция (до разбиения по агентам)
+LEGACY_COLLECTION = "memories"
+# Во сколько раз больше кандидатов берём из Chroma для переранжирования по свежести
+CANDIDATES_FACTOR = 4
+# Попыток открыть Chroma при старте
+CLIENT_OPEN_ATTEMPTS = 3
+# Сколько раз пытаемся записать воспоминание, прежде чем выбросить его
+WRITE_ATTEMPTS = 3
 
 
 class MemoryStore:
     def __init__(self):
         try:
-            self.client = chromadb.Client(Settings(
-                chroma_db_impl="duckdb+parquet",
-                persist_directory=config.CHROMA_PATH
-            ))
-            self.collection = self.client.get_or_create_collection(
-                name="memories"
-            )
+            self.client = self._open_client()
+            # Эмбеддинги через кэш: одинаковый текст считается один раз
+            self.embedder = CachedEmbeddingFunction()
             self.available = True
-        except:
+        except Exception as e:
+            logger.warning(f"⚠️ Векторная память недоступна: {e}")
             self.available = False
-            self.collection = None
+
+        # У каждого агента своя коллекция; открытые держим в LRU
+        self._partitions = OrderedDict()
+        self._partitions_lock = threading.Lock()
+        self.max_open_partitions = config.MEMORY_OPEN_PARTITIONS
+        self.half_life = config.MEMORY_HALF_LIFE_HOURS * 3600
+        self.recency_weight = config.MEMORY_RECENCY_WEIGHT
+
+        # Write-behind: add() только кладёт в очередь, фоновый поток пишет пачками
+        self.batch_size = config.MEMORY_BATCH_SIZE
+        self.flush_interval = config.MEMORY_FLUSH_INTERVAL
+        self._pending = []  # (id, agent_id, text, emotion, timestamp)
+        self._inflight = []  # пачка, которую пишет flush прямо сейчас (для поиска)
+        self._attempts = {}  # id -> неудачных попыток записи
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._flusher = None
+        if self.available:
+            self._migrate_legacy()
+            self._flusher = threading.Thread(target=self._flush_loop, name="memory-flusher", daemon=True)
+            self._flusher.start()
+
+    @staticmethod
+    def _open_client():
+        # Воркеры, стартующие одновременно, могут столкнуться на создании схемы Chroma
+        for attempt in range(CLIENT_OPEN_ATTEMPTS):
+            try:
+                return chromadb.PersistentClient(
+                    path=config.CHROMA_PATH,
+                    settings=Settings(anonymized_telemetry=False)
+                )
+            except Exception:
+                if attempt == CLIENT_OPEN_ATTEMPTS - 1:
+                    raise
+                time.sleep(0.2 * (attempt + 1))
+
+    @staticmethod
+    def _partition_name(agent_id: str) -> str:
+        return f"memories_{agent_id}"
+
+    def _partition(self, agent_id: str, create: bool = True):
+        """Коллекция агента: открывается при первом обращении, холодные закрываются"""
+        with self._partitions_lock:
+            collection = self._partitions.get(agent_id)
+            if collection is not None:
+                self._partitions.move_to_end(agent_id)
+                return collection
+
+        name = self._partition_name(agent_id)
+        try:
+            if create:
+                collection = self.client.get_or_create_collection(
+                    name=name,
+                    embedding_function=self.embedder,
+                    configuration={"hnsw": {"space": "cosine"}}
+                )
+            else:
+                collection = self.client.get_collection(name=name, embedding_function=self.embedder)
+        except NotFoundError:
+            return None
+
+        with self._partitions_lock:
+            self._partitions[agent_id] = collection
+            while len(self._partitions) > self.max_open_partitions:
+                self._partitions.popitem(last=False)
+        return collection
+
+    def _migrate_legacy(self):
+        """Разложить старую общую коллекцию по коллекциям агентов (один раз)"""
+        try:
+            legacy = self.client.get_collection(name=LEGACY_COLLECTION, embedding_function=self.embedder)
+        except NotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"❌ Не удалось открыть старую коллекцию памяти: {e}")
+            return
+
+        data = legacy.get(include=["documents", "metadatas", "embeddings"])
+        groups = defaultdict(lambda: ([], [], [], []))
+        for item_id, document, metadata, embedding in zip(
+                data["ids"], data["documents"], data["metadatas"], data["embeddings"]):
+            metadata = dict(metadata or {})
+            metadata.setdefault("timestamp", time.time())
+            ids, documents, metadatas, embeddings = groups[metadata.get("agent_id", "unknown")]
+            ids.append(item_id)
+            documents.append(document)
+            metadatas.append(metadata)
+            embeddings.append(embedding)
+
+        for agent_id, (ids, documents, metadatas, embeddings) in groups.items():
+            self._partition(agent_id).add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+
+        self.client.delete_collection(name=LEGACY_COLLECTION)
+        logger.info(f"🧠 Память разложена по агентам: {len(data['ids'])} записей, {len(groups)} агентов")
+
+    @property
+    def queue_depth(self) -> int:
+        """Сколько воспоминаний ждёт записи в Chroma"""
+        return len(self._pending) + len(self._inflight)
 
     def add(self, agent_id: str, text: str, emotion: str):
+        self.add_many([(agent_id, text, emotion)])
+
+    def add_many(self, items: list):
+        """Поставить в очередь пачку (agent_id, text, emotion); запись - в фоне"""
+        if not self.available or not items:
+            return
+        timestamp = time.time()
+        with self._cond:
+            self._pending.extend(
+                (uuid.uuid4().hex, agent_id, text, emotion, timestamp)
+                for agent_id, text, emotion in items
+            )
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                if not self._stopped and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
+
+    def flush(self):
+        """Записать накопленное: эмбеддинги одним вызовом, по одному add на агента"""
+        with self._cond:
+            # Пока пачка пишется, она остаётся видна поиску через _inflight
+            batch, self._pending = self._pending, []
+            self._inflight = batch
+        if not batch:
+            return
+
+        failed = []
+        try:
+            embeddings = self.embedder([text for _, _, text, _, _ in batch])
+        except Exception as e:
+            logger.error(f"❌ Ошибка эмбеддингов памяти ({len(batch)} шт.): {e}")
+            embeddings, failed = [], batch
+
+        groups = defaultdict(list)
+        for item, embedding in zip(batch, embeddings):
+            groups[item[1]].append((item, embedding))
+
+        for agent_id, items in groups.items():
+            try:
+                self._partition(agent_id).add(
+                    ids=[item_id for (item_id, _, _, _, _), _ in items],
+                    documents=[text for (_, _, text, _, _), _ in items],
+                    embeddings=[embedding for _, embedding in items],
+                    metadatas=[
+                        {"agent_id": agent_id, "emotion": emotion, "timestamp": timestamp}
+                        for (_, _, _, emotion, timestamp), _ in items
+                    ]
+                )
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи памяти агента {agent_id} ({len(items)} шт.): {e}")
+                failed.extend(item for item, _ in items)
+
+        # Незаписанное - в начало очереди; после WRITE_ATTEMPTS попыток - выбрасываем
+        retry, dropped = [], 0
+        with self._cond:
+            for item in failed:
+                attempts = self._attempts.pop(item[0], 0) + 1
+                if attempts < WRITE_ATTEMPTS:
+                    self._attempts[item[0]] = attempts
+                    retry.append(item)
+                else:
+                    dropped += 1
+            written = {item[0] for item in batch} - {item[0] for item in failed}
+            for item_id in written:
+                self._attempts.pop(item_id, None)
+            self._pending[:0] = retry
+            self._inflight = []
+
+        if written:
+            logger.debug(f"🧠 Записано воспоминаний: {len(written)} ({len(groups)} агентов)")
+        if dropped:
+            logger.error(f"❌ Воспоминания потеряны после {WRITE_ATTEMPTS} попыток записи: {dropped} шт.")
+
+    def close(self):
+        """Дописать очередь и остановить фоновый поток (при остановке сервера)"""
+        if not self._flusher:
+            return
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._flusher.join()
+        self._flusher = None
+
+    def delete_agent(self, agent_id: str):
+        """Удалить всю память агента вместе с его коллекцией"""
         if not self.available:
             return
+        with self._cond:
+            self._pending = [item for item in self._pending if item[1] != agent_id]
+        with self._partitions_lock:
+            self._partitions.pop(agent_id, None)
         try:
-            self.collection.add(
-                documents=[text],
-                metadatas=[{"agent_id": agent_id, "emotion": emotion}],
-                ids=[f"{agent_id}_{datetime.now().timestamp()}"]
-            )
-        except:
+            self.client.delete_collection(name=self._partition_name(agent_id))
+        except NotFoundError:
             pass
+        except Exception as e:
+            logger.error(f"❌ Ошибка удаления памяти агента {agent_id}: {e}")
+
+    def _recency(self, timestamp: float, now: float) -> float:
+        """1.0 для только что записанного, 0.5 через half_life, и т.д."""
+        age = max(0.0, now - timestamp)
+        return math.exp(-math.log(2) * age / self.half_life)
+
+    def _score(self, similarity: float, timestamp: float, now: float) -> float:
+        return (1 - self.recency_weight) * similarity + self.recency_weight * self._recency(timestamp, now)
+
+    def _search_pending(self, agent_id: str, query: str, n: int) -> list:
+        """Ещё не записанные воспоминания: простое совпадение слов с запросом"""
+        words = set(query.lower().split())
+        with self._cond:
+            pending = [item for item in self._inflight + self._pending if item[1] == agent_id]
+        scored = []
+        for _, _, text, _, timestamp in pending:
+            overlap = len(words & set(text.lower().split()))
+            if overlap:
+                scored.append((overlap, timestamp, text))
+        scored.sort(reverse=True)
+        return [text for _, _, text in scored[:n]]
 
     def search(self, agent_id: str, query: str, n: int = 3):
+        """Похожие и свежие воспоминания агента (ищем только в его коллекции)"""
         if not self.available:
             return []
+        found = self._search_pending(agent_id, query, n)
+        if len(found) >= n:
+            return found
+
+        collection = self._partition(agent_id, create=False)
+        if collection is None:
+            return found
         try:
-            results = self.collection.query(
+            results = collection.query(
                 query_texts=[query],
-                n_results=n,
-                where={"agent_id": agent_id}
+                n_results=n * CANDIDATES_FACTOR,
+                include=["documents", "metadatas", "distances"]
             )
-            return results['documents'][0] if results['documents'] else []
-        except:
-            return []
+        except Exception as e:
+            logger.error(f"❌ Ошибка поиска в памяти агента {agent_id}: {e}")
+            return found
+
+        now = time.time()
+        candidates = []
+        for document, metadata, distance in zip(
+                results["documents"][0], results["metadatas"][0], results["distances"][0]):
+            if document in found:
+                continue
+            # Коллекции в пространстве cosine: distance = 1 - похожесть
+            score = self._score(1.0 - distance, (metadata or {}).get("timestamp", 0.0), now)
+            candidates.append((score, document))
+        candidates.sort(reverse=True)
+
+        return (found + [document for _, document in candidates])[:n]
 
 
-memory_store = MemoryStore()
\ No newline at end of file
+memory_store = MemoryStore()
@@ -0,0 +1,153 @@
+"""
+Общее состояние для нескольких воркеров uvicorn на одном хосте.
+
+Всё лежит в той же SQLite (WAL): именованные счётчики и флаги - в
+shared_state, аренды для выбора лидера - в leases. Поток-наблюдатель
+раз в SHARED_STATE_POLL_INTERVAL проверяет PRAGMA data_version (дёшево,
+без чтения таблиц) и, если кто-то закоммитил изменения, вызывает
+подписчиков: чат подтягивает новые сообщения, версии ETag - счётчики,
+история диалогов - сбрасывает устаревшие записи.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from .config import config
+from .db.database import db
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class SharedState:
+    def __init__(self, interval: float):
+        self.interval = interval
+        # Уникален на процесс: pid может повториться после рестарта
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._listeners: List[Callable[[], None]] = []
+        self._stop = threading.Event()
+        self._watcher = None
+
+    # --- счётчики и флаги ---
+
+    def get(self, key: str, default: int = 0) -> int:
+        row = db.fetch_one("SELECT value FROM shared_state WHERE key = ?", (key,))
+        return row["value"] if row else default
+
+    def get_many(self, prefix: str) -> Dict[str, int]:
+        """Все значения с ключом, начинающимся на prefix (ключи без префикса)"""
+        rows = db.fetch_all(
+            "SELECT key, value FROM shared_state WHERE key LIKE ? || '%'", (prefix,)
+        )
+        return {row["key"][len(prefix):]: row["value"] for row in rows}
+
+    def set(self, key: str, value: int):
+        db.execute(
+            "INSERT INTO shared_state (key, value, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+            (key, value, time.time())
+        )
+
+    def setdefault(self, key: str, value: int) -> int:
+        """Записать value, только если ключа ещё нет; вернуть итоговое значение"""
+        db.execute(
+            "INSERT OR IGNORE INTO shared_state (key, value, updated_at) VALUES (?, ?, ?)",
+            (key, value, time.time())
+        )
+        return self.get(key, value)
+
+    def incr(self, key: str, conn: Optional[sqlite3.Connection] = None) -> int:
+        """
+        Атомарно увеличить счётчик на 1, вернуть новое значение.
+
+        С conn - внутри уже открытой транзакции: первой записью в ней счётчик
+        берёт блокировку записи до коммита, так что порядок значений совпадает
+        с порядком коммитов (годится как последовательность изменений).
+        """
+        if conn is None:
+            with db.transaction() as conn:
+                return self.incr(key, conn)
+        row = conn.execute(
+            "INSERT INTO shared_state (key, value, updated_at) VALUES (?, 1, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1, updated_at = excluded.updated_at "
+            "RETURNING value",
+            (key, time.time())
+        ).fetchone()
+        return row[0]
+
+    # --- аренды (выбор лидера) ---
+
+    def acquire_lease(self, name: str, ttl: float) -> bool:
+        """
+        Взять или продлить аренду name на ttl секунд. Удаётся, если аренда
+        свободна, истекла или уже наша; иначе False.
+        """
+        now = time.time()
+        with db.transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (name, self.worker_id, now + ttl, now)
+            )
+        return cursor.rowcount > 0
+
+    def release_lease(self, name: str):
+        db.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.worker_id))
+
+    def lease_owner(self, name: str) -> Optional[str]:
+        """Кто сейчас держит аренду (None - никто или истекла)"""
+        row = db.fetch_one(
+            "SELECT owner FROM leases WHERE name = ? AND expires_at >= ?", (name, time.time())
+        )
+        return row["owner"] if row else None
+
+    # --- наблюдение за изменениями от других воркеров ---
+
+    def subscribe(self, listener: Callable[[], None]):
+        """listener() вызывается из потока-наблюдателя после чужих (и своих) коммитов"""
+        self._listeners.append(listener)
+
+    def start(self):
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="shared-state-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        if self._watcher is None:
+            return
+        self._stop.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def _watch(self):
+        # Отдельное соединение: data_version меняется от коммитов всех ДРУГИХ соединений
+        conn = sqlite3.connect(db.db_path)
+        last = None
+        try:
+            while not self._stop.is_set():
+                try:
+                    version = conn.execute("PRAGMA data_version").fetchone()[0]
+                except sqlite3.Error as e:
+                    logger.error(f"❌ Наблюдатель общего состояния: {e}")
+                    version = last
+                if version != last:
+                    last = version
+                    for listener in self._listeners:
+                        try:
+                            listener()
+                        except Exception as e:
+                            logger.error(f"❌ Ошибка синхронизации общего состояния: {e}")
+                self._stop.wait(self.interval)
+        finally:
+            conn.close()
+
+
+shared_state = SharedState(interval=config.SHARED_STATE_POLL_INTERVAL)
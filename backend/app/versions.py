@@ -0,0 +1,84 @@
+"""
+Счётчики версий ресурсов для ETag / условных GET.
+
+Каждая запись увеличивает счётчик своего ресурса (bump), а читающие
+эндпоинты строят из счётчиков сильный ETag. Если у клиента та же
+версия, отвечаем 304 без запроса к БД и без сериализации JSON.
+
+Счётчики общие для всех воркеров (shared_state в SQLite); здесь - их
+локальная копия, которую наблюдатель обновляет после чужих записей.
+"""
+
+import hashlib
+import random
+import threading
+from typing import Optional
+
+from fastapi import Request, Response
+
+from .logger import get_logger
+from .shared_state import shared_state
+
+logger = get_logger(__name__)
+
+PREFIX = "version:"
+
+
+class ResourceVersions:
+    def __init__(self):
+        # Счётчики переживают рестарт вместе с БД; эпоха в ETag защищает
+        # от совпадений, если базу пересоздали с нуля
+        self.boot_id = format(shared_state.setdefault("versions_epoch", random.getrandbits(31)), "x")
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.refresh()
+        shared_state.subscribe(self.refresh)
+
+    def refresh(self):
+        """Перечитать счётчики из общей БД (их могли поднять другие воркеры)"""
+        latest = shared_state.get_many(PREFIX)
+        with self._lock:
+            for resource, value in latest.items():
+                self._versions[resource] = max(value, self._versions.get(resource, 0))
+
+    def bump(self, *resources: str):
+        """Отметить изменение ресурсов (видно всем воркерам)"""
+        for resource in resources:
+            try:
+                value = shared_state.incr(PREFIX + resource)
+            except Exception as e:
+                # БД недоступна - хотя бы этот воркер не отдаст устаревший 304
+                logger.error(f"❌ Версия {resource} не записана в БД: {e}")
+                value = self._versions.get(resource, 0) + 1
+            with self._lock:
+                self._versions[resource] = max(value, self._versions.get(resource, 0))
+
+    def get(self, resource: str) -> int:
+        return self._versions.get(resource, 0)
+
+    def etag(self, *resources: str, extra: str = "") -> str:
+        """Сильный ETag из версий ресурсов (+ параметры запроса в extra)"""
+        parts = [self.boot_id] + [f"{r}{self.get(r)}" for r in resources]
+        if extra:
+            # Заголовки - latin-1: параметры (например, "общая зона") идут коротким хэшем
+            parts.append(hashlib.sha1(extra.encode("utf-8")).hexdigest()[:8])
+        return '"' + "-".join(parts) + '"'
+
+    def check(self, request: Request, response: Response, *resources: str,
+              extra: str = "") -> Optional[Response]:
+        """
+        Поставить ETag в ответ; если клиент прислал тот же в If-None-Match,
+        вернуть готовый 304 (эндпоинт отдаёт его как есть).
+        """
+        etag = self.etag(*resources, extra=extra)
+        response.headers["ETag"] = etag
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            candidates = [tag.strip() for tag in if_none_match.split(",")]
+            if etag in candidates or "*" in candidates:
+                return Response(status_code=304, headers={"ETag": etag})
+        return None
+
+
+versions = ResourceVersions()
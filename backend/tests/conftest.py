@@ -0,0 +1,18 @@
+"""
+Общие настройки тестов.
+
+Модули app при импорте открывают SQLite и лог-файл по путям из config,
+поэтому до первого импорта подменяем их на временную папку - data/ и
+logs/ проекта тесты не трогают.
+"""
+
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="agents-tests-")
+os.environ["DATABASE_PATH"] = os.path.join(_tmp, "agents.db")
+os.environ["CHROMA_PATH"] = os.path.join(_tmp, "chroma")
+os.environ["LOG_FILE"] = os.path.join(_tmp, "backend.log")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
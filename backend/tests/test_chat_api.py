@@ -0,0 +1,28 @@
+from urllib.parse import quote
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.chat.store import DEFAULT_ROOM
+from app.main import app
+
+
+@pytest.fixture
+def client():
+    # Без lifespan: фоновые потоки и супервизор тестам не нужны
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("path", ["/chat/status", f"/chat/{quote(DEFAULT_ROOM)}/status"])
+def test_status_of_default_room(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.json()["room"] == DEFAULT_ROOM
+
+    etag = response.headers["etag"]
+    assert etag.isascii()
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_status_of_unknown_room(client):
+    assert client.get(f"/chat/{quote('нет такой комнаты')}/status").status_code == 404
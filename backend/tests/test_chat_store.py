@@ -0,0 +1,63 @@
+import uuid
+
+import pytest
+
+from app.chat.store import DEFAULT_ROOM, ChatRooms
+
+CAPACITY = 5
+
+
+def _message(text: str) -> dict:
+    return {"id": uuid.uuid4().hex, "message": text}
+
+
+@pytest.fixture
+def rooms():
+    return ChatRooms(capacity=CAPACITY)
+
+
+def test_unknown_room_is_not_opened(rooms):
+    assert rooms.get("нет такой комнаты") is None
+    assert rooms.open_count == 0
+
+
+def test_ring_buffer_keeps_last_capacity_messages(rooms):
+    store = rooms.get(DEFAULT_ROOM)
+    start = store.cursor
+    for i in range(CAPACITY + 3):
+        store.append(_message(str(i)))
+
+    assert len(store) == CAPACITY
+    assert [m["seq"] for m in store.latest(CAPACITY * 2)] == list(range(start + 4, start + CAPACITY + 4))
+    assert store.since(start + CAPACITY + 1, CAPACITY)[0]["message"] == str(CAPACITY + 1)
+
+
+def test_room_seq_continues_across_clear_and_reload(rooms):
+    store = rooms.get(DEFAULT_ROOM)
+    start = store.cursor
+    for i in range(3):
+        store.append(_message(str(i)))
+
+    store.clear()
+    assert len(store) == 0
+    assert store.cursor == start + 3
+    assert store.append(_message("после очистки"))["seq"] == start + 4
+
+    # Другой воркер (или рестарт) поднимает комнату из SQLite
+    reloaded = ChatRooms(capacity=CAPACITY).get(DEFAULT_ROOM)
+    assert reloaded.cursor == start + 4
+    assert [m["message"] for m in reloaded.latest(CAPACITY)] == ["после очистки"]
+    assert reloaded.append(_message("дальше"))["seq"] == start + 5
+
+
+def test_sync_delivers_messages_and_clears_from_other_instance(rooms):
+    store = rooms.get(DEFAULT_ROOM)
+    other = ChatRooms(capacity=CAPACITY).get(DEFAULT_ROOM)
+
+    sent = other.append(_message("от соседа"))
+    rooms.sync()
+    assert store.latest(1)[0]["id"] == sent["id"]
+
+    other.clear()
+    rooms.sync()
+    assert len(store) == 0
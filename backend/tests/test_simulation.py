@@ -0,0 +1,125 @@
+import asyncio
+import time
+from collections import Counter
+
+import pytest
+
+from app.chat.simulation import SimulationEngine
+
+
+@pytest.fixture
+def engine():
+    engine = SimulationEngine(tick=1.0, turns_per_tick=1, min_interval=30.0, max_interval=90.0, room_pace_agents=5)
+    engine.clock = 1000.0
+    return engine
+
+
+def test_pop_due_defers_extra_turns_per_room(engine):
+    rooms = {"a1": "A", "a2": "A", "b1": "B"}
+    engine._schedule("a1", 990.0)
+    engine._schedule("a2", 995.0)
+    engine._schedule("b1", 999.0)
+
+    assert engine._pop_due(rooms) == ["a1", "b1"]
+    # a2 не потерян - переносится на следующий тик
+    assert engine._next_due() == 995.0
+    assert engine._pop_due(rooms) == ["a2"]
+    assert engine._pop_due(rooms) == []
+
+
+def test_pop_due_counts_running_turns(engine):
+    rooms = {"a1": "A", "b1": "B"}
+    engine._schedule("a1", 990.0)
+    engine._schedule("b1", 990.0)
+
+    assert engine._pop_due(rooms, busy=Counter({"A": 1})) == ["b1"]
+    assert engine._pop_due(rooms) == ["a1"]
+
+
+def test_pop_due_skips_future_and_stale_entries(engine):
+    rooms = {"a1": "A", "a2": "A"}
+    engine._schedule("a1", 990.0)
+    engine._schedule("a1", 1500.0)  # перенесён - старая запись кучи устарела
+    engine._schedule("a2", 2000.0)
+
+    assert engine._pop_due(rooms) == []
+    assert engine._next_due() == 1500.0
+
+
+def test_advance_fast_jumps_to_next_turn(engine):
+    engine._schedule("a1", 1300.0)
+    engine._advance_fast(until=5000)
+    assert engine.clock == 1300.0
+
+
+def test_advance_fast_never_passes_until(engine):
+    engine._schedule("a1", 9000.0)
+    engine._advance_fast(until=1200)
+    assert engine.clock == 1200.0
+
+    engine._advance_fast(until=1200)
+    assert engine.clock == 1200.0
+
+
+def test_advance_fast_without_agents_goes_to_until(engine):
+    engine._advance_fast(until=4000)
+    assert engine.clock == 4000.0
+
+
+def test_advance_fast_steps_a_tick_when_turns_are_overdue(engine):
+    engine._schedule("a1", 900.0)
+    engine._advance_fast(until=5000)
+    assert engine.clock == 1001.0
+
+
+AGENTS = [{"id": "a1", "location": "A"}, {"id": "a2", "location": "A"}, {"id": "b1", "location": "B"}]
+
+
+def _drive(engine: SimulationEngine, seconds: float, stop=lambda: False) -> list:
+    """Крутить run() с заглушкой хода, пока не пройдёт seconds или не выполнится stop()"""
+    turns = []
+
+    async def load_agents():
+        return AGENTS
+
+    async def take_turn(agent):
+        await asyncio.sleep(0.01)  # как будто ждём LLM
+        turns.append(agent["id"])
+
+    async def main():
+        task = asyncio.create_task(engine.run(load_agents, take_turn))
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not stop():
+            await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    return turns
+
+
+def test_run_takes_turns_and_advances_clock():
+    engine = SimulationEngine(tick=0.05, turns_per_tick=1, min_interval=0.05, max_interval=0.1, room_pace_agents=5)
+    engine.fast_forward(0)
+    start = engine.saved_clock()
+
+    turns = _drive(engine, 1.0)
+
+    assert set(turns) == {"a1", "a2", "b1"}
+    assert engine.metrics()["turns"] == len(turns)
+    assert engine.clock > start
+    assert engine.saved_clock() == int(engine.clock)  # часы сохранены при остановке
+
+
+def test_fast_forward_reaches_target():
+    engine = SimulationEngine(tick=1.0, turns_per_tick=1, min_interval=60.0, max_interval=120.0, room_pace_agents=5)
+    until = engine.fast_forward(3600)
+
+    turns = _drive(engine, 10.0, stop=lambda: engine.fast_forward_until() == 0)
+
+    assert engine.clock == until
+    assert engine.fast_forward_until() == 0
+    assert not engine.fast_forwarding
+    # Часовая перемотка при ходе раз в 60-120 секунд - десятки ходов на агента
+    assert len(turns) > 3 * 20
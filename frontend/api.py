@@ -1,25 +1,56 @@
+import json
+from urllib.parse import quote
+
 import requests
 import streamlit as st
 
 
+# (путь, параметры) -> (ETag, данные). Общий для всех сессий: данные не персональные.
+_conditional_cache = {}
+
+
 class API:
     def __init__(self, base_url="http://localhost:8000"):
         self.base_url = base_url
 
+    def _get_conditional(self, path, params=None, timeout=10):
+        """
+        GET с If-None-Match: на 304 возвращаем сохранённый ответ.
+        Возвращает разобранный JSON или None, если запрос не удался.
+        """
+        key = (self.base_url, path, tuple(sorted((params or {}).items())))
+        cached = _conditional_cache.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+
+        r = requests.get(f"{self.base_url}{path}", params=params, headers=headers, timeout=timeout)
+        if r.status_code == 304 and cached:
+            return cached[1]
+        if not r.ok:
+            return None
+
+        data = r.json()
+        etag = r.headers.get("ETag")
+        if etag:
+            _conditional_cache[key] = (etag, data)
+        return data
+
     def get_agents(self):
         """Получить всех агентов."""
         try:
-            r = requests.get(f"{self.base_url}/agents", timeout=10)
-            return r.json() if r.ok else []
+            data = self._get_conditional("/agents")
+            return data if data is not None else []
         except Exception as e:
             st.error(f"Ошибка получения агентов: {e}")
             return []
 
-    def create_agent(self, name, personality):
+    def create_agent(self, name, personality, location=None):
+        params = {"name": name, "personality": personality}
+        if location:
+            params["location"] = location
         try:
             r = requests.post(
                 f"{self.base_url}/agents",
-                params={"name": name, "personality": personality},
+                params=params,
                 timeout=30,
             )
             return r.json() if r.ok else None
@@ -39,6 +70,22 @@ class API:
             st.error(f"Ошибка отправки сообщения агенту: {e}")
             return None
 
+    def stream_message(self, agent_id, message, read_timeout=60):
+        """
+        Отправить сообщение агенту и получать ответ по мере генерации.
+
+        Генератор выдаёт пары (event, data): token {"text"} на каждый кусок,
+        в конце done - то же, что возвращает send_message.
+        """
+        with requests.post(
+            f"{self.base_url}/agents/{agent_id}/message/stream",
+            params={"message": message},
+            stream=True,
+            timeout=(5, read_timeout),
+        ) as r:
+            r.raise_for_status()
+            yield from _iter_sse(r)
+
     def add_event(self, text):
         try:
             r = requests.post(
@@ -53,26 +100,38 @@ class API:
 
     def get_events(self, limit=50):
         try:
-            r = requests.get(f"{self.base_url}/events", params={"limit": limit}, timeout=10)
-            return r.json() if r.ok else []
+            data = self._get_conditional("/events", params={"limit": limit})
+            return data if data is not None else []
         except Exception as e:
             st.error(f"Ошибка получения событий: {e}")
             return []
 
     def get_graph(self):
         try:
-            r = requests.get(f"{self.base_url}/graph", timeout=10)
-            return r.json() if r.ok else {"nodes": [], "edges": []}
+            data = self._get_conditional("/graph")
+            return data if data is not None else {"nodes": [], "edges": []}
         except Exception as e:
             st.error(f"Ошибка получения графа: {e}")
             return {"nodes": [], "edges": []}
 
-    def get_chat_messages(self, limit=50):
-        """Получить сообщения из общего чата."""
+    def get_chat_rooms(self):
+        """Комнаты чата (локации) с числом агентов и сообщений."""
+        try:
+            r = requests.get(f"{self.base_url}/chat/rooms", timeout=10)
+            return r.json().get("rooms", []) if r.ok else []
+        except Exception as e:
+            st.error(f"Ошибка получения комнат чата: {e}")
+            return []
+
+    def get_chat_messages(self, limit=50, cursor=None, room=None):
+        """Получить сообщения комнаты (с cursor - только новые)."""
+        params = {"limit": limit}
+        if cursor is not None:
+            params["cursor"] = cursor
         try:
             r = requests.get(
-                f"{self.base_url}/chat/messages",
-                params={"limit": limit},
+                f"{self.base_url}{_chat_path(room, 'messages')}",
+                params=params,
                 timeout=10,
             )
             return r.json() if r.ok else {"messages": [], "total": 0}
@@ -80,11 +139,28 @@ class API:
             st.error(f"Ошибка получения сообщений чата: {e}")
             return {"messages": [], "total": 0}
 
-    def get_chat_status(self):
-        """Получить статус фонового общения."""
+    def stream_chat(self, cursor=None, read_timeout=30, room=None):
+        """
+        Подписаться на /chat/{room}/stream (SSE) и отдавать события по мере прихода.
+
+        Генератор выдаёт пары (event, data). Сервер шлёт keep-alive каждые
+        15 с, поэтому read_timeout срабатывает только при потере связи.
+        """
+        params = {} if cursor is None else {"cursor": cursor}
+        with requests.get(
+            f"{self.base_url}{_chat_path(room, 'stream')}",
+            params=params,
+            stream=True,
+            timeout=(5, read_timeout),
+        ) as r:
+            r.raise_for_status()
+            yield from _iter_sse(r)
+
+    def get_chat_status(self, room=None):
+        """Получить статус комнаты и фонового общения."""
         try:
-            r = requests.get(f"{self.base_url}/chat/status", timeout=10)
-            return r.json() if r.ok else {
+            data = self._get_conditional(_chat_path(room, "status"))
+            return data if data is not None else {
                 "background_running": False,
                 "messages_count": 0,
                 "agents_active": 0,
@@ -113,11 +189,11 @@ class API:
             st.error(f"Ошибка отправки: {e}")
             return None
 
-    def user_send_to_chat(self, message, user_name="Пользователь"):
-        """Пользователь отправляет сообщение в чат."""
+    def user_send_to_chat(self, message, user_name="Пользователь", room=None):
+        """Пользователь отправляет сообщение в комнату."""
         try:
             r = requests.post(
-                f"{self.base_url}/chat/user",
+                f"{self.base_url}{_chat_path(room, 'user')}",
                 params={"message": message, "user_name": user_name},
                 timeout=30,
             )
@@ -129,10 +205,10 @@ class API:
             st.error(f"Ошибка отправки: {e}")
             return None
 
-    def clear_chat(self):
-        """Очистить историю чата."""
+    def clear_chat(self, room=None):
+        """Очистить историю комнаты."""
         try:
-            r = requests.post(f"{self.base_url}/chat/clear", timeout=10)
+            r = requests.post(f"{self.base_url}{_chat_path(room, 'clear')}", timeout=10)
             return r.ok
         except Exception as e:
             st.error(f"Ошибка очистки чата: {e}")
@@ -156,6 +232,28 @@ class API:
             st.error(f"Ошибка остановки фонового чата: {e}")
             return False
 
+    def fast_forward_chat(self, hours):
+        """Перемотать симуляцию на hours часов (0 - отменить перемотку)."""
+        try:
+            r = requests.post(f"{self.base_url}/chat/fast-forward", params={"hours": hours}, timeout=10)
+            return r.ok
+        except Exception as e:
+            st.error(f"Ошибка перемотки: {e}")
+            return False
+
+    def move_agent(self, agent_id, location):
+        """Перевести агента в другую локацию (комнату чата)."""
+        try:
+            r = requests.post(
+                f"{self.base_url}/agents/{agent_id}/move",
+                params={"location": location},
+                timeout=10,
+            )
+            return r.ok
+        except Exception as e:
+            st.error(f"Ошибка перемещения агента: {e}")
+            return False
+
     def delete_agent(self, agent_id: str):
         """Удалить агента."""
         try:
@@ -169,5 +267,29 @@ class API:
             return False
 
 
+def _chat_path(room, action):
+    """/chat/{room}/{action}; без комнаты - старый путь общей зоны"""
+    if not room:
+        return f"/chat/{action}"
+    return f"/chat/{quote(room, safe='')}/{action}"
+
+
+def _iter_sse(response):
+    """Разобрать ответ text/event-stream на пары (event, data)"""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            # Пустая строка завершает событие
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+
 def get_api():
     return API()
@@ -21,9 +21,10 @@ with st.sidebar:
     name = st.text_input("Имя", "Алиса")
     personality = st.selectbox("Характер",
                                ["дружелюбный", "задумчивый", "энергичный", "спокойный", "саркастичный", "любопытный"])
+    location = st.text_input("Локация", "общая зона")
 
     if st.button("✨ Создать агента"):
-        api.create_agent(name, personality)
+        api.create_agent(name, personality, location)
         st.rerun()
 
     st.divider()
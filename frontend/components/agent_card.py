@@ -3,6 +3,30 @@ import streamlit as st
 from .chat_history import render_chat_history
 
 
+def stream_reply(agent, message, api):
+    """Показывать ответ агента по мере генерации; без потока - обычный запрос"""
+    placeholder = st.empty()
+    placeholder.caption("🤔 Агент думает...")
+    text = ""
+    try:
+        for event, data in api.stream_message(agent["id"], message):
+            if event == "token":
+                text += data.get("text", "")
+                placeholder.info(f"Ответ: {text}▌")
+            elif event == "done":
+                placeholder.success(f"Ответ: {data.get('reply', text)}")
+                return
+    except Exception:
+        if not text:
+            # Поток недоступен - обычный запрос
+            with st.spinner("🤔 Агент думает..."):
+                resp = api.send_message(agent["id"], message)
+            if resp:
+                placeholder.success(f"Ответ: {resp.get('reply', '')}")
+            return
+    placeholder.warning(f"Ответ оборвался: {text}")
+
+
 def agent_card(agent, api):
     with st.container():
         col1, col2 = st.columns([1, 3])
@@ -20,6 +44,8 @@ def agent_card(agent, api):
             st.caption(f"🎭 {agent['personality']}")
             st.caption(f"📍 {agent.get('location', 'общая зона')}")
             st.caption(f"😊 Настроение: {agent['mood']:.2f}")
+            if "pleasure" in agent:
+                st.caption(f"💓 {agent['pleasure']:.2f} · ⚡ {agent['arousal']:.2f}")
 
         tab1, tab2, tab3 = st.tabs(["💬 Чат", "📜 История", "⚙️ Управление"])
 
@@ -27,10 +53,7 @@ def agent_card(agent, api):
             msg = st.text_input("Сообщение", key=f"msg_{agent['id']}")
             if st.button("Отправить", key=f"btn_{agent['id']}"):
                 if msg.strip():
-                    with st.spinner("🤔 Агент думает..."):
-                        resp = api.send_message(agent["id"], msg.strip())
-                    if resp:
-                        st.success(f"Ответ: {resp.get('reply', '')}")
+                    stream_reply(agent, msg.strip(), api)
                 else:
                     st.warning("Введите сообщение")
 
@@ -38,6 +61,11 @@ def agent_card(agent, api):
             render_chat_history(agent["id"], agent["name"], api)
 
         with tab3:
+            location = st.text_input("Локация", agent.get("location", "общая зона"), key=f"location_{agent['id']}")
+            if st.button("🚶 Перейти", key=f"move_{agent['id']}"):
+                if location.strip() and api.move_agent(agent["id"], location.strip()):
+                    st.rerun()
+
             st.markdown("**Опасная зона**")
             if st.button(f"🗑️ Удалить {agent['name']}", key=f"delete_{agent['id']}"):
                 if api.delete_agent(agent["id"]):
@@ -1,5 +1,8 @@
+import time
+from contextlib import closing
 from datetime import datetime
 
+import requests
 import streamlit as st
 
 try:
@@ -9,26 +12,34 @@ except ImportError:
 
 
 AUTO_REFRESH_INTERVAL_MS = 3000
+CHAT_LIMIT = 100
+# Сколько секунд за один прогон скрипта слушаем стрим (меньше интервала автообновления)
+STREAM_WINDOW = 2.5
 
 
 def render_chat_room(api):
-    """Общая комната чата с рабочим автообновлением."""
+    """Комнаты чата (по локациям агентов) с рабочим автообновлением."""
 
-    st.markdown("## 💬 Общий чат агентов")
-    st.caption("Агенты общаются сами по себе. Вы можете вмешаться в любой момент!")
+    st.markdown("## 💬 Чат агентов")
+    st.caption("Агенты общаются сами по себе в своих локациях. Вы можете вмешаться в любой момент!")
 
-    status = api.get_chat_status()
+    room = select_room(api)
+
+    status = api.get_chat_status(room)
     running = bool(status.get("background_running", False))
     agents_count = status.get("agents_active", 0)
     messages_count = status.get("messages_count", 0)
+    fast_forward_until = status.get("fast_forward_until")
 
-    col1, col2, col3, col4, col5 = st.columns([2, 1, 1, 1, 1])
+    col1, col2, col3, col4, col5, col6 = st.columns([2, 1, 1, 1, 1, 1])
 
     with col1:
         state_icon = "🟢" if running else "⚪"
         state_text = "запущен" if running else "остановлен"
         st.markdown(f"**{state_icon} Чат {state_text}**")
         st.caption(f"Агентов: {agents_count} · Сообщений: {messages_count}")
+        if fast_forward_until:
+            st.caption(f"⏩ Перемотка: {status.get('simulation_clock', '')[11:16]} → {fast_forward_until[11:16]}")
 
     with col2:
         if st.button("▶️ Запустить", disabled=running, use_container_width=True):
@@ -42,13 +53,24 @@ def render_chat_room(api):
 
     with col4:
         if st.button("🧹 Очистить", use_container_width=True):
-            if api.clear_chat():
+            if api.clear_chat(room):
+                reset_chat_cache()
                 st.rerun()
 
     with col5:
-        auto_refresh = st.checkbox("Автообновление", value=True)
+        if fast_forward_until:
+            if st.button("⏹️ Без перемотки", use_container_width=True):
+                if api.fast_forward_chat(0):
+                    st.rerun()
+        elif st.button("⏩ Ночь", help="Прокрутить 8 часов симуляции так быстро, как позволяет LLM",
+                       use_container_width=True):
+            if api.fast_forward_chat(8):
+                st.rerun()
 
-    if auto_refresh:
+    with col6:
+        live = st.checkbox("Автообновление", value=True)
+
+    if live:
         if st_autorefresh is not None:
             st_autorefresh(interval=AUTO_REFRESH_INTERVAL_MS, key="chat_autorefresh")
         else:
@@ -58,8 +80,7 @@ def render_chat_room(api):
             )
 
     try:
-        response = api.get_chat_messages(limit=100)
-        messages = response.get("messages", [])
+        messages = load_chat_messages(api, room)
     except Exception:
         messages = []
         st.error("Не удалось загрузить сообщения чата")
@@ -79,9 +100,91 @@ def render_chat_room(api):
     if user_message:
         text = user_message.strip()
         if text:
-            api.user_send_to_chat(text, "Пользователь")
+            api.user_send_to_chat(text, "Пользователь", room)
             st.rerun()
 
+    if live:
+        # Последним и ненадолго: дальше страницу (и другие вкладки) перезапускает st_autorefresh
+        listen_chat_stream(api, chat_container, room)
+
+
+def select_room(api):
+    """Выбор комнаты; при смене комнаты накопленные сообщения сбрасываются."""
+    rooms = api.get_chat_rooms()
+    names = [r["name"] for r in rooms] or ["общая зона"]
+    labels = {r["name"]: f"{r['name']} ({r['agents']} аг.)" for r in rooms}
+
+    current = st.session_state.get("chat_room")
+    room = st.selectbox(
+        "Комната",
+        names,
+        index=names.index(current) if current in names else 0,
+        format_func=lambda name: labels.get(name, name),
+    )
+    if room != current:
+        reset_chat_cache()
+        st.session_state["chat_room"] = room
+    return room
+
+
+def load_chat_messages(api, room):
+    """Догрузить только новые сообщения; уже полученные лежат в session_state."""
+    cached = st.session_state.get("chat_messages", [])
+    cursor = st.session_state.get("chat_cursor")
+
+    response = api.get_chat_messages(limit=CHAT_LIMIT, cursor=cursor, room=room)
+    if "cursor" not in response:
+        # Бэкенд не ответил - показываем то, что уже есть
+        return cached
+    new_messages = response.get("messages", [])
+
+    if response.get("total", 0) == 0:
+        # Чат очистили (возможно, из другой вкладки)
+        cached = []
+    else:
+        cached = (cached + new_messages)[-CHAT_LIMIT:]
+
+    st.session_state["chat_messages"] = cached
+    st.session_state["chat_cursor"] = response["cursor"]
+    return cached
+
+
+def listen_chat_stream(api, chat_container, room, window=STREAM_WINDOW):
+    """
+    Дорисовывать новые сообщения из /chat/{room}/stream по мере прихода,
+    но не дольше window секунд: скрипт должен закончиться, чтобы
+    st_autorefresh перезапустил страницу, а поток сервера освободился.
+    """
+    deadline = time.monotonic() + window
+    stream = api.stream_chat(cursor=st.session_state.get("chat_cursor"), room=room, read_timeout=window)
+    try:
+        # closing: соединение закрывается сразу при выходе, а не когда соберут генератор
+        with closing(stream):
+            for event, data in stream:
+                if event == "clear":
+                    reset_chat_cache()
+                    st.rerun()
+
+                if event == "message":
+                    cached = st.session_state.get("chat_messages", [])
+                    st.session_state["chat_messages"] = (cached + [data])[-CHAT_LIMIT:]
+                    st.session_state["chat_cursor"] = data["seq"]
+
+                    with chat_container:
+                        render_chat_message(data)
+
+                if time.monotonic() >= deadline:
+                    return
+    except requests.RequestException:
+        # Тишина дольше окна (read timeout) или бэкенд недоступен - догоним на следующем прогоне
+        return
+
+
+def reset_chat_cache():
+    """Забыть накопленные сообщения - следующая загрузка будет полной."""
+    st.session_state.pop("chat_messages", None)
+    st.session_state.pop("chat_cursor", None)
+
 
 def render_chat_message(msg):
     """Отрисовать одно сообщение."""
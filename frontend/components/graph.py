@@ -7,18 +7,52 @@ def render_graph(graph_data):
         st.info("Нет агентов для отображения")
         return
 
+    nodes = graph_data['nodes']
+    # Позиции считает бэкенд; у старого бэкенда их нет - ставим в линию
+    positions = {
+        n['id']: (n.get('x', i), n.get('y', 1))
+        for i, n in enumerate(nodes)
+    }
+
     fig = go.Figure()
 
-    # Узлы
+    # Рёбра: кто с кем разговаривал (одна линия на пару, разрывы через None)
+    edge_x, edge_y = [], []
+    for edge in graph_data.get('edges', []):
+        if edge['source'] not in positions or edge['target'] not in positions:
+            continue
+        (x0, y0), (x1, y1) = positions[edge['source']], positions[edge['target']]
+        edge_x += [x0, x1, None]
+        edge_y += [y0, y1, None]
+    if edge_x:
+        fig.add_trace(go.Scatter(
+            x=edge_x,
+            y=edge_y,
+            mode='lines',
+            line=dict(width=1, color='#999'),
+            hoverinfo='skip'
+        ))
+
+    # Узлы: цвет - настроение, размер - сколько агент общается
     fig.add_trace(go.Scatter(
-        x=[i for i in range(len(graph_data['nodes']))],
-        y=[1] * len(graph_data['nodes']),
+        x=[positions[n['id']][0] for n in nodes],
+        y=[positions[n['id']][1] for n in nodes],
         mode='markers+text',
-        text=[n['name'] for n in graph_data['nodes']],
+        text=[n['name'] for n in nodes],
+        textposition='top center',
+        hovertext=[
+            f"{n['name']} ({n.get('location', '')})<br>"
+            f"собеседников: {n.get('degree', 0)}, ответов: {n.get('strength', 0)}<br>"
+            f"сообщество: {n['community'] if n.get('community', -1) >= 0 else '-'}"
+            for n in nodes
+        ],
+        hoverinfo='text',
         marker=dict(
-            size=30,
-            color=[n.get('mood', 0.5) for n in graph_data['nodes']],
+            size=[20 + min(n.get('strength', 0), 30) for n in nodes],
+            color=[n.get('mood', 0.5) for n in nodes],
             colorscale='RdYlGn',
+            cmin=0,
+            cmax=1,
             showscale=True
         )
     ))
@@ -26,7 +60,16 @@ def render_graph(graph_data):
     fig.update_layout(
         title="Агенты",
         showlegend=False,
-        height=400
+        height=500,
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False)
     )
 
-    st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
+    st.plotly_chart(fig, use_container_width=True)
+
+    metrics = graph_data.get('metrics')
+    if metrics:
+        st.caption(
+            f"Связей: {metrics['edges']} · ответов: {metrics['interactions']} · "
+            f"плотность: {metrics['density']} · сообществ: {metrics['communities']}"
+        )